@@ -1,30 +1,44 @@
 # app.py
 import datetime
+import json
+import multiprocessing
 import sys
 import uuid
 import os
 import requests
 import qrcode
 from PIL import Image, ImageDraw, ImageEnhance
-from flask import Flask, jsonify, request, send_from_directory, render_template
+from flask import Flask, Response, jsonify, redirect, request, send_from_directory, render_template
 from flask_cors import CORS
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import time
 from utils.logging import setup_logging
 from utils.file_handling import save_uploaded_files, cleanup_files, allowed_file, save_file
-from utils.image_processing import get_frame_type, get_frame_size, calc_positions, paste_image, fit_cover_image
-from utils.video_processing import process_video_task, process_fast_video_task, convert_webm_to_mp4
+from utils.image_compositor import compose_print_image
+from utils.image_encoder import encode_image_profiles, PROFILE_PRINT, PROFILE_WEB
+from utils.frame_layout import get_frame_layout
+from utils.video_processing import process_video_outputs_task, convert_webm_to_mp4
+from utils.video_encoder import ENCODER_BACKENDS
+from utils.ffmpeg_compositor import RENDER_ENGINES
 from utils.filters import apply_filter_to_image
+from utils.image_pipeline import prepare_slot_tiles
+from utils.render_jobs import (
+    render_jobs, QueueFullError, JOB_DONE, JOB_FAILED, FINISHED_STATES, LANE_IMAGE, LANE_VIDEO_SHORT, LANE_VIDEO_LONG
+)
+from utils.template_cache import get_template_image, template_cache
+from utils.template_registry import register_template, get_template, delete_template
+from utils.transcode_cache import transcode_cache
 from utils.performance import performance_monitor, log_system_stats
-from utils.upload import upload_image_to_host, cleanup_local_video_file
+from utils.upload import cleanup_local_video_file
+from utils.circuit_breaker import upload_breaker, CIRCUIT_BREAKERS
+from utils.media_session import update_media_session, pending_updates, media_session_stats
+from utils.upload_queue import upload_queue, KIND_IMAGE, KIND_VIDEO
 from utils.print_utils import print_image, get_local_ip, _download_and_save_image
-from utils.video_standardizer import standardize_video, standardize_videos_in_batch
+from utils.video_standardizer import standardize_videos_in_batch
 from config import (
     PRINT_SERVER_IP, UPLOAD_FOLDER, OUTPUT_FOLDER, FRAME_TYPES, FRAME_MARGINS, FRAME_GAPS, 
-    GAP_DEFAULT, GAP_PROCESSING, VIDEO_FPS, FAST_VIDEO_DURATION, 
-    MAX_PROCESSING_WORKERS, MAX_UPLOAD_WORKERS, PROCESSING_TIMEOUT, 
+    GAP_DEFAULT, GAP_PROCESSING, VIDEO_FPS, FAST_VIDEO_DURATION, VIDEO_ENCODER_BACKEND, VIDEO_RENDER_ENGINE,
+    MAX_PROCESSING_WORKERS, MAX_UPLOAD_WORKERS, PROCESSING_TIMEOUT, RENDER_QUEUE_SIZE,
     UPLOAD_TIMEOUT, URL_MAIN, URL_FRONTEND, FRAME_TYPE_DESCRIPTIONS, 
-    get_frame_gap, get_frame_margin, get_print_margin, MAX_INPUT_IMAGE_SIZE,
     get_daily_folder, 
 )
 
@@ -59,26 +73,8 @@ def log_response_info(response):
 # Thêm cache cho QR code
 qr_cache = {}
 
-# Cache cho upload để tránh upload cùng file nhiều lần
-upload_cache = {}
-
 def cleanup_old_cache():
-    """Cleanup cache entries older than 1 hour"""
-    current_time = time.time()
-    keys_to_remove = []
-    
-    for key in upload_cache:
-        # Extract timestamp from cache key
-        try:
-            timestamp = float(key.split('_')[-1])
-            if current_time - timestamp > 3600:  # 1 hour
-                keys_to_remove.append(key)
-        except (ValueError, IndexError):
-            continue
-    
-    for key in keys_to_remove:
-        del upload_cache[key]
-    
+    """Cleanup in-memory caches that grow per session"""
     # Cleanup QR cache if it gets too large
     if len(qr_cache) > 100:
         qr_cache.clear()
@@ -95,127 +91,182 @@ def get_qr_code(url, size=(200, 200)):
     qr_cache[url] = qr_img
     return qr_img
 
-def update_media_session(media_session_code, image_url=None, video_url=None, fast_video_url=None):
-    if not media_session_code:
-        logger.warning("No media session code provided")
-        return False
-    
-    update_url = f"{URL_FRONTEND}/api/media-session"
-    update_data = {"sessionCode": media_session_code}
-    if image_url:
-        update_data["imageUrl"] = image_url
-    if video_url:
-        update_data["videoUrl"] = video_url
-    if fast_video_url:
-        update_data["gifUrl"] = fast_video_url
-    
-    try:
-        response = requests.put(update_url, json=update_data)
-        if response.status_code == 200:
-            logger.info(f"Media session updated: {response.json()}")
-            return True
-        logger.error(f"Failed to update media session: {response.status_code}, {response.text}")
-        return False
-    except Exception as e:
-        logger.error(f"Error updating media session: {str(e)}")
-        return False
-
 @performance_monitor
-def process_image_task(frame_type, image_files, positions, photo_width, photo_height, background_img, overlay_img, total_width, total_height, unique_id, media_session_code=None, filter_id=None):
+def process_image_task(layout, image_files, background_img, overlay_img, unique_id, media_session_code=None, filter_id=None):
     try:
         # Cleanup old cache entries periodically
         cleanup_old_cache()
         
         # Sử dụng daily folder để lưu file
         daily_output_folder = get_daily_folder(OUTPUT_FOLDER)
-        image_output_file = os.path.join(daily_output_folder, f"photobooth_result_{unique_id}.jpg")
-        total_slots = frame_type["columns"] * frame_type["rows"]
-        output_width = total_width * 2 if frame_type["isCustom"] and frame_type["columns"] == 1 else total_width
-        output_height = total_height
-
-        frame = Image.new("RGBA", (total_width, total_height), (255, 255, 255, 255))
-        if background_img:
-            frame.paste(background_img, (0, 0))
-        
-        # Xử lý ảnh song song thay vì tuần tự
-        processed_images = []
-        for file in image_files[:total_slots]:
-            img = Image.open(file).convert("RGBA")
-            # Giảm kích thước ảnh trước khi apply filter để tăng tốc
-            if img.width > MAX_INPUT_IMAGE_SIZE or img.height > MAX_INPUT_IMAGE_SIZE:
-                img.thumbnail((MAX_INPUT_IMAGE_SIZE, MAX_INPUT_IMAGE_SIZE), Image.Resampling.BICUBIC)
-            
-            if filter_id and filter_id != 'none':
-                img = apply_filter_to_image(img, filter_id)
-            processed_images.append(img)
-        
-        for img, pos in zip(processed_images, positions):
-            frame = paste_image(frame, img, pos, (photo_width, photo_height), frame_type.get("isCircle", False), frame_type)
-        
-        if overlay_img:
-            frame.paste(overlay_img, (0, 0), overlay_img)
-        
-        # Thêm QR code trước khi tạo ảnh kép cho frame isCustom
+        output_base = os.path.join(daily_output_folder, f"photobooth_result_{unique_id}")
+
+        # Decode + filter + resize/crop các slot song song, bước composite chỉ dán tile đã sẵn sàng
+        processed_images = prepare_slot_tiles(image_files[:layout.slot_count], layout.slot_size,
+                                              layout.is_circle, layout.slot_crop_top, filter_id)
+        
+        # QR code được dán vào từng dải (vị trí tính sẵn trong layout)
+        qr_img = None
         if media_session_code:
             qr_url = f"{URL_FRONTEND}/session/{media_session_code}"
-            qr_img = get_qr_code(qr_url, (180, 180))  # Giảm kích thước QR
-            margin = 160 if frame_type["isCustom"] and frame_type["rows"] == 4 else 80
-            
-            # Với frame isCustom, thêm QR vào frame gốc trước khi ghép đôi
-            if frame_type["isCustom"] and frame_type["columns"] == 1:
-                x_pos = total_width - 180 - margin
-                y_pos = total_height - 180 - margin
-                frame.paste(qr_img, (x_pos, y_pos))
-            else:
-                # Frame thường, sử dụng output_width
-                x_pos = output_width - 180 - margin
-                y_pos = output_height - 180 - margin
-                frame.paste(qr_img, (x_pos, y_pos))
-        
-        # Tạo ảnh kép cho frame isCustom sau khi đã thêm QR code
-        if frame_type["isCustom"] and frame_type["columns"] == 1:
-            # Tạo ảnh kép với kích thước gấp đôi chiều rộng
-            doubled_frame = Image.new("RGB", (output_width, output_height), (255, 255, 255))
-            frame_rgb = frame.convert("RGB")
-            doubled_frame.paste(frame_rgb, (0, 0))
-            doubled_frame.paste(frame_rgb, (total_width, 0))
-            doubled_frame.save(image_output_file, "JPEG", quality=100, optimize=True, subsampling=0, progressive=False)
-        else:
-            # Frame thường, lưu trực tiếp
-            frame.convert("RGB").save(image_output_file, "JPEG", quality=100, optimize=True, subsampling=0, progressive=False)
-        
-        # Upload ảnh lên host để lưu trữ
-        if os.path.exists(image_output_file):
-            try:
-                # Sử dụng cache để tránh upload cùng file nhiều lần
-                file_hash = f"{os.path.basename(image_output_file)}_{os.path.getmtime(image_output_file)}"
-                if file_hash not in upload_cache:
-                    uploaded_url = upload_image_to_host(image_output_file)
-                    if uploaded_url:
-                        upload_cache[file_hash] = uploaded_url
-                        logger.info(f"Image uploaded and cached: {uploaded_url}")
-                else:
-                    uploaded_url = upload_cache[file_hash]
-                    logger.info(f"Using cached upload URL: {uploaded_url}")
-                
-                if uploaded_url and media_session_code:
-                    # Cập nhật media session với URL đã upload
-                    update_media_session(media_session_code, image_url=uploaded_url)
-                    cleanup_files([image_output_file])  # Xoá file local sau khi upload thành công
-                    logger.info(f"Media session updated with URL: {uploaded_url}")
-                
-                return uploaded_url
-                
-            except Exception as e:
-                logger.warning(f"Failed to upload image to host: {e}")
-        
-        return uploaded_url
+            qr_img = get_qr_code(qr_url, (layout.qr_size, layout.qr_size))
+        
+        # Canvas RGB kích thước output; frame isCustom được ghép thẳng thành ảnh kép
+        frame = compose_print_image(layout, processed_images, background_img, overlay_img, qr_img)
+        # Bản in (master) và bản chia sẻ encode từ cùng canvas
+        outputs = encode_image_profiles(frame, output_base)
+        del frame, processed_images  # Giải phóng canvas trước khi upload
+        
+        print_file = outputs[PROFILE_PRINT]["path"]
+        share_file = outputs[PROFILE_WEB]["path"]
+        # Bản chia sẻ được upload nền (hàng đợi upload), bản in giữ lại trên máy để in
+        upload_task = upload_queue.enqueue(share_file, KIND_IMAGE, media_session_code, "image_url")
+        local_image_url = f"{URL_MAIN}/outputs/{os.path.basename(share_file)}"
+        if media_session_code and upload_breaker.is_open:
+            # Upload host đang lỗi: khách dùng tạm URL local, upload xong sẽ cập nhật URL trên host
+            update_media_session(media_session_code, image_url=local_image_url, created_at=upload_task["created_at"])
+        return {
+            "image": local_image_url,
+            "share_url": upload_task["url"],  # URL trên host, có sau khi upload nền xong (xem attach_share_urls)
+            "print_image": f"{URL_MAIN}/outputs/{os.path.basename(print_file)}",
+            "upload_id": upload_task["task_id"],
+            "outputs": {name: {key: value for key, value in output.items() if key != "path"} for name, output in outputs.items()},
+        }
     except Exception as e:
         logger.error(f"Error in image processing: {str(e)}")
         return None
 
-@app.route('/api/process-image', methods=['POST'])
-def process_image():
+def on_upload_complete(task):
+    """Upload nền xong: cập nhật media session bằng URL trên host"""
+    if task["media_session_code"] and task["session_field"]:
+        # created_at của task: URL của lần render cũ upload xong muộn không ghi đè URL mới hơn
+        update_media_session(task["media_session_code"], created_at=task["created_at"], **{task["session_field"]: task["url"]})
+
+upload_queue.on_complete = on_upload_complete
+
+def attach_share_urls(result, timeout=0):
+    """
+    Điền URL chia sẻ trên host (khách mở được từ điện thoại) vào kết quả render theo trạng thái hàng đợi
+    upload: share_url cho ảnh (upload_id), share_urls cho video (uploads). Còn None khi upload chưa xong.
+    timeout > 0 thì chờ upload tối đa timeout giây (không chờ khi upload host đang lỗi).
+    """
+    if not isinstance(result, dict) or not (result.get("upload_id") or result.get("uploads")):
+        return result
+    result = dict(result)
+    deadline = time.time() + (0 if upload_breaker.is_open else timeout)
+    
+    def resolve(task_id):
+        task = upload_queue.wait(task_id, max(0, deadline - time.time()))
+        return task["url"] if task else None
+    
+    if result.get("upload_id"):
+        result["share_url"] = result.get("share_url") or resolve(result["upload_id"])
+    if result.get("uploads"):
+        result["share_urls"] = {task_type: resolve(task_id) for task_type, task_id in result["uploads"].items()}
+    return result
+
+def job_with_share_urls(job):
+    if job and job.get("result"):
+        job = {**job, "result": attach_share_urls(job["result"])}
+    return job
+
+def resolve_request_template():
+    """
+    Lấy background/overlay cho request render: template_id đã đăng ký (không cần upload lại file)
+    hoặc file background/overlay gửi kèm như trước.
+
+    Returns:
+        tuple: (template, background_file, overlay_file) - template là None nếu không dùng template_id,
+            False nếu template_id không tồn tại
+    """
+    template_id = request.form.get('template_id')
+    if not template_id:
+        return None, request.files.get('background'), request.files.get('overlay')
+    template = get_template(template_id)
+    return (template if template else False), None, None
+
+@app.route('/api/templates', methods=['POST'])
+def create_template():
+    """
+    Đăng ký background/overlay một lần, trả về template_id dùng cho process-image / process-video.
+    frame_types (vd. "1,5") và warm_scales ("print,video", mặc định cả hai): biến thể được chuẩn bị sẵn ở nền.
+    """
+    try:
+        frame_types = [frame_id.strip() for frame_id in request.form.get('frame_types', '').split(',') if frame_id.strip()]
+        warm_scales = [scale.strip() for scale in request.form.get('warm_scales', 'print,video').split(',') if scale.strip()]
+        template = register_template(request.files.get('background'), request.files.get('overlay'), request.form.get('name'),
+                                     warm_frame_types=frame_types, warm_scales=warm_scales)
+        return jsonify({"success": True, **template}), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"[TEMPLATE API] Error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/templates/<template_id>', methods=['GET'])
+def get_template_info(template_id):
+    template = get_template(template_id)
+    if not template:
+        return jsonify({"error": "Template not found"}), 404
+    return jsonify({key: value for key, value in template.items() if not key.endswith('_path')})
+
+@app.route('/api/templates/<template_id>', methods=['DELETE'])
+def remove_template(template_id):
+    if not delete_template(template_id):
+        return jsonify({"error": "Template not found"}), 404
+    return jsonify({"success": True}), 200
+
+def run_image_job(layout, image_files, background_img, overlay_img, media_session_code, filter_id, saved_files):
+    """Job render ảnh chạy trên executor dùng chung, tự dọn file upload khi xong"""
+    try:
+        image_result = process_image_task(
+            layout, image_files, background_img, overlay_img, str(uuid.uuid4()), media_session_code, filter_id
+        )
+        print(f"Image output: {image_result}")
+        if not image_result or not image_result['image']:
+            raise RuntimeError("Image processing failed")
+        # image: bản chia sẻ phục vụ từ /outputs (URL_MAIN), share_url: bản đó trên host khi upload nền xong,
+        # print_image: bản in gốc phục vụ từ /outputs
+        return image_result
+    finally:
+        cleanup_files(saved_files)
+        cleanup_files(image_files)
+
+def get_booth_id():
+    """
+    Booth gửi request: header X-Booth-Id hoặc field booth_id nếu booth tự khai báo,
+    không thì theo IP client (mỗi booth một máy trong LAN).
+    """
+    booth_id = request.headers.get('X-Booth-Id') or request.values.get('booth_id')
+    if not booth_id:
+        forwarded_for = request.environ.get('HTTP_X_FORWARDED_FOR', '')
+        booth_id = forwarded_for.split(',')[0].strip() or request.environ.get('REMOTE_ADDR')
+    return (booth_id or "default")[:64]
+
+def render_job_response(job, async_job):
+    """
+    async_job: trả về 202 + job_id ngay. Ngược lại chờ job xong tối đa PROCESSING_TIMEOUT
+    (giữ nguyên hành vi của endpoint đồng bộ cũ), quá hạn thì trả 504 kèm job_id để polling tiếp.
+    """
+    links = {"status_url": f"/api/jobs/{job['job_id']}", "events_url": f"/api/jobs/{job['job_id']}/events"}
+    if async_job:
+        return jsonify({**job, **links}), 202
+    
+    job = render_jobs.wait_finished(job['job_id'], timeout=PROCESSING_TIMEOUT)
+    if job['status'] == JOB_DONE:
+        # Endpoint đồng bộ trả URL chia sẻ trên host như trước: chờ upload nền tối đa UPLOAD_TIMEOUT
+        return jsonify(attach_share_urls(job['result'], UPLOAD_TIMEOUT)), 200
+    if job['status'] == JOB_FAILED:
+        return jsonify({"error": job['error']}), 500
+    logger.error(f"[RENDER JOB] Timeout after {PROCESSING_TIMEOUT} seconds waiting for job {job['job_id']}")
+    return jsonify({"error": f"Processing timeout after {PROCESSING_TIMEOUT}s", "job_id": job['job_id'], **links}), 504
+
+def queue_full_response(error):
+    response = jsonify({"error": str(error), "queue": render_jobs.stats()})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+def handle_process_image(async_job):
     log_system_stats()  # Log system stats trước khi xử lý
     saved_files = []  # Initialize saved_files to avoid UnboundLocalError
     try:
@@ -223,64 +274,49 @@ def process_image():
         if not frame_type_choice:
             return jsonify({"error": "Missing frame_type parameter"}), 400
         
-        frame_type = get_frame_type(frame_type_choice)
-        total_width, total_height = get_frame_size(frame_type)
+        layout = get_frame_layout(frame_type_choice)  # Layout in đã tính sẵn cho frame type
         media_session_code = request.form.get('mediaSessionCode')
         filter_id = request.form.get('filter_id', 'none')
         files = request.files.getlist('files')
-        background_file = request.files.get('background')
-        overlay_file = request.files.get('overlay')
+        template, background_file, overlay_file = resolve_request_template()
+        if template is False:
+            return jsonify({"error": "Template not found"}), 404
         
         # Save files and update saved_files
         image_files, background_path, overlay_path, saved_files = save_uploaded_files(files, background_file, overlay_file)
+        if template:
+            background_path, overlay_path = template["background_path"], template["overlay_path"]
         if not image_files:
             cleanup_files(saved_files)
             return jsonify({"error": "No valid image files"}), 400
         
-        margin = get_frame_margin(frame_type_choice)
-        gap = get_frame_gap(frame_type_choice)
-        photo_width, photo_height, positions = calc_positions(frame_type, total_width, total_height, margin, gap)
-        
-        background_img = None
-        overlay_img = None
-        if background_path:
-            background_img = Image.open(background_path).convert("RGB")
-            crop_direction = "top" if frame_type and (
-                (frame_type.get("columns") == 1 and frame_type.get("rows") == 1 and not frame_type.get("isCircle", False)) or
-                (frame_type.get("columns") == 2 and frame_type.get("rows") == 2) or
-                (frame_type.get("columns") == 1 and frame_type.get("rows") == 2 and not frame_type.get("isCustom", False))) else "center"
-            background_img = fit_cover_image(background_img, (total_width, total_height), crop_direction)
-        if overlay_path:
-            overlay_img = Image.open(overlay_path).convert("RGBA")
-            crop_direction = "top" if frame_type and (
-                (frame_type.get("columns") == 1 and frame_type.get("rows") == 1 and not frame_type.get("isCircle", False)) or
-                (frame_type.get("columns") == 2 and frame_type.get("rows") == 2) or
-                (frame_type.get("columns") == 1 and frame_type.get("rows") == 2 and not frame_type.get("isCustom", False))) else "center"
-            overlay_img = fit_cover_image(overlay_img, (total_width, total_height), crop_direction)
-        
-        response_data = {}
-        unique_id = str(uuid.uuid4())
-        with ThreadPoolExecutor(max_workers=MAX_PROCESSING_WORKERS) as executor:
-            future = executor.submit(
-                process_image_task, frame_type, image_files, positions, photo_width, photo_height,
-                background_img, overlay_img, total_width, total_height, unique_id, media_session_code, filter_id
-            )
-            image_output_file = future.result(timeout=PROCESSING_TIMEOUT)
-            print(f"Image output file: {image_output_file}")
-            if image_output_file:
-                response_data['image'] = image_output_file
-            else:
-                cleanup_files(saved_files)
-                return jsonify({"error": "Image processing failed"}), 500
-            
+        # Background/overlay đã fit cover lấy từ template cache (key theo hash nội dung + crop + kích thước)
+        background_img = get_template_image(background_path, "RGB", layout.size, layout.template_crop)
+        overlay_img = get_template_image(overlay_path, "RGBA", layout.size, layout.template_crop)
+        
+        job = render_jobs.submit(
+            "image", run_image_job, layout, image_files, background_img, overlay_img, media_session_code, filter_id, saved_files,
+            lane=LANE_IMAGE, booth_id=get_booth_id()
+        )
+        saved_files = []  # Từ đây job chịu trách nhiệm dọn file
+        return render_job_response(job, async_job)
+    except QueueFullError as e:
         cleanup_files(saved_files)
-        cleanup_files(image_files)
-        return jsonify(response_data), 200
+        logger.warning(f"[IMAGE PROCESSING] Rejected: {str(e)}")
+        return queue_full_response(e)
     except Exception as e:
         cleanup_files(saved_files)
         logger.error(f"[IMAGE PROCESSING] Error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/process-image', methods=['POST'])
+def process_image():
+    return handle_process_image(async_job=False)
+
+@app.route('/api/jobs/process-image', methods=['POST'])
+def submit_image_job():
+    return handle_process_image(async_job=True)
+
 @app.route('/api/convert-video', methods=['POST'])
 def convert_video():
     """
@@ -300,12 +336,9 @@ def convert_video():
                 temp_path = save_file(file, UPLOAD_FOLDER, "temp_")
                 saved_files.append(temp_path)
                 
-                # Convert nếu là WebM
+                # Convert WebM / chuẩn hóa video về h264+aac (một lần encode, có cache)
                 converted_path = convert_webm_to_mp4(temp_path)
                 
-                # Chuẩn hóa video về h264+aac
-                converted_path = standardize_video(converted_path, crf=23, preset="fast")
-                
                 if converted_path != temp_path:
                     saved_files.append(converted_path)
                 
@@ -330,112 +363,163 @@ def convert_video():
         logger.error(f"[VIDEO CONVERT API] Error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/process-video', methods=['POST'])
-def process_video():
+def run_video_job(frame_type, video_files, background_path, overlay_path, total_width, total_height, duration,
+                  upload_to_host, encoder, engine, media_session_code, saved_files):
+    """Job render video (chuẩn hoá + ghép + encode + upload) chạy trên executor dùng chung"""
+    try:
+        # Chuẩn hóa tất cả video (kể cả WebM) về h264+aac: mỗi file probe một lần,
+        # file đã đạt chuẩn được giữ nguyên, kết quả encode lấy từ transcode cache nếu có
+        standardized_files = standardize_videos_in_batch(video_files, preset="fast", crf=23)
+        saved_files.extend(f for f in standardized_files if f not in video_files)
+        video_files = standardized_files
+        
+        # Video thường + fast video (khi duration > 2) dùng chung một lượt decode/composite.
+        # Upload không chạy trong job: file xong là đưa vào hàng đợi upload và trả worker render
+        results = process_video_outputs_task(
+            frame_type, video_files, background_path, overlay_path, total_width, total_height, duration, False, encoder, engine, duration > 2
+        ) or {}
+        
+        rendered_at = time.time()
+        response_data = {}
+        uploads = {}
+        local_urls = {}
+        for task_type, result in results.items():
+            if result:
+                response_data[task_type] = f"/outputs/{os.path.basename(result)}"
+                local_urls[task_type] = f"{URL_MAIN}{response_data[task_type]}"
+                if upload_to_host:
+                    # Media session nhận URL trên host khi upload xong (callback của hàng đợi upload)
+                    session_field = "video_url" if task_type == 'video' else "fast_video_url"
+                    uploads[task_type] = upload_queue.enqueue(
+                        result, KIND_VIDEO, media_session_code, session_field, cleanup=True
+                    )["task_id"]
+        
+        if not response_data:
+            raise RuntimeError("Video processing failed")
+        if uploads:
+            response_data['uploads'] = uploads
+        if media_session_code and (not uploads or upload_breaker.is_open):
+            # Không upload lên host (hoặc upload host đang lỗi): media session dùng URL local
+            update_media_session(media_session_code, video_url=local_urls.get('video'), fast_video_url=local_urls.get('fast_video'),
+                                 created_at=rendered_at)
+        
+        return response_data
+    finally:
+        cleanup_files(saved_files)
+
+def handle_process_video(async_job):
     saved_files = []  # Initialize saved_files to avoid UnboundLocalError
     try:
         frame_type_choice = request.form.get('frame_type')
         if not frame_type_choice:
             return jsonify({"error": "Missing frame_type parameter"}), 400
         
-        frame_type = get_frame_type(frame_type_choice)
-        total_width, total_height = get_frame_size(frame_type)
+        layout = get_frame_layout(frame_type_choice)
+        frame_type = layout.frame_type
+        total_width, total_height = layout.size
         media_session_code = request.form.get('mediaSessionCode')
         duration = int(request.form.get('duration', 2))
         upload_to_host = request.form.get('upload_to_host', 'true').lower() == 'true'  # Tùy chọn upload
         if duration not in [2, 10]:
             return jsonify({"error": "Duration must be 2 or 10 seconds"}), 400
+        encoder = request.form.get('encoder', VIDEO_ENCODER_BACKEND)  # Chọn backend encode để so sánh
+        if encoder not in ENCODER_BACKENDS:
+            return jsonify({"error": f"Encoder must be one of {list(ENCODER_BACKENDS)}"}), 400
+        engine = request.form.get('engine', VIDEO_RENDER_ENGINE)  # Chọn engine render để benchmark
+        if engine not in RENDER_ENGINES:
+            return jsonify({"error": f"Engine must be one of {list(RENDER_ENGINES)}"}), 400
         
         files = request.files.getlist('files')
-        background_file = request.files.get('background')
-        overlay_file = request.files.get('overlay')
+        template, background_file, overlay_file = resolve_request_template()
+        if template is False:
+            return jsonify({"error": "Template not found"}), 404
         
         # Save files and update saved_files
         video_files, background_path, overlay_path, saved_files = save_uploaded_files(files, background_file, overlay_file)
+        if template:
+            background_path, overlay_path = template["background_path"], template["overlay_path"]
         if not video_files:
             cleanup_files(saved_files)
             return jsonify({"error": "No valid video files"}), 400
         
         logger.info(f"[VIDEO PROCESSING] Processing {len(video_files)} video files with frame type: {frame_type_choice}")
-        # Convert WebM files to MP4 for better compatibility
-        converted_files = []
-        for video_file in video_files:
-            converted_file = convert_webm_to_mp4(video_file)
-            if converted_file:
-                converted_files.append(converted_file)
-                saved_files.append(converted_file)
-            else:
-                converted_files.append(video_file)  # Keep original if conversion fails
-        video_files = converted_files
-        
-        # Chuẩn hóa tất cả video về h264+aac
-        video_files = standardize_videos_in_batch(video_files, preset="fast", crf=23)
-        
-        margin = get_frame_margin(frame_type_choice)
-        gap = get_frame_gap(frame_type_choice)
-        photo_width, photo_height, positions = calc_positions(frame_type, total_width, total_height, margin, gap)
-        
-        response_data = {}
-        with ThreadPoolExecutor(max_workers=MAX_PROCESSING_WORKERS) as executor:
-            # Sử dụng OpenCV - đã được optimize và nhanh nhất trong benchmark
-            tasks = [('video', executor.submit(
-                process_video_task, frame_type, video_files, background_path, overlay_path, total_width, total_height, duration, upload_to_host
-            ))]
-            if duration > 2:
-                tasks.append(('fast_video', executor.submit(
-                    process_fast_video_task, frame_type, video_files, background_path, overlay_path, total_width, total_height, duration, upload_to_host
-                )))
-            
-            for task_type, future in tasks:
-                try:
-                    result = future.result(timeout=PROCESSING_TIMEOUT)
-                    if result:
-                        # Nếu result là URL (bắt đầu với http), sử dụng trực tiếp
-                        # Nếu là file path, tạo URL local
-                        if result.startswith('http'):
-                            response_data[task_type] = result
-                        else:
-                            response_data[task_type] = f"/outputs/{os.path.basename(result)}"
-                except TimeoutError:
-                    logger.error(f"[VIDEO PROCESSING] Timeout error for {task_type} after {PROCESSING_TIMEOUT} seconds")
-                    # Continue with other tasks instead of failing completely
-                    continue
-                except Exception as e:
-                    logger.error(f"[VIDEO PROCESSING] Task error for {task_type}: {str(e)}")
-                    continue
-        
-        if not response_data:
-            cleanup_files(saved_files)
-            return jsonify({"error": "Video processing failed"}), 500
-        
-        if media_session_code:
-            # Xử lý video URL
-            video_url = None
-            if 'video' in response_data:
-                video_response = response_data.get('video')
-                if video_response.startswith('http'):
-                    video_url = video_response
-                else:
-                    video_url = f"{URL_MAIN}{video_response}"
-            
-            # Xử lý fast video URL
-            fast_video_url = None
-            if 'fast_video' in response_data:
-                fast_video_response = response_data.get('fast_video')
-                if fast_video_response.startswith('http'):
-                    fast_video_url = fast_video_response
-                else:
-                    fast_video_url = f"{URL_MAIN}{fast_video_response}"
-            
-            update_media_session(media_session_code, video_url=video_url, fast_video_url=fast_video_url)
-        
+        job = render_jobs.submit(
+            "video", run_video_job, frame_type, video_files, background_path, overlay_path, total_width, total_height,
+            duration, upload_to_host, encoder, engine, media_session_code, saved_files,
+            lane=LANE_VIDEO_SHORT if duration <= 2 else LANE_VIDEO_LONG,  # 10s kèm fast video xếp sau video 2s
+            booth_id=get_booth_id()
+        )
+        saved_files = []  # Từ đây job chịu trách nhiệm dọn file
+        return render_job_response(job, async_job)
+    except QueueFullError as e:
         cleanup_files(saved_files)
-        return jsonify(response_data), 200
+        logger.warning(f"[VIDEO PROCESSING] Rejected: {str(e)}")
+        return queue_full_response(e)
     except Exception as e:
         cleanup_files(saved_files)
         logger.error(f"[VIDEO PROCESSING] Error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/process-video', methods=['POST'])
+def process_video():
+    return handle_process_video(async_job=False)
+
+@app.route('/api/jobs/process-video', methods=['POST'])
+def submit_video_job():
+    return handle_process_video(async_job=True)
+
+@app.route('/api/queue', methods=['GET'])
+def get_render_queue():
+    """Độ sâu hàng đợi + ETA cho booth gọi (booth hiển thị thời gian chờ cho khách)"""
+    return jsonify(render_jobs.queue_info(get_booth_id())), 200
+
+@app.route('/api/uploads/<task_id>', methods=['GET'])
+def get_upload_status(task_id):
+    task = upload_queue.get(task_id)
+    if not task:
+        return jsonify({"error": "Upload not found"}), 404
+    task.pop("file_path", None)
+    return jsonify(task), 200
+
+@app.route('/api/circuit-breakers', methods=['GET'])
+def get_circuit_breakers():
+    """Trạng thái circuit breaker của upload host / frontend (staff xem khi khách báo không nhận được ảnh)"""
+    return jsonify({
+        "breakers": {name: breaker.stats() for name, breaker in CIRCUIT_BREAKERS.items()},
+        "pending_media_session_updates": pending_updates(),
+        "pending_uploads": upload_queue.stats()["pending"],
+    }), 200
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_render_job(job_id):
+    job = render_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_with_share_urls(job)), 200
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def render_job_events(job_id):
+    """Server-Sent Events: gửi một event mỗi lần job đổi trạng thái, đóng stream khi job xong"""
+    if not render_jobs.get(job_id):
+        return jsonify({"error": "Job not found"}), 404
+    
+    def stream():
+        version = None
+        while True:
+            job = render_jobs.wait(job_id, version, timeout=15)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            if job['version'] == version:
+                yield ": keep-alive\n\n"  # Giữ kết nối qua proxy khi job chạy lâu
+                continue
+            version = job['version']
+            yield f"event: {job['status']}\ndata: {json.dumps(job_with_share_urls(job))}\n\n"
+            if job['status'] in FINISHED_STATES:
+                return
+    
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/frame-types', methods=['GET'])
 def get_frame_types():
     return jsonify(FRAME_TYPES)
@@ -451,11 +535,16 @@ def get_frame_constants():
         },
         "video_settings": {
             "fps": VIDEO_FPS,
-            "fast_video_duration": FAST_VIDEO_DURATION
+            "fast_video_duration": FAST_VIDEO_DURATION,
+            "encoder": VIDEO_ENCODER_BACKEND,
+            "available_encoders": list(ENCODER_BACKENDS),
+            "engine": VIDEO_RENDER_ENGINE,
+            "available_engines": list(RENDER_ENGINES)
         },
         "threading_settings": {
             "max_processing_workers": MAX_PROCESSING_WORKERS,
             "max_upload_workers": MAX_UPLOAD_WORKERS,
+            "render_queue_size": RENDER_QUEUE_SIZE,
             "processing_timeout": PROCESSING_TIMEOUT,
             "upload_timeout": UPLOAD_TIMEOUT
         },
@@ -474,6 +563,14 @@ def get_performance_info():
             "processing": f"{PROCESSING_TIMEOUT}s",
             "upload": f"{UPLOAD_TIMEOUT}s"
         },
+        "render_jobs": render_jobs.stats(),
+        "uploads": upload_queue.stats(),
+        "circuit_breakers": {name: breaker.stats()["state"] for name, breaker in CIRCUIT_BREAKERS.items()},
+        "media_session_updates": media_session_stats(),
+        "caches": {
+            "templates": template_cache.stats(),
+            "transcode": transcode_cache.stats()
+        },
         "parallel_features": [
             "Image processing",
             "Video processing",
@@ -561,6 +658,8 @@ def serve_output(filename):
             mime_type = 'image/jpeg'
         elif filename.lower().endswith('.png'):
             mime_type = 'image/png'
+        elif filename.lower().endswith('.webp'):
+            mime_type = 'image/webp'
         
         if os.path.exists(file_path):
             return send_from_directory(daily_folder, filename, mimetype=mime_type)
@@ -570,6 +669,11 @@ def serve_output(filename):
             if os.path.isdir(folder_path) and os.path.exists(os.path.join(folder_path, filename)):
                 return send_from_directory(folder_path, filename, mimetype=mime_type)
         
+        # File local đã xoá sau khi upload nền xong: chuyển sang bản trên host
+        uploaded_url = upload_queue.uploaded_url(os.path.basename(filename))
+        if uploaded_url:
+            return redirect(uploaded_url, code=302)
+        
         return jsonify({"error": "File not found"}), 404
     except Exception as e:
         logger.error(f"[FILE SERVE] Error: {str(e)}")
@@ -614,6 +718,10 @@ def download_image():
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # Cần cho process pool khi chạy từ .exe (PyInstaller)
     logger.info("Starting Flask application")
+    # Tiếp tục các upload còn dở từ lần chạy trước. Không chạy lúc import: process con của pool
+    # (spawn) import lại module chính và sẽ upload trùng các task trên đĩa
+    upload_queue.start()
     # Tắt debug mode để tránh multiple processes và threading issues
     app.run(debug=True, host='0.0.0.0', port=8000, threaded=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Đo peak RSS và thời gian ghép ảnh in: bản cũ (canvas RGBA + convert RGB + canvas ảnh kép)
+so với compose_print_image (canvas RGB, ghép thẳng hai dải). Mỗi lần đo chạy trong process riêng
+để peak RSS không bị lẫn giữa các lần.
+
+Cách dùng: python bench_compositor.py [frame_id ...]
+"""
+import sys
+import os
+import time
+import multiprocessing
+
+# Thêm thư mục hiện tại vào Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+import psutil
+from PIL import Image
+from config import FRAME_TYPES
+from utils.frame_layout import get_frame_layout
+from utils.image_compositor import compose_print_image
+from utils.image_processing import paste_image
+
+def peak_rss_mb():
+    try:
+        import resource
+        # Linux trả về KB, macOS trả về byte
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return psutil.Process(os.getpid()).memory_info().peak_wset / 1024 / 1024
+
+def make_inputs(layout):
+    background = Image.new("RGB", layout.size, (230, 200, 180))
+    overlay = Image.new("RGBA", layout.size, (0, 0, 0, 0))
+    overlay.paste((255, 255, 255, 160), (0, 0, layout.width, layout.height // 20))
+    tiles = [Image.new("RGBA", layout.slot_size, (40 * i % 255, 120, 200, 255)) for i in range(layout.slot_count)]
+    qr_img = Image.new("RGB", (layout.qr_size, layout.qr_size), (0, 0, 0))
+    return tiles, background, overlay, qr_img
+
+def compose_legacy(layout, tiles, background_img, overlay_img, qr_img):
+    """Bản sao đường ghép cũ của process_image_task để so sánh"""
+    frame = Image.new("RGBA", layout.size, (255, 255, 255, 255))
+    frame.paste(background_img, (0, 0))
+    for img, pos in zip(tiles, layout.positions):
+        frame = paste_image(frame, img, pos, layout.slot_size, layout.is_circle, layout.frame_type, layout.circle_mask)
+    frame.paste(overlay_img, (0, 0), overlay_img)
+    frame.paste(qr_img, layout.qr_position)
+    if layout.is_doubled:
+        doubled_frame = Image.new("RGB", (layout.output_width, layout.height), (255, 255, 255))
+        frame_rgb = frame.convert("RGB")
+        doubled_frame.paste(frame_rgb, (0, 0))
+        doubled_frame.paste(frame_rgb, (layout.width, 0))
+        return doubled_frame
+    return frame.convert("RGB")
+
+def run_once(mode, frame_id, result_queue):
+    layout = get_frame_layout(frame_id)
+    inputs = make_inputs(layout)
+    baseline = peak_rss_mb()
+    compose = compose_legacy if mode == "legacy" else compose_print_image
+    start = time.perf_counter()
+    output = compose(layout, *inputs)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    result_queue.put((peak_rss_mb() - baseline, elapsed_ms, output.size))
+
+def measure(mode, frame_id):
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_once, args=(mode, frame_id, result_queue))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    return result
+
+def bench_compositor(frame_ids=None):
+    frame_ids = frame_ids or list(FRAME_TYPES)
+    print("=== Compositor benchmark: peak RSS tăng thêm khi ghép (MB) ===")
+    print(f"{'frame':<8}{'output':>14}{'legacy MB':>12}{'new MB':>10}{'legacy ms':>12}{'new ms':>10}")
+    for frame_id in frame_ids:
+        legacy_mb, legacy_ms, size = measure("legacy", frame_id)
+        new_mb, new_ms, _ = measure("new", frame_id)
+        print(f"{frame_id:<8}{f'{size[0]}x{size[1]}':>14}{legacy_mb:>12.1f}{new_mb:>10.1f}{legacy_ms:>12.1f}{new_ms:>10.1f}")
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    bench_compositor(sys.argv[1:])
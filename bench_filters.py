@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Benchmark filter ảnh: so sánh bản ImageEnhance nhiều lượt (apply_filter_to_image_pil)
+với bản LUT đã biên dịch (apply_filter_to_image), ms/ảnh ở kích thước 2048px.
+
+Cách dùng: python bench_filters.py [ảnh.jpg] [số lần lặp]
+"""
+import sys
+import os
+import time
+
+# Thêm thư mục hiện tại vào Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+import numpy as np
+from PIL import Image
+from config import MAX_INPUT_IMAGE_SIZE
+from utils.filters import FILTERS, apply_filter_to_image, apply_filter_to_image_pil
+
+def load_test_image(path=None):
+    if path:
+        img = Image.open(path).convert("RGBA")
+        img.thumbnail((MAX_INPUT_IMAGE_SIZE, MAX_INPUT_IMAGE_SIZE), Image.Resampling.BICUBIC)
+        return img
+    # Ảnh tổng hợp 2048x1365 có gradient màu + nhiễu để gần với ảnh chụp thật
+    height, width = MAX_INPUT_IMAGE_SIZE * 2 // 3, MAX_INPUT_IMAGE_SIZE
+    y, x = np.mgrid[0:height, 0:width]
+    rng = np.random.default_rng(0)
+    rgb = np.stack([x * 255 / width, y * 255 / height, (x + y) * 255 / (width + height)], axis=-1)
+    rgb = np.clip(rgb + rng.normal(0, 12, rgb.shape), 0, 255).astype(np.uint8)
+    return Image.fromarray(rgb).convert("RGBA")
+
+def time_filter(func, img, filter_id, repeat):
+    func(img, filter_id)  # Warm-up (biên dịch LUT, cache)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(img, filter_id)
+    return (time.perf_counter() - start) * 1000 / repeat, result
+
+def bench_filters(path=None, repeat=5):
+    img = load_test_image(path)
+    print(f"=== Filter benchmark: {img.size[0]}x{img.size[1]}, {repeat} lần/filter ===")
+    print(f"{'filter':<10}{'PIL (ms)':>12}{'LUT (ms)':>12}{'speedup':>10}{'max diff':>10}{'mean diff':>11}")
+    for filter_id in FILTERS:
+        if filter_id == "none":
+            continue
+        pil_ms, pil_img = time_filter(apply_filter_to_image_pil, img, filter_id, repeat)
+        lut_ms, lut_img = time_filter(apply_filter_to_image, img, filter_id, repeat)
+        diff = np.abs(np.asarray(pil_img.convert("RGB"), dtype=np.int16) - np.asarray(lut_img.convert("RGB"), dtype=np.int16))
+        print(f"{filter_id:<10}{pil_ms:>12.1f}{lut_ms:>12.1f}{pil_ms / lut_ms:>9.1f}x{diff.max():>10}{diff.mean():>11.2f}")
+    print("\nLưu ý: hdr, vivid, noir, dreamy có hue_rotate/grayscale mà bản PIL bỏ qua, nên diff lớn hơn là bình thường.")
+
+if __name__ == "__main__":
+    image_path = sys.argv[1] if len(sys.argv) > 1 else None
+    repeat_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    bench_filters(image_path, repeat_count)
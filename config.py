@@ -8,6 +8,11 @@ UPLOAD_BASE_FOLDER = os.path.join(BASE_DIR, 'uploads')
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 OUTPUT_FOLDER = os.path.join(BASE_DIR, 'outputs')
 OUTPUT_BASE_FOLDER = os.path.join(BASE_DIR, 'outputs')
+TEMPLATE_FOLDER = os.path.join(BASE_DIR, 'frame_templates')  # Background/overlay đã đăng ký (template_id)
+TRANSCODE_CACHE_FOLDER = os.path.join(BASE_DIR, 'cache', 'transcode')
+TRANSCODE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # Dung lượng tối đa của transcode cache (LRU)
+MEDIA_PROBE_CACHE_SIZE = 256  # Số kết quả ffprobe giữ trong bộ nhớ (key: path, size, mtime)
+UPLOAD_QUEUE_FOLDER = os.path.join(BASE_DIR, 'cache', 'uploads')  # Hàng đợi upload lưu trên đĩa (còn sau khi restart)
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'mp4', 'webm'}
 
 
@@ -17,6 +22,17 @@ WIDTH_IMAGE = 4956
 
 ENABLE_IMAGE_OPTIMIZATION = True
 MAX_INPUT_IMAGE_SIZE = 2048  # Giới hạn kích thước ảnh input
+IMAGE_SLOT_EXECUTOR = "thread"  # "thread" hoặc "process" (filter nặng CPU) cho stage chuẩn bị ảnh từng slot
+IMAGE_SLOT_WORKERS = min(6, os.cpu_count() or 4)  # Số worker dùng chung cho stage chuẩn bị ảnh
+FILTER_LUT_CACHE_SIZE = 8  # Số 3D LUT (theo độ sáng trung bình) mỗi filter giữ lại (LRU, ~0.4 MB mỗi LUT)
+TEMPLATE_CACHE_MAX_BYTES = 768 * 1024 * 1024  # Ngân sách bộ nhớ cho cache background/overlay đã chuẩn bị (LRU)
+TEMPLATE_WARM_MAX_BYTES = TEMPLATE_CACHE_MAX_BYTES // 4  # Bộ nhớ tối đa warm-up một template khi đăng ký được dùng
+# Profile encode ảnh output từ cùng một canvas: "print" là bản in giữ trên máy, "web" là bản nhỏ upload lên host
+# (xem trên điện thoại). format: "JPEG" hoặc "WEBP", max_side: None = giữ nguyên kích thước
+IMAGE_OUTPUT_PROFILES = {
+    "print": {"format": "JPEG", "max_side": None, "quality": 100, "subsampling": 0, "optimize": False, "progressive": False},
+    "web": {"format": "JPEG", "max_side": 2048, "quality": 85, "subsampling": 2, "optimize": True, "progressive": True},
+}
 
 # Frame types and aspect ratios
 FRAME_TYPES = {
@@ -71,12 +87,46 @@ FRAME_GAPS = {
 # Video settings
 VIDEO_FPS = 30
 FAST_VIDEO_DURATION = 2
+VIDEO_RENDER_ENGINE = "opencv"  # "opencv" (ghép frame bằng Python/numpy) hoặc "ffmpeg" (một filter_complex cho cả layout)
+VIDEO_SLOT_DECODER = "ffmpeg"  # "ffmpeg" (decode + scale/crop về kích thước slot trong ffmpeg) hoặc "opencv"
+VIDEO_PREFETCH_DEPTH = 4  # Số frame decode sẵn cho mỗi slot (thread decoder riêng), 0 = decode tuần tự
+VIDEO_ENCODER_BACKEND = "ffmpeg_pipe"  # "ffmpeg_pipe" (encode 1 lượt qua stdin) hoặc "opencv" (VideoWriter + standardize_video)
 
 # Threading settings
 MAX_PROCESSING_WORKERS = 6  # Tăng số worker để xử lý song song
 MAX_UPLOAD_WORKERS = 3      # Tăng upload workers
 PROCESSING_TIMEOUT = 300    # Giảm timeout để fail fast
 UPLOAD_TIMEOUT = 120
+UPLOAD_MAX_ATTEMPTS = 10  # Số lần thử upload một file trước khi bỏ cuộc
+UPLOAD_RETRY_BASE_DELAY = 2  # Giây chờ trước lần thử lại đầu tiên, nhân đôi sau mỗi lần lỗi
+UPLOAD_RETRY_MAX_DELAY = 300  # Khoảng chờ tối đa giữa hai lần thử
+UPLOAD_TASK_RETENTION = 24 * 3600  # Giữ trạng thái upload đã xong (giây) để tra cứu URL
+MEDIA_SESSION_TIMEOUT = 10  # Timeout (giây) cho request cập nhật media session lên URL_FRONTEND
+MEDIA_SESSION_RETRY_DELAY = 5  # Giây chờ trước khi gửi lại cập nhật media session bị lỗi
+MEDIA_SESSION_COALESCE_WINDOW = 2  # Gộp các cập nhật cùng session code trong khoảng này (giây) thành một request
+MEDIA_SESSION_HISTORY = 1000  # Số session nhớ URL đã gửi (bỏ cập nhật trùng / cũ hơn)
+# Circuit breaker cho upload host / URL_FRONTEND: lỗi liên tiếp thì ngừng gọi, dùng URL local và để lại sau
+CIRCUIT_FAILURE_THRESHOLD = 3  # Số lỗi trong CIRCUIT_FAILURE_WINDOW giây thì mở breaker
+CIRCUIT_FAILURE_WINDOW = 60
+CIRCUIT_RESET_TIMEOUT = 30  # Giây breaker mở trước khi cho một request thử lại
+FFMPEG_THREAD_BUDGET = os.cpu_count() or 4  # Tổng số thread cho mọi tiến trình ffmpeg chạy song song
+FFMPEG_THROTTLED_THREADS = max(1, FFMPEG_THREAD_BUDGET // 4)  # Số thread ffmpeg (video) khi đang có job ảnh chờ/chạy
+FFMPEG_PROCESS_THREADS = max(1, FFMPEG_THREAD_BUDGET // 2)  # Số thread một tiến trình encode/chuẩn hóa ffmpeg xin từ ngân sách
+FFMPEG_THROTTLED_NICE = 10  # Nice (Linux/macOS) của tiến trình ffmpeg đang chạy khi throttle; Windows dùng BELOW_NORMAL
+RENDER_WORKERS = MAX_PROCESSING_WORKERS  # Số job render (ảnh/video) chạy cùng lúc trên toàn server
+RENDER_QUEUE_SIZE = 24  # Số job chờ tối đa khi mọi worker đều bận, vượt quá thì từ chối (503)
+RENDER_JOB_RETENTION = 3600  # Giữ trạng thái/kết quả job đã xong (giây) cho client polling
+# Lane ưu tiên: ảnh (khách đứng chờ) > video 2s > video 10s + fast video. Trọng số dùng khi nhiều lane cùng có job chờ
+RENDER_LANE_WEIGHTS = {"image": 6, "video_short": 2, "video_long": 1}
+RENDER_IMAGE_RESERVED_WORKERS = 1  # Số worker chỉ nhận job ảnh, video không bao giờ chiếm hết worker
+RENDER_LATENCY_SAMPLES = 200  # Số job gần nhất mỗi lane dùng để tính p50/p95
+# Chia công bằng giữa các booth dùng chung server (booth nhận diện theo header X-Booth-Id / booth_id, hoặc IP)
+# Số job video một booth được chạy cùng lúc (job ảnh không bị giới hạn). Mặc định chừa 1 worker video
+# cho booth khác; server chỉ phục vụ một booth thì đặt = RENDER_WORKERS để dùng hết worker
+RENDER_BOOTH_MAX_RUNNING = max(1, RENDER_WORKERS - RENDER_IMAGE_RESERVED_WORKERS - 1)
+RENDER_BOOTH_MAX_WAITING = 6  # Số job một booth được xếp hàng chờ, vượt quá thì từ chối (503)
+RENDER_BOOTH_LIMITS = {}  # Giới hạn video chạy cùng lúc riêng theo booth_id, vd. {"booth-main": 3}
+RENDER_DEFAULT_RUN_SECONDS = {"image": 5, "video_short": 20, "video_long": 60}  # Ước tính ETA khi lane chưa có mẫu
 
 # URLs
 URL_MAIN = "http://localhost:4000"
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test pipeline decode song song: frame trả về theo từng bước của mọi slot (slot hết sớm trả None),
+lỗi decoder được raise ở compositor và reader chỉ được giải phóng khi decoder không còn đọc nữa.
+"""
+import sys
+import os
+import threading
+
+import pytest
+
+# Thêm thư mục hiện tại vào Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+from utils.decode_pipeline import PrefetchPipeline
+
+def collect(pipeline):
+    steps = []
+    while True:
+        frames = pipeline.next_frames()
+        if frames is None:
+            return steps
+        steps.append(frames)
+
+@pytest.mark.parametrize("depth", [0, 2])
+def test_slots_advance_in_lockstep(depth):
+    with PrefetchPipeline([range(3), range(10, 12)], depth=depth, label="TEST") as pipeline:
+        steps = collect(pipeline)
+    assert steps == [[0, 10], [1, 11], [2, None]]
+    assert pipeline.stats()["frames"] == 3
+
+@pytest.mark.parametrize("depth", [0, 2])
+def test_decoder_error_is_raised_in_compositor(depth):
+    def broken():
+        yield 1
+        raise ValueError("corrupt frame")
+
+    with PrefetchPipeline([broken(), range(5)], depth=depth, label="TEST") as pipeline:
+        assert pipeline.next_frames() == [1, 0]
+        with pytest.raises(ValueError, match="corrupt frame"):
+            pipeline.next_frames()
+
+def test_release_runs_in_decoder_thread_after_reading_stops():
+    reading = threading.local()
+    events = []
+
+    def source(name):
+        reading.active = True
+        for frame in range(3):
+            events.append((name, "read", threading.current_thread().name))
+            yield frame
+        reading.active = False
+
+    def release(name):
+        def _release():
+            assert not getattr(reading, "active", False)
+            events.append((name, "release", threading.current_thread().name))
+        return _release
+
+    with PrefetchPipeline([source("a"), source("b")], depth=2, label="TEST",
+                          releases=[release("a"), release("b")]) as pipeline:
+        collect(pipeline)
+
+    for name in ("a", "b"):
+        slot_events = [event for event in events if event[0] == name]
+        assert slot_events[-1][1] == "release"
+        # Cùng thread decoder với các lần đọc, không phải thread compositor
+        assert {thread for _, _, thread in slot_events} == {f"test-decoder-{'ab'.index(name)}"}
+
+def test_close_early_releases_blocked_decoders():
+    released = []
+    pipeline = PrefetchPipeline([iter(range(1000)), iter(range(1000))], depth=1, label="TEST",
+                                releases=[lambda: released.append(0), lambda: released.append(1)])
+    assert pipeline.next_frames() == [0, 0]
+    pipeline.close()  # Decoder đang chờ put vào queue đầy
+    assert sorted(released) == [0, 1]
+    assert not any(thread.is_alive() for thread in pipeline._threads)
+
+def test_sequential_mode_releases_on_close():
+    released = []
+    with PrefetchPipeline([range(2)], depth=0, label="TEST", releases=[lambda: released.append(True)]) as pipeline:
+        assert pipeline.next_frames() == [0]
+        assert not released
+    assert released == [True]
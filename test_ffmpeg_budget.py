@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test ngân sách thread ffmpeg: số thread được cấp luôn đủ minimum, available không âm,
+reservation lồng nhau không lấy thêm từ ngân sách, throttle hạ ưu tiên tiến trình đang chạy.
+"""
+import sys
+import os
+import subprocess
+import threading
+import time
+
+import pytest
+
+# Thêm thư mục hiện tại vào Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+psutil = pytest.importorskip("psutil")
+
+from utils.ffmpeg_budget import FFmpegThreadBudget
+
+def test_grant_within_minimum_and_threads():
+    budget = FFmpegThreadBudget(total_threads=8, throttled_threads=2)
+    granted = budget.acquire(6, minimum=3)
+    assert granted == 6
+    assert budget.available == 2
+    budget.release(granted)
+    assert budget.available == 8
+
+def test_waits_until_minimum_is_free():
+    budget = FFmpegThreadBudget(total_threads=4, throttled_threads=1)
+    first = budget.acquire(3, minimum=3)
+    grants = []
+    waiter = threading.Thread(target=lambda: grants.append(budget.acquire(4, minimum=2)))
+    waiter.start()
+    time.sleep(0.05)
+    assert not grants  # Chỉ còn 1 thread trống, cần 2
+    budget.release(first)
+    waiter.join(timeout=1)
+    assert grants == [4]
+
+def test_minimum_over_limit_runs_alone_and_is_accounted():
+    budget = FFmpegThreadBudget(total_threads=4, throttled_threads=1)
+    budget.set_throttled(True)
+    granted = budget.acquire(10, minimum=6)
+    assert granted == 6
+    assert budget.available == 0
+    assert budget.overcommitted == 2
+    budget.release(granted)
+    assert budget.available == 4
+    assert budget.overcommitted == 0
+
+def test_nested_reservation_borrows_outer_grant():
+    budget = FFmpegThreadBudget(total_threads=4, throttled_threads=1)
+    outer = budget.acquire(4, minimum=4)
+    assert budget.available == 0
+    with budget.reserve(2) as inner:
+        assert inner == 2
+        assert budget.available == 0
+    budget.release(outer)
+    assert budget.available == 4
+
+def test_release_must_match_reservation():
+    budget = FFmpegThreadBudget(total_threads=4, throttled_threads=1)
+    granted = budget.acquire(2)
+    with pytest.raises(RuntimeError):
+        budget.release(granted + 1)
+    budget.release(granted)
+
+@pytest.mark.skipif(os.name == "nt", reason="nice chỉ có trên Linux/macOS")
+def test_throttle_lowers_running_process_priority():
+    budget = FFmpegThreadBudget(total_threads=4, throttled_threads=1)
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(5)"])
+    try:
+        budget.track(process)
+        base = psutil.Process(process.pid).nice()
+        budget.set_throttled(True)
+        assert psutil.Process(process.pid).nice() > base
+        # Tiến trình bắt đầu sau khi throttle cũng bị hạ ưu tiên ngay
+        late = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(5)"])
+        try:
+            budget.track(late)
+            assert psutil.Process(late.pid).nice() > base
+        finally:
+            budget.untrack(late)
+            late.kill()
+            late.wait()
+    finally:
+        budget.untrack(process)
+        process.kill()
+        process.wait()
+
+def test_run_tracks_process_while_running():
+    budget = FFmpegThreadBudget(total_threads=4, throttled_threads=1)
+    result = budget.run([sys.executable, "-c", "print('ok')"], check=True, capture_output=True, text=True)
+    assert result.stdout.strip() == "ok"
+    assert not budget._processes
+    with pytest.raises(subprocess.CalledProcessError):
+        budget.run([sys.executable, "-c", "raise SystemExit(3)"], check=True, capture_output=True)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Test engine filter_complex: thứ tự input/label của graph (mask, overlay, output phụ) và một lượt
+render thật bằng ffmpeg với clip ngắn (slot đúng vị trí, mask tròn, fast video ngắn hơn).
+"""
+import sys
+import os
+
+import pytest
+
+# Thêm thư mục hiện tại vào Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("psutil")
+
+from utils.ffmpeg_compositor import build_layout_filter_graph, render_layout_video
+from utils.ffmpeg_utils import check_ffmpeg_availability
+
+POSITIONS = [(8, 8), (72, 8)]
+
+def chains(graph):
+    return graph.split(";")
+
+def test_plain_graph_chains_slots_onto_background():
+    graph = build_layout_filter_graph(2, (136, 72), (56, 56), POSITIONS, 10)
+    assert chains(graph)[0] == "[0:v]scale=136:72,fps=10.000,format=yuv420p,setsar=1[base]"
+    assert "[1:v]setpts=PTS-STARTPTS" in graph and "[2:v]setpts=PTS-STARTPTS" in graph
+    assert "[base][s0]overlay=8:8:eof_action=repeat[b0]" in graph
+    assert "[b0][s1]overlay=72:8:eof_action=repeat[b1]" in graph
+    assert chains(graph)[-1] == "[b1]format=yuv420p[out]"
+    assert "alphamerge" not in graph and "split" not in graph
+
+def test_mask_and_overlay_inputs_follow_slots():
+    graph = build_layout_filter_graph(2, (136, 72), (56, 56), POSITIONS, 10, crop_top=True,
+                                      has_background=False, has_mask=True, has_overlay=True)
+    assert chains(graph)[0] == "[0:v]fps=10.000,format=yuv420p,setsar=1[base]"
+    # Input: [0] nền, [1..2] slot, [3] mask, [4] overlay
+    assert "[3:v]format=gray,split=2[m0][m1]" in graph
+    assert "[v1][m1]alphamerge[s1]" in graph
+    assert "crop=56:56:(iw-ow)/2:0" in graph
+    assert "[4:v]format=rgba[ov]" in graph
+    assert chains(graph)[-1] == "[bo]format=yuv420p[out]"
+
+def test_single_slot_mask_is_not_split():
+    graph = build_layout_filter_graph(1, (72, 72), (56, 56), POSITIONS, 10, has_mask=True)
+    assert "[2:v]format=gray[m0]" in graph
+    assert "split" not in graph
+
+def test_extra_outputs_split_composited_stream():
+    graph = build_layout_filter_graph(2, (136, 72), (56, 56), POSITIONS, 10, speed=2.0, extra_speeds=[5.0])
+    assert "setpts=(PTS-STARTPTS)/2.000000" in graph
+    assert "[b1]format=yuv420p,split=2[out][x0]" in graph
+    assert chains(graph)[-1] == "[x0]setpts=(PTS-STARTPTS)/5.000000,fps=10.000[extra0]"
+
+def write_clip(path, color, frames=20):
+    cv2 = pytest.importorskip("cv2")
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), 10, (64, 64))
+    if not writer.isOpened():
+        pytest.skip("OpenCV VideoWriter không ghi được mp4v")
+    for _ in range(frames):
+        writer.write(np.full((64, 64, 3), color, dtype=np.uint8))
+    writer.release()
+
+def read_frames(path):
+    cv2 = pytest.importorskip("cv2")
+    cap = cv2.VideoCapture(str(path))
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+@pytest.mark.skipif(not check_ffmpeg_availability(), reason="Cần ffmpeg")
+def test_render_layout_video_with_circle_and_fast_output(tmp_path):
+    clips = [tmp_path / "red.mp4", tmp_path / "blue.mp4"]
+    write_clip(clips[0], (0, 0, 255))
+    write_clip(clips[1], (255, 0, 0))
+    output, fast = tmp_path / "out.mp4", tmp_path / "fast.mp4"
+
+    render_layout_video([str(clip) for clip in clips], str(output), (136, 72), (56, 56), POSITIONS, 10, 2.0,
+                        is_circle=True, extra_outputs=[(str(fast), 4.0, 0.5)])
+
+    frames = read_frames(output)
+    assert len(frames) == pytest.approx(20, abs=1)
+    assert len(read_frames(fast)) == pytest.approx(5, abs=1)
+    frame = frames[5].astype(int)
+    # Tâm slot lấy màu clip (BGR), góc slot ngoài mask tròn giữ nền trắng
+    assert frame[36, 36, 2] > 200 and frame[36, 36, 0] < 60
+    assert frame[36, 100, 0] > 200 and frame[36, 100, 2] < 60
+    assert frame[10, 10].min() > 200
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test filter ảnh biên dịch thành 3D LUT: kết quả khớp bản ImageEnhance cũ (và phép tính màu trực tiếp
+cho các bước bản cũ không có: hue_rotate, grayscale), giữ kênh alpha, LUT theo độ sáng có giới hạn.
+"""
+import sys
+import os
+
+import pytest
+
+# Thêm thư mục hiện tại vào Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+from config import FILTER_LUT_CACHE_SIZE
+from utils.filters import (
+    FILTERS, CompiledFilter, get_compiled_filter, apply_filter_to_image, apply_filter_to_image_pil, _apply_color_steps
+)
+
+def sample_image(mode="RGB"):
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:96, 0:128]
+    rgb = np.stack([x * 2, y * 2, x + y], axis=-1) + rng.integers(-10, 10, (96, 128, 3))
+    rgb = np.clip(rgb, 0, 255).astype(np.uint8)
+    if mode == "RGBA":
+        alpha = (x * 2).astype(np.uint8)[..., None]
+        return Image.fromarray(np.concatenate([rgb, alpha], axis=-1), "RGBA")
+    return Image.fromarray(rgb, "RGB")
+
+def pixel_diff(a, b):
+    return np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16))
+
+@pytest.mark.parametrize("filter_id", [filter_id for filter_id, params in FILTERS.items()
+                                       if "hue_rotate" not in params and "grayscale" not in params])
+def test_matches_imageenhance_version(filter_id):
+    img = sample_image()
+    diff = pixel_diff(apply_filter_to_image(img, filter_id), apply_filter_to_image_pil(img, filter_id))
+    assert diff.max() <= 6
+    assert diff.mean() < 2
+
+@pytest.mark.parametrize("filter_id", [filter_id for filter_id, params in FILTERS.items()
+                                       if params and "blur" not in params and "sharpness" not in params])
+def test_lut_matches_direct_color_steps(filter_id):
+    img = sample_image()
+    compiled = get_compiled_filter(filter_id)
+    expected = np.rint(_apply_color_steps(np.asarray(img, dtype=np.float32), compiled.color_steps,
+                                          compiled._contrast_mean(img)))
+    diff = pixel_diff(compiled.apply(img), expected)
+    assert diff.max() <= 4
+    assert diff.mean() < 0.2
+
+def test_rgba_keeps_alpha_channel():
+    img = sample_image("RGBA")
+    result = apply_filter_to_image(img, "vintage")
+    assert result.mode == "RGBA"
+    assert np.array_equal(np.asarray(result)[..., 3], np.asarray(img)[..., 3])
+
+def test_unknown_or_empty_filter_returns_image():
+    img = sample_image()
+    assert apply_filter_to_image(img, "missing") is img
+    assert get_compiled_filter("missing") is None
+    assert np.array_equal(np.asarray(apply_filter_to_image(img, "none")), np.asarray(img))
+
+def test_compiled_once_and_lut_cache_is_bounded():
+    assert get_compiled_filter("soft") is get_compiled_filter("soft")
+    compiled = CompiledFilter("soft", FILTERS["soft"])
+    first = compiled.get_lut(100)
+    assert compiled.get_lut(100) is first
+    for mean in range(FILTER_LUT_CACHE_SIZE + 3):
+        compiled.get_lut(mean)
+    assert len(compiled._luts) == FILTER_LUT_CACHE_SIZE
+    assert 100 not in compiled._luts
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Test cache probe media: probe lỗi (file chưa ghi xong) không bị cache, lần gọi sau chạy lại
+ffprobe và thấy file hoàn chỉnh dù size/mtime không đổi.
+"""
+import sys
+import os
+
+import pytest
+
+# Thêm thư mục hiện tại vào Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+import utils.media_probe as media_probe
+
+def test_failed_probe_is_not_cached(tmp_path, monkeypatch):
+    video = tmp_path / "clip.mp4"
+    video.write_bytes(b"partial")
+    outputs = iter([
+        media_probe.subprocess.CalledProcessError(1, "ffprobe"),
+        '{"streams": [{"codec_type": "video", "codec_name": "h264", "width": 64, "height": 48, '
+        '"r_frame_rate": "10/1", "nb_frames": "5"}], "format": {"duration": "0.5"}}',
+    ])
+    calls = []
+
+    def fake_run(cmd, **kwargs):
+        calls.append(cmd)
+        output = next(outputs)
+        if isinstance(output, Exception):
+            raise output
+        return media_probe.subprocess.CompletedProcess(cmd, 0, output, "")
+
+    monkeypatch.setattr(media_probe, "check_ffprobe_availability", lambda: True)
+    monkeypatch.setattr(media_probe, "get_ffprobe_command", lambda: "ffprobe")
+    monkeypatch.setattr(media_probe.subprocess, "run", fake_run)
+    monkeypatch.setattr(media_probe, "_cache", media_probe.OrderedDict())
+
+    assert media_probe.probe_media(str(video)) is None
+    assert media_probe.has_video_stream(str(video)) is True
+    assert media_probe.probe_media(str(video))["frame_count"] == 5
+    assert len(calls) == 2  # Lần thứ ba lấy từ cache
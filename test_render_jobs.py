@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Test bộ lập lịch render: lane được chọn theo trọng số, booth được phục vụ xoay vòng trong lane,
+giới hạn video chạy cùng lúc của booth / worker dành riêng cho ảnh, và từ chối khi hàng đợi đầy.
+"""
+import sys
+import os
+import threading
+import time
+
+import pytest
+
+# Thêm thư mục hiện tại vào Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+pytest.importorskip("psutil")
+
+from utils.render_jobs import (
+    RenderJobManager, QueueFullError, JOB_QUEUED, JOB_RUNNING, JOB_DONE,
+    LANE_IMAGE, LANE_VIDEO_SHORT, LANE_VIDEO_LONG,
+)
+
+def make_manager(**kwargs):
+    options = dict(workers=1, queue_size=20, image_reserved_workers=0, booth_max_running=10, booth_max_waiting=10)
+    options.update(kwargs)
+    return RenderJobManager(**options)
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+def submit_blocker(manager, gate, lane=LANE_IMAGE, booth_id="blocker"):
+    """Job chiếm worker tới khi gate được set, để các job sau xếp hàng đủ rồi mới được chọn"""
+    job = manager.submit("blocker", gate.wait, 5, lane=lane, booth_id=booth_id)
+    assert wait_for(lambda: manager.get(job["job_id"])["status"] == JOB_RUNNING)
+    return job
+
+def run_in_order(manager, jobs):
+    """Submit (lane, booth, tên) sau một blocker, trả về thứ tự các job được chạy"""
+    gate, order = threading.Event(), []
+    submit_blocker(manager, gate)
+    job_ids = [manager.submit("test", order.append, name, lane=lane, booth_id=booth)["job_id"]
+               for lane, booth, name in jobs]
+    gate.set()
+    for job_id in job_ids:
+        assert manager.wait_finished(job_id, timeout=5)["status"] == JOB_DONE
+    return order
+
+def test_lanes_share_workers_by_weight():
+    manager = make_manager(lane_weights={LANE_IMAGE: 2, LANE_VIDEO_SHORT: 1, LANE_VIDEO_LONG: 1})
+    jobs = ([(LANE_VIDEO_LONG, "booth", f"long{i}") for i in range(2)]
+            + [(LANE_VIDEO_SHORT, "booth", f"short{i}") for i in range(2)]
+            + [(LANE_IMAGE, "booth", f"image{i}") for i in range(4)])
+    order = run_in_order(manager, jobs)
+    # Mỗi vòng trọng số (2 + 1 + 1): 2 ảnh, 1 video ngắn, 1 video dài, dù video được gửi trước
+    first_round = [name.rstrip("0123456789") for name in order[:4]]
+    assert order[0] == "image0"
+    assert sorted(first_round) == ["image", "image", "long", "short"]
+    assert sorted(order) == sorted(name for _, _, name in jobs)
+
+def test_booths_take_turns_within_lane():
+    manager = make_manager()
+    jobs = ([(LANE_VIDEO_SHORT, "booth-a", f"a{i}") for i in range(3)]
+            + [(LANE_VIDEO_SHORT, "booth-b", f"b{i}") for i in range(2)])
+    assert run_in_order(manager, jobs) == ["a0", "b0", "a1", "b1", "a2"]
+
+def test_booth_video_limit_does_not_block_images():
+    manager = make_manager(workers=3, image_reserved_workers=1, booth_max_running=1)
+    gate = threading.Event()
+    try:
+        first = manager.submit("video", gate.wait, 5, lane=LANE_VIDEO_SHORT, booth_id="booth-a")
+        second = manager.submit("video", gate.wait, 5, lane=LANE_VIDEO_SHORT, booth_id="booth-a")
+        other = manager.submit("video", gate.wait, 5, lane=LANE_VIDEO_LONG, booth_id="booth-b")
+        image = manager.submit("image", lambda: "image", lane=LANE_IMAGE, booth_id="booth-a")
+
+        assert manager.wait_finished(image["job_id"], timeout=5)["status"] == JOB_DONE
+        assert wait_for(lambda: manager.get(other["job_id"])["status"] == JOB_RUNNING)
+        assert manager.get(first["job_id"])["status"] == JOB_RUNNING
+        # Booth A đã chạy đủ 1 video, worker còn lại dành cho ảnh: video thứ hai phải chờ
+        time.sleep(0.05)
+        assert manager.get(second["job_id"])["status"] == JOB_QUEUED
+        assert manager.queue_info("booth-a")["running_video"] == 1
+    finally:
+        gate.set()
+    assert manager.wait_finished(second["job_id"], timeout=5)["status"] == JOB_DONE
+
+def test_rejects_when_queue_or_booth_is_full():
+    gate = threading.Event()
+    manager = make_manager(queue_size=2, booth_max_waiting=1)
+    try:
+        submit_blocker(manager, gate)
+        manager.submit("image", lambda: None, booth_id="booth-a")
+        with pytest.raises(QueueFullError):
+            manager.submit("image", lambda: None, booth_id="booth-a")
+        manager.submit("image", lambda: None, booth_id="booth-b")
+        with pytest.raises(QueueFullError):
+            manager.submit("image", lambda: None, booth_id="booth-c")
+        assert manager.stats()["rejected"] == 2
+    finally:
+        gate.set()
+
+def test_failed_job_reports_error():
+    manager = make_manager()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    job = manager.wait_finished(manager.submit("image", fail)["job_id"], timeout=5)
+    assert job["status"] == "failed"
+    assert job["error"] == "boom"
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test template cache: mỗi key chỉ tạo một lần kể cả khi nhiều thread cùng cần, LRU theo số byte,
+value lớn hơn ngân sách không được cache và evict_content bỏ mọi biến thể của một file.
+"""
+import sys
+import os
+import threading
+import time
+
+import pytest
+
+# Thêm thư mục hiện tại vào Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from utils.template_cache import TemplateCache
+
+def test_concurrent_requests_create_value_once():
+    cache = TemplateCache(max_bytes=100)
+    calls, results = [], []
+
+    def factory():
+        calls.append(threading.get_ident())
+        time.sleep(0.05)
+        return "value"
+
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_create("key", factory, len)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 4
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = TemplateCache(max_bytes=10)
+    cache.get_or_create("a", lambda: "aaaa", len)
+    cache.get_or_create("b", lambda: "bbbb", len)
+    cache.get_or_create("a", lambda: pytest.fail("a phải lấy từ cache"), len)
+    cache.get_or_create("c", lambda: "cccc", len)  # Vượt 10 byte: bỏ b (ít dùng gần đây nhất)
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 8
+    assert stats["evictions"] == 1
+    assert cache.get_or_create("b", lambda: "new b", len) == "new b"
+
+def test_value_larger_than_budget_is_not_cached():
+    cache = TemplateCache(max_bytes=4)
+    assert cache.get_or_create("big", lambda: "too large", len) == "too large"
+    assert cache.stats()["entries"] == 0
+    assert cache.get_or_create("big", lambda: "again", len) == "again"
+
+def test_failed_factory_does_not_poison_key():
+    cache = TemplateCache(max_bytes=100)
+
+    def broken():
+        raise OSError("cannot read template")
+
+    with pytest.raises(OSError):
+        cache.get_or_create("key", broken, len)
+    assert cache.get_or_create("key", lambda: "ok", len) == "ok"
+
+def test_evict_content_removes_every_variant_of_a_file():
+    cache = TemplateCache(max_bytes=100)
+    cache.get_or_create(("image", "hash-a", "RGB", "center", (10, 10)), lambda: "a1", len)
+    cache.get_or_create(("scaled", "hash-a", "RGB", "center", (10, 10), (5, 5)), lambda: "a2", len)
+    cache.get_or_create(("video_layers", "hash-b", "hash-a", "center", (10, 10), (5, 5)), lambda: "ab", len)
+    cache.get_or_create(("image", "hash-b", "RGBA", "center", (10, 10)), lambda: "b1", len)
+
+    assert cache.evict_content(["hash-a"]) == 3
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["bytes"] == 2
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test hàng đợi upload với circuit breaker half-open: task có file đã mất không được giữ
+lượt thử của breaker (và chỉ trả lại lượt thử nếu chính nó đang giữ), upload sau đó vẫn chạy
+và đóng breaker lại.
+"""
+import sys
+import os
+import time
+
+import pytest
+
+# Thêm thư mục hiện tại vào Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+pytest.importorskip("requests")
+
+import utils.upload_queue as upload_queue_module
+from utils.circuit_breaker import CircuitBreaker, CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN
+from utils.upload_queue import UploadQueue, KIND_IMAGE, UPLOAD_DONE, UPLOAD_FAILED
+
+def wait_for_status(queue, task_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        task = queue.get(task_id)
+        if task["status"] in (UPLOAD_DONE, UPLOAD_FAILED):
+            return task
+        time.sleep(0.01)
+    return queue.get(task_id)
+
+def test_missing_file_releases_half_open_probe(tmp_path, monkeypatch):
+    breaker = CircuitBreaker("test_upload", failure_threshold=1, failure_window=60, reset_timeout=0.05)
+    monkeypatch.setattr(upload_queue_module, "upload_breaker", breaker)
+    queue = UploadQueue(folder=str(tmp_path / "queue"), workers=1, base_delay=0.01, max_delay=0.01)
+    monkeypatch.setattr(queue, "_upload", lambda task: f"https://host/{os.path.basename(task['file_path'])}")
+
+    # Breaker mở rồi chuyển sang half-open
+    breaker.record_failure("host down")
+    time.sleep(0.06)
+
+    # File không còn: task thất bại, lượt thử được trả lại
+    missing = wait_for_status(queue, queue.enqueue(str(tmp_path / "missing.jpg"), KIND_IMAGE)["task_id"])
+    assert missing["status"] == UPLOAD_FAILED
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert breaker.allow_request("probe")
+    assert breaker.release_probe("probe")
+
+    # Upload bình thường vẫn chạy được và đóng breaker
+    image_path = tmp_path / "photo.jpg"
+    image_path.write_bytes(b"jpeg")
+    uploaded = wait_for_status(queue, queue.enqueue(str(image_path), KIND_IMAGE)["task_id"])
+    assert uploaded["status"] == UPLOAD_DONE
+    assert uploaded["url"] == "https://host/photo.jpg"
+    assert breaker.state == CIRCUIT_CLOSED
+
+def test_probe_released_only_by_its_holder():
+    breaker = CircuitBreaker("test_probe_holder", failure_threshold=1, failure_window=60, reset_timeout=0.05)
+    # Task được cho qua lúc breaker còn đóng (vd. file của nó mất sau đó)
+    assert breaker.allow_request("closed-task")
+    breaker.record_failure("host down")
+    time.sleep(0.06)
+    assert breaker.allow_request("probe-task")
+
+    # Task không giữ lượt thử không trả lại được lượt thử của task đang upload thử
+    assert not breaker.release_probe("closed-task")
+    assert not breaker.release_probe(None)
+    assert not breaker.allow_request("other-task")
+    assert breaker.state == CIRCUIT_HALF_OPEN
+
+    assert breaker.release_probe("probe-task")
+    assert breaker.allow_request("other-task")
+
+def test_wait_returns_when_upload_finishes(tmp_path, monkeypatch):
+    breaker = CircuitBreaker("test_upload_wait", failure_threshold=3, failure_window=60, reset_timeout=30)
+    monkeypatch.setattr(upload_queue_module, "upload_breaker", breaker)
+    queue = UploadQueue(folder=str(tmp_path / "queue"), workers=1, base_delay=0.01, max_delay=0.01)
+    monkeypatch.setattr(queue, "_upload", lambda task: (time.sleep(0.1), "https://host/share.jpg")[1])
+
+    image_path = tmp_path / "share.jpg"
+    image_path.write_bytes(b"jpeg")
+    task_id = queue.enqueue(str(image_path), KIND_IMAGE)["task_id"]
+    # timeout 0: trả về ngay trạng thái hiện tại
+    assert queue.wait(task_id, 0)["url"] is None
+    task = queue.wait(task_id, 5)
+    assert task["status"] == UPLOAD_DONE
+    assert task["url"] == "https://host/share.jpg"
+    assert queue.wait("missing", 1) is None
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Test DecimatingReader với clip ngắn hơn số frame cần đọc: frame sau khi nguồn hết phải là
+frame cuối cùng của clip, kể cả với FFmpegSlotReader (không seek được).
+"""
+import sys
+import os
+
+import pytest
+
+# Thêm thư mục hiện tại vào Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+from utils.ffmpeg_utils import check_ffmpeg_availability
+from utils.video_readers import DecimatingReader, FFmpegSlotReader
+
+SHADES = [20, 60, 100, 140, 180]
+
+class ListReader:
+    """Nguồn chỉ đọc tuần tự như pipe ffmpeg: frame là ảnh 2x2 tô màu theo index"""
+    seekable = False
+
+    def __init__(self, count):
+        self.frames = [np.full((2, 2, 3), index, dtype=np.uint8) for index in range(count)]
+        self.position = 0
+        self.grabbed = None
+
+    def grab(self):
+        if self.position >= len(self.frames):
+            self.grabbed = None
+            return False
+        self.grabbed, self.position = self.frames[self.position], self.position + 1
+        return True
+
+    def retrieve(self):
+        frame, self.grabbed = self.grabbed, None
+        return frame is not None, frame
+
+    def set(self, prop, value):
+        return False
+
+def frame_values(frames):
+    return [None if frame is None else int(frame[0, 0, 0]) for frame in frames]
+
+def test_short_source_repeats_last_grabbed_frame():
+    reader = DecimatingReader(ListReader(5))
+    # Frame 4 chỉ được grab (bỏ qua) trước khi nguồn hết ở frame 5
+    assert frame_values(reader.iter_frames([0, 3, 6, 9])) == [0, 3, 4, 4]
+
+def test_source_ending_before_first_requested_frame():
+    reader = DecimatingReader(ListReader(3))
+    assert frame_values(reader.iter_frames([5, 8])) == [2, 2]
+
+def test_empty_source_returns_none():
+    reader = DecimatingReader(ListReader(0))
+    assert frame_values(reader.iter_frames([0, 1])) == [None, None]
+
+def write_short_clip(path):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), 10, (64, 48))
+    if not writer.isOpened():
+        pytest.skip("OpenCV VideoWriter không ghi được mp4v")
+    for shade in SHADES:
+        writer.write(np.full((48, 64, 3), shade, dtype=np.uint8))
+    writer.release()
+
+@pytest.mark.skipif(not check_ffmpeg_availability(), reason="Cần ffmpeg")
+def test_ffmpeg_slot_reader_short_clip(tmp_path):
+    clip = tmp_path / "short.mp4"
+    write_short_clip(clip)
+    cap = FFmpegSlotReader(str(clip), (32, 24), fps=10)
+    assert cap.isOpened()
+    try:
+        frames = list(DecimatingReader(cap).iter_frames([0, 2, 6, 9]))
+    finally:
+        cap.release()
+    assert all(frame is not None for frame in frames)
+    means = [float(frame.mean()) for frame in frames]
+    assert means[0] == pytest.approx(SHADES[0], abs=6)
+    assert means[1] == pytest.approx(SHADES[2], abs=6)
+    # Hết clip: lặp frame cuối (frame 4, chỉ được grab), không phải frame retrieve gần nhất (frame 2)
+    assert means[2] == pytest.approx(SHADES[-1], abs=6)
+    assert means[3] == pytest.approx(SHADES[-1], abs=6)
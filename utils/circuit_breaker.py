@@ -0,0 +1,133 @@
+# utils/circuit_breaker.py
+"""
+Circuit breaker cho các endpoint bên ngoài (upload host, URL_FRONTEND). Lỗi liên tiếp trong
+CIRCUIT_FAILURE_WINDOW giây làm breaker mở: các request sau không gọi ra ngoài nữa mà fail ngay,
+caller dùng URL local và để việc đó lại sau. Hết CIRCUIT_RESET_TIMEOUT giây thì cho một request
+thử (half-open), thành công thì đóng lại, lỗi thì mở tiếp.
+"""
+import threading
+import time
+from collections import deque
+from config import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_FAILURE_WINDOW, CIRCUIT_RESET_TIMEOUT
+from utils.logging import setup_logging
+
+logger = setup_logging()
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, failure_window=CIRCUIT_FAILURE_WINDOW,
+                 reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.failure_window = failure_window
+        self.reset_timeout = reset_timeout
+        self.state = CIRCUIT_CLOSED
+        self.opened_at = None
+        self.last_error = None
+        self.rejected = 0
+        self.total_failures = 0
+        self.total_successes = 0
+        self._failures = deque()
+        self._probe_holder = None  # Request đang giữ lượt thử half-open
+        self._lock = threading.Lock()
+
+    def allow_request(self, holder=None):
+        """
+        True nếu được gọi ra ngoài (breaker đóng, hoặc là request thử khi half-open).
+
+        Args:
+            holder: Định danh request (vd. task_id), ghi lại khi request nhận lượt thử half-open
+                để chỉ request đó trả lại được (release_probe)
+        """
+        with self._lock:
+            if self.state == CIRCUIT_OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = CIRCUIT_HALF_OPEN
+                self._probe_holder = None
+                logger.info(f"[CIRCUIT {self.name}] Half-open, allowing a probe request")
+            if self.state == CIRCUIT_CLOSED:
+                return True
+            if self.state == CIRCUIT_HALF_OPEN and self._probe_holder is None:
+                self._probe_holder = holder if holder is not None else object()
+                return True
+            self.rejected += 1
+            return False
+
+    @property
+    def is_open(self):
+        """Endpoint đang bị coi là lỗi (open hoặc half-open): caller nên dùng đường dự phòng"""
+        return self.state != CIRCUIT_CLOSED
+
+    def retry_at(self):
+        """Thời điểm nên thử lại (time.time()) khi request bị breaker từ chối"""
+        with self._lock:
+            if self.state == CIRCUIT_OPEN:
+                return self.opened_at + self.reset_timeout
+            if self.state == CIRCUIT_HALF_OPEN:
+                # Request thử đang chạy, chờ kết quả của nó
+                return time.time() + self.reset_timeout
+            return time.time()
+
+    def release_probe(self, holder):
+        """
+        Trả lại lượt thử half-open khi request được cho phép nhưng không gọi ra ngoài (vd. file không còn).
+        Chỉ có tác dụng nếu holder đang giữ lượt thử: request được cho qua lúc breaker còn đóng
+        không trả lại lượt thử của request khác.
+
+        Returns:
+            bool: True nếu lượt thử được trả lại
+        """
+        with self._lock:
+            if holder is None or self._probe_holder != holder:
+                return False
+            self._probe_holder = None
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.total_successes += 1
+            self._failures.clear()
+            if self.state != CIRCUIT_CLOSED:
+                logger.info(f"[CIRCUIT {self.name}] Closed, remote endpoint is back")
+            self.state = CIRCUIT_CLOSED
+            self.opened_at = None
+            self._probe_holder = None
+
+    def record_failure(self, error=None):
+        with self._lock:
+            now = time.time()
+            self.total_failures += 1
+            self.last_error = str(error) if error else None
+            self._failures.append(now)
+            while self._failures and now - self._failures[0] > self.failure_window:
+                self._failures.popleft()
+            if self.state == CIRCUIT_HALF_OPEN or len(self._failures) >= self.failure_threshold:
+                if self.state != CIRCUIT_OPEN:
+                    logger.warning(f"[CIRCUIT {self.name}] Open for {self.reset_timeout}s after "
+                                   f"{len(self._failures)} failures: {self.last_error}")
+                self.state = CIRCUIT_OPEN
+                self.opened_at = now
+                self._probe_holder = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "recent_failures": len(self._failures),
+                "failure_threshold": self.failure_threshold,
+                "failure_window": self.failure_window,
+                "reset_timeout": self.reset_timeout,
+                "opened_at": self.opened_at,
+                "retry_in": round(max(0.0, self.opened_at + self.reset_timeout - time.time()), 1) if self.opened_at else 0.0,
+                "last_error": self.last_error,
+                "rejected": self.rejected,
+                "total_failures": self.total_failures,
+                "total_successes": self.total_successes,
+            }
+
+upload_breaker = CircuitBreaker("upload_host")
+media_session_breaker = CircuitBreaker("media_session")
+
+CIRCUIT_BREAKERS = {breaker.name: breaker for breaker in (upload_breaker, media_session_breaker)}
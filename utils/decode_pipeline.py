@@ -0,0 +1,154 @@
+# utils/decode_pipeline.py
+"""
+Pipeline decode song song cho compositor video: mỗi slot có một thread decoder riêng
+đổ frame vào queue có giới hạn, compositor lấy frame của tất cả slot theo từng bước (lockstep).
+"""
+import queue
+import threading
+import time
+from utils.logging import setup_logging
+
+logger = setup_logging()
+
+_END = object()
+
+class _ProducerError:
+    def __init__(self, error):
+        self.error = error
+
+class PrefetchPipeline:
+    """
+    Args:
+        sources (list): Mỗi phần tử là một iterable trả về frame (hoặc None nếu slot không có frame)
+            cho một slot, chạy trong thread decoder riêng
+        depth (int): Số frame tối đa chờ sẵn trong queue của mỗi slot. <= 0 thì decode tuần tự
+            ngay trong thread compositor (không tạo thread)
+        label (str): Nhãn dùng trong log
+        releases (list, optional): Hàm giải phóng reader của từng slot (vd. cap.release). Pipeline
+            giữ reader từ lúc tạo: mỗi hàm chỉ được gọi sau khi thread decoder của slot đã thoát
+            (trong chính thread đó), hoặc trong close() khi decode tuần tự
+
+    Dùng như context manager; next_frames() trả về list frame theo thứ tự slot,
+    hoặc None khi mọi nguồn đã hết.
+    """
+
+    def __init__(self, sources, depth=4, label="VIDEO", releases=None):
+        self.depth = depth
+        self.label = label
+        self.wait_time = 0.0
+        self.frames = 0
+        self._iterators = [iter(source) for source in sources]
+        self._releases = list(releases) if releases else [None] * len(self._iterators)
+        self._done = [False] * len(self._iterators)
+        self._stop = threading.Event()
+        self._queues = []
+        self._threads = []
+        self._start_time = time.perf_counter()
+
+        if depth > 0:
+            for idx, (iterator, release) in enumerate(zip(self._iterators, self._releases)):
+                q = queue.Queue(maxsize=depth)
+                thread = threading.Thread(target=self._produce, args=(iterator, q, release),
+                                          name=f"{label.lower()}-decoder-{idx}", daemon=True)
+                self._queues.append(q)
+                self._threads.append(thread)
+                thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, iterator, q, release):
+        try:
+            for frame in iterator:
+                if not self._put(q, frame):
+                    return
+            self._put(q, _END)
+        except Exception as e:
+            self._put(q, _ProducerError(e))
+        finally:
+            # Reader chỉ được giải phóng khi thread decoder không còn đọc từ nó
+            self._release_reader(iterator, release)
+
+    def _release_reader(self, iterator, release):
+        try:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            if release is not None:
+                release()
+        except Exception as e:
+            logger.warning(f"[{self.label} DECODE PIPELINE] Error releasing reader: {e}")
+
+    def next_frames(self):
+        """Lấy frame tiếp theo của mọi slot, chặn cho tới khi tất cả decoder có frame"""
+        start = time.perf_counter()
+        items = []
+        for idx, iterator in enumerate(self._iterators):
+            if self._done[idx]:
+                item = _END
+            elif self.depth > 0:
+                item = self._queues[idx].get()
+            else:
+                item = next(iterator, _END)
+            if item is _END:
+                self._done[idx] = True
+            items.append(item)
+        self.wait_time += time.perf_counter() - start
+
+        for item in items:
+            if isinstance(item, _ProducerError):
+                raise item.error
+        if items and all(item is _END for item in items):
+            return None
+        self.frames += 1
+        return [None if item is _END else item for item in items]
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._start_time
+        return {
+            "depth": self.depth,
+            "slots": len(self._iterators),
+            "frames": self.frames,
+            "compositor_wait": self.wait_time,
+            "elapsed": elapsed,
+        }
+
+    def close(self):
+        if self._stop.is_set():
+            return self.stats()
+        self._stop.set()
+        for q in self._queues:
+            # Giải phóng producer đang chờ put
+            try:
+                while True:
+                    q.get_nowait()
+            except queue.Empty:
+                pass
+        for thread in self._threads:
+            thread.join(timeout=5)
+            if thread.is_alive():
+                # Decoder vẫn kẹt trong lần đọc: reader được giải phóng khi thread đó thoát
+                logger.warning(f"[{self.label} DECODE PIPELINE] {thread.name} did not stop within 5s, "
+                               f"its reader will be released when it exits")
+        if self.depth <= 0:
+            for iterator, release in zip(self._iterators, self._releases):
+                self._release_reader(iterator, release)
+
+        stats = self.stats()
+        share = stats["compositor_wait"] / stats["elapsed"] * 100 if stats["elapsed"] else 0
+        logger.info(f"[{self.label} DECODE PIPELINE] depth={self.depth}, slots={stats['slots']}, frames={stats['frames']}, "
+                    f"compositor wait={stats['compositor_wait']:.2f}s ({share:.0f}% of {stats['elapsed']:.2f}s)")
+        return stats
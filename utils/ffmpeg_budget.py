@@ -0,0 +1,169 @@
+# utils/ffmpeg_budget.py
+"""
+Ngân sách thread dùng chung cho mọi tiến trình ffmpeg của server: các encode chạy song song
+(nhiều file trong một batch, nhiều session cùng lúc) chia nhau số core thay vì mỗi ffmpeg
+tự dùng hết core và tranh CPU lẫn nhau. Khi có job ảnh đang chờ/chạy, ngân sách bị hạ xuống
+FFMPEG_THROTTLED_THREADS để encode video không giành CPU với ảnh khách đang đứng chờ.
+
+Mọi tiến trình ffmpeg (chuẩn hóa, encode, reader slot, engine filter_complex) được tạo trong
+một reservation và giữ thread tới khi tiến trình kết thúc. Số thread của tiến trình đang chạy
+không đổi được, nên throttle tác động theo hai cách: reservation mới bị giới hạn theo limit,
+còn các tiến trình đang chạy (đăng ký qua track/run) bị hạ ưu tiên CPU tới khi hết throttle.
+"""
+import os
+import subprocess
+import threading
+from contextlib import contextmanager
+import psutil
+from config import FFMPEG_THREAD_BUDGET, FFMPEG_THROTTLED_THREADS, FFMPEG_THROTTLED_NICE
+from utils.logging import setup_logging
+
+logger = setup_logging()
+
+if os.name == "nt":
+    _PRIORITY_NORMAL, _PRIORITY_THROTTLED = psutil.NORMAL_PRIORITY_CLASS, psutil.BELOW_NORMAL_PRIORITY_CLASS
+else:
+    _PRIORITY_NORMAL, _PRIORITY_THROTTLED = 0, FFMPEG_THROTTLED_NICE
+
+class FFmpegThreadBudget:
+    def __init__(self, total_threads=FFMPEG_THREAD_BUDGET, throttled_threads=FFMPEG_THROTTLED_THREADS):
+        self.total = max(1, int(total_threads))
+        self.throttled_threads = min(self.total, max(1, int(throttled_threads)))
+        self.limit = self.total  # Số thread được cấp tối đa hiện tại (giảm khi throttle)
+        self.available = self.total  # Không bao giờ âm: phần cấp vượt ngân sách ghi vào overcommitted
+        self.overcommitted = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()  # Các reservation thread hiện tại đang giữ (stack)
+        self._processes = set()  # Tiến trình ffmpeg đang chạy, hạ ưu tiên khi throttle
+
+    @property
+    def throttled(self):
+        return self.limit < self.total
+
+    def set_throttled(self, throttled):
+        """Bật/tắt throttle: giới hạn reservation mới và đổi ưu tiên các tiến trình ffmpeg đang chạy"""
+        with self._cond:
+            limit = self.throttled_threads if throttled else self.total
+            if limit == self.limit:
+                return
+            self.limit = limit
+            processes = list(self._processes)
+            self._cond.notify_all()
+        for process in processes:
+            _set_priority(process, throttled)
+        logger.info(f"[FFMPEG BUDGET] {'Throttled' if throttled else 'Restored'} to {limit}/{self.total} threads, "
+                    f"{len(processes)} running ffmpeg processes {'lowered' if throttled else 'restored'}")
+
+    def share(self, concurrent_jobs):
+        """Số thread chia đều cho concurrent_jobs tiến trình ffmpeg chạy cùng lúc"""
+        return max(1, self.limit // max(1, concurrent_jobs))
+
+    def _headroom(self):
+        return self.limit - (self.total - self.available)
+
+    def _grants(self):
+        grants = getattr(self._local, "grants", None)
+        if grants is None:
+            grants = self._local.grants = []
+        return grants
+
+    def acquire(self, threads, minimum=1):
+        """
+        Giữ thread cho một hoặc nhiều tiến trình ffmpeg, trả về số thread được cấp (gọi release sau đó,
+        trong cùng thread). Số được cấp luôn nằm trong [minimum, threads].
+
+        Chờ tới khi còn ít nhất minimum thread trống trong limit rồi cấp min(threads, số thread còn trống).
+        minimum lớn hơn limit (vd. nhiều slot hơn số core, hoặc đang throttle) thì chờ tới khi không còn
+        reservation nào rồi cấp đúng minimum, phần vượt ngân sách ghi vào overcommitted.
+        Thread đang giữ một reservation khác (vd. chuẩn hóa trong lúc render) không chờ và không lấy
+        thêm từ ngân sách: dùng lại tối đa phần reservation ngoài đang giữ, để không deadlock với chính nó.
+        """
+        threads = max(1, int(threads))
+        minimum = min(max(1, int(minimum)), threads)
+        grants = self._grants()
+        if grants:
+            granted = min(threads, grants[-1][0])
+            grants.append((granted, 0, 0))
+            return granted
+
+        with self._cond:
+            if minimum <= self.limit:
+                self._cond.wait_for(lambda: self._headroom() >= minimum)
+                granted = min(threads, self._headroom())
+            else:
+                self._cond.wait_for(lambda: self.available == self.total and not self.overcommitted)
+                granted = minimum
+            taken = min(granted, self.available)
+            self.available -= taken
+            self.overcommitted += granted - taken
+        if granted > taken:
+            logger.warning(f"[FFMPEG BUDGET] Granted {granted} threads, {granted - taken} over the {self.total}-thread budget")
+        grants.append((granted, taken, granted - taken))
+        return granted
+
+    def release(self, granted):
+        grants = self._grants()
+        if not grants or grants[-1][0] != granted:
+            raise RuntimeError(f"ffmpeg budget release({granted}) does not match this thread's last reservation")
+        _, taken, overcommitted = grants.pop()
+        if not taken and not overcommitted:
+            return
+        with self._cond:
+            self.available += taken
+            self.overcommitted -= overcommitted
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, threads, minimum=1):
+        """
+        Giữ thread trong suốt block with (xem acquire). Giá trị yield là số thread được cấp,
+        dùng cho tham số -threads hoặc chia cho các tiến trình trong block.
+        """
+        granted = self.acquire(threads, minimum)
+        try:
+            yield granted
+        finally:
+            self.release(granted)
+
+    def track(self, process):
+        """Đăng ký tiến trình ffmpeg đang chạy (gọi untrack khi kết thúc) để throttle hạ ưu tiên được"""
+        with self._cond:
+            self._processes.add(process)
+            throttled = self.throttled
+        if throttled:
+            _set_priority(process, True)
+
+    def untrack(self, process):
+        with self._cond:
+            self._processes.discard(process)
+
+    def run(self, cmd, check=False, capture_output=False, **kwargs):
+        """subprocess.run cho tiến trình ffmpeg, tiến trình được track trong lúc chạy"""
+        if capture_output:
+            kwargs["stdout"] = kwargs["stderr"] = subprocess.PIPE
+        with subprocess.Popen(cmd, **kwargs) as process:
+            self.track(process)
+            try:
+                stdout, stderr = process.communicate()
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                self.untrack(process)
+        if check and process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+def _set_priority(process, throttled):
+    """
+    Đổi ưu tiên CPU của tiến trình ffmpeg. Trên Linux/macOS không có quyền thì không tăng lại
+    được nice: tiến trình giữ ưu tiên thấp tới khi kết thúc.
+    """
+    try:
+        psutil.Process(process.pid).nice(_PRIORITY_THROTTLED if throttled else _PRIORITY_NORMAL)
+    except psutil.AccessDenied:
+        logger.debug(f"[FFMPEG BUDGET] Cannot restore priority of ffmpeg pid {process.pid}")
+    except (psutil.NoSuchProcess, ProcessLookupError):
+        pass
+
+ffmpeg_thread_budget = FFmpegThreadBudget()
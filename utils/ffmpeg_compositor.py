@@ -0,0 +1,191 @@
+"""
+Engine render video thuần ffmpeg: toàn bộ layout (background, các slot video,
+mask tròn, overlay, tăng tốc cho fast video) được biểu diễn bằng một filter_complex
+duy nhất, không còn vòng lặp frame bằng Python/numpy.
+"""
+import os
+import subprocess
+import platform
+import tempfile
+import time
+from utils.image_processing import get_circle_mask
+from utils.logging import setup_logging
+from utils.ffmpeg_utils import get_ffmpeg_command
+from utils.ffmpeg_budget import ffmpeg_thread_budget
+
+logger = setup_logging()
+
+ENGINE_OPENCV = "opencv"
+ENGINE_FFMPEG = "ffmpeg"
+RENDER_ENGINES = (ENGINE_OPENCV, ENGINE_FFMPEG)
+
+def get_subprocess_args():
+    """
+    Trả về các tham số phù hợp cho subprocess.run tùy theo hệ điều hành
+
+    Returns:
+        dict: Dictionary chứa các tham số cho subprocess.run
+    """
+    args = {}
+    if platform.system() == "Windows":
+        args["creationflags"] = subprocess.CREATE_NO_WINDOW
+    return args
+
+def build_layout_filter_graph(slot_count, output_size, slot_size, positions, fps, speed=1.0,
+                              crop_top=False, has_background=True, has_mask=False, has_overlay=False,
+                              extra_speeds=()):
+    """
+    Dựng filter_complex cho layout.
+
+    Thứ tự input: [0] background (ảnh lặp hoặc màu trắng), [1..n] các slot video,
+    tiếp theo là mask tròn (nếu có) và overlay PNG (nếu có).
+
+    extra_speeds: các output phụ dùng chung kết quả composite (vd. fast video), mỗi output
+    được split từ [out] rồi tăng tốc bằng setpts + fps, label là [extra0], [extra1], ...
+
+    Returns:
+        str: filter_complex, output label chính là [out]
+    """
+    width, height = output_size
+    slot_w, slot_h = slot_size
+    y_expr = "0" if crop_top else "(ih-oh)/2"
+    mask_idx = slot_count + 1
+    overlay_idx = slot_count + 1 + (1 if has_mask else 0)
+
+    chains = []
+    base_fmt = f"scale={width}:{height}," if has_background else ""
+    chains.append(f"[0:v]{base_fmt}fps={fps:.3f},format=yuv420p,setsar=1[base]")
+
+    if has_mask and slot_count > 1:
+        chains.append(f"[{mask_idx}:v]format=gray,split={slot_count}" + "".join(f"[m{i}]" for i in range(slot_count)))
+    elif has_mask:
+        chains.append(f"[{mask_idx}:v]format=gray[m0]")
+
+    for i in range(slot_count):
+        pts = f"setpts=(PTS-STARTPTS)/{speed:.6f}" if speed != 1.0 else "setpts=PTS-STARTPTS"
+        chain = (f"[{i + 1}:v]{pts},fps={fps:.3f},"
+                 f"scale={slot_w}:{slot_h}:force_original_aspect_ratio=increase,"
+                 f"crop={slot_w}:{slot_h}:(iw-ow)/2:{y_expr},setsar=1")
+        if has_mask:
+            chains.append(f"{chain},format=rgba[v{i}]")
+            chains.append(f"[v{i}][m{i}]alphamerge[s{i}]")
+        else:
+            chains.append(f"{chain}[s{i}]")
+
+    current = "base"
+    for i, (x, y) in enumerate(positions[:slot_count]):
+        chains.append(f"[{current}][s{i}]overlay={x}:{y}:eof_action=repeat[b{i}]")
+        current = f"b{i}"
+
+    if has_overlay:
+        chains.append(f"[{overlay_idx}:v]format=rgba[ov]")
+        chains.append(f"[{current}][ov]overlay=0:0[bo]")
+        current = "bo"
+
+    if not extra_speeds:
+        chains.append(f"[{current}]format=yuv420p[out]")
+        return ";".join(chains)
+
+    chains.append(f"[{current}]format=yuv420p,split={len(extra_speeds) + 1}[out]" +
+                  "".join(f"[x{i}]" for i in range(len(extra_speeds))))
+    for i, extra_speed in enumerate(extra_speeds):
+        chains.append(f"[x{i}]setpts=(PTS-STARTPTS)/{extra_speed:.6f},fps={fps:.3f}[extra{i}]")
+    return ";".join(chains)
+
+def render_layout_video(video_files, output_file, output_size, slot_size, positions, fps, duration,
+                        speed=1.0, background_img=None, overlay_img=None, is_circle=False,
+                        crop_top=False, crf=23, preset="fast", threads=1, extra_outputs=None):
+    """
+    Render video layout bằng một lệnh ffmpeg duy nhất.
+
+    Args:
+        video_files (list): Video cho từng slot (theo thứ tự positions)
+        output_file (str): File MP4 output
+        output_size (tuple): (width, height) video output, đã chẵn
+        slot_size (tuple): (width, height) mỗi slot
+        positions (list): Toạ độ (x, y) mỗi slot trong output
+        fps (float): FPS output
+        duration (float): Thời lượng output (giây)
+        speed (float): Hệ số tăng tốc cho fast video (1.0 = tốc độ gốc)
+        background_img (PIL.Image, optional): Background RGB đã fit đúng output_size
+        overlay_img (PIL.Image, optional): Overlay RGBA đã fit đúng output_size
+        is_circle (bool): Cắt slot theo hình tròn
+        crop_top (bool): Crop slot từ trên xuống thay vì giữa
+        threads (int): Số thread cho filter_complex và cho mỗi encoder output; mỗi slot decode bằng 1 thread.
+            Tổng = slot + (số output + 1) * threads, caller giữ từ ngân sách ffmpeg chung
+        extra_outputs (list, optional): [(output_file, speed, duration)] các output phụ
+            render từ cùng một lượt decode/composite (vd. fast video)
+
+    Returns:
+        str: Đường dẫn file output
+
+    Raises:
+        ValueError: Nếu ffmpeg render thất bại
+    """
+    start_time = time.perf_counter()
+    width, height = output_size
+    slot_count = min(len(video_files), len(positions))
+
+    with tempfile.TemporaryDirectory(prefix="layout_") as tmp_dir:
+        cmd = [get_ffmpeg_command(), '-y', '-hide_banner', '-loglevel', 'error', '-nostdin',
+               '-filter_complex_threads', str(threads)]
+
+        if background_img is not None:
+            bg_file = os.path.join(tmp_dir, "background.png")
+            background_img.save(bg_file, "PNG", compress_level=1)
+            cmd.extend(['-loop', '1', '-framerate', f'{fps:.3f}', '-i', bg_file])
+        else:
+            cmd.extend(['-f', 'lavfi', '-i', f'color=c=white:s={width}x{height}:r={fps:.3f}'])
+
+        for video_file in video_files[:slot_count]:
+            cmd.extend(['-threads', '1', '-stream_loop', '-1', '-i', video_file])
+
+        if is_circle:
+            mask_file = os.path.join(tmp_dir, "mask.png")
+            get_circle_mask(tuple(slot_size)).save(mask_file, "PNG")
+            cmd.extend(['-loop', '1', '-framerate', f'{fps:.3f}', '-i', mask_file])
+
+        if overlay_img is not None:
+            ov_file = os.path.join(tmp_dir, "overlay.png")
+            overlay_img.save(ov_file, "PNG", compress_level=1)
+            cmd.extend(['-loop', '1', '-framerate', f'{fps:.3f}', '-i', ov_file])
+
+        extra_outputs = extra_outputs or []
+        graph = build_layout_filter_graph(
+            slot_count, output_size, slot_size, positions, fps, speed, crop_top,
+            has_background=background_img is not None, has_mask=is_circle,
+            has_overlay=overlay_img is not None,
+            extra_speeds=[extra_speed for _, extra_speed, _ in extra_outputs]
+        )
+        cmd.extend(['-filter_complex', graph])
+        targets = [('[out]', output_file, duration)]
+        targets += [(f'[extra{i}]', extra_file, extra_duration)
+                    for i, (extra_file, _, extra_duration) in enumerate(extra_outputs)]
+        for label, target_file, target_duration in targets:
+            cmd.extend([
+                '-map', label,
+                '-t', f'{target_duration:.3f}',
+                '-an',
+                '-c:v', 'libx264',
+                '-preset', preset,
+                '-crf', str(crf),
+                '-pix_fmt', 'yuv420p',
+                '-profile:v', 'high',
+                '-level', '4.0',
+                '-movflags', '+faststart',
+                '-threads', str(threads),
+                target_file
+            ])
+
+        logger.info(f"[FFMPEG ENGINE] Rendering {slot_count} slots -> {output_file} ({width}x{height}, {duration}s, speed x{speed:g})")
+        try:
+            ffmpeg_thread_budget.run(cmd, check=True, capture_output=True, text=True, **get_subprocess_args())
+        except subprocess.CalledProcessError as e:
+            raise ValueError(f"FFmpeg layout render failed: {e.stderr[-2000:] if e.stderr else e}") from e
+
+    for _, target_file, _ in targets:
+        if not os.path.exists(target_file) or os.path.getsize(target_file) == 0:
+            raise ValueError(f"FFmpeg layout render produced no output: {target_file}")
+
+    logger.info(f"[FFMPEG ENGINE] Done in {time.perf_counter() - start_time:.2f}s: {output_file}")
+    return output_file
@@ -1,6 +1,7 @@
 # utils/file_handling.py
 import os
 import uuid
+import hashlib
 from werkzeug.utils import secure_filename
 from config import ALLOWED_EXTENSIONS, UPLOAD_FOLDER, OUTPUT_FOLDER
 
@@ -16,6 +17,14 @@ def save_file(file, folder, prefix=""):
     file.save(file_path)
     return file_path
 
+def hash_file_content(file_path, chunk_size=1024 * 1024):
+    """SHA-256 nội dung file"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 def cleanup_files(file_paths):
     for file_path in file_paths:
         try:
@@ -1,6 +1,9 @@
 # utils/filters.py
 from PIL import Image, ImageEnhance, ImageOps, ImageFilter, ImageDraw
+import threading
+from collections import OrderedDict
 import numpy as np
+from config import FILTER_LUT_CACHE_SIZE
 
 FILTERS = {
     "none": {},
@@ -16,7 +19,145 @@ FILTERS = {
     "dreamy": {"brightness": 1.05, "contrast": 0.95, "saturation": 0.9, "blur": 0.5, "hue_rotate": 5},
 }
 
+# Thứ tự các bước màu, giống thứ tự áp dụng của bản PIL (sepia trước, rồi brightness/contrast/saturation)
+COLOR_STEPS = ("sepia", "brightness", "contrast", "saturation", "hue_rotate", "grayscale")
+LUT_SIZE = 33
+SEPIA_MATRIX = np.array([
+    [0.393, 0.769, 0.189],
+    [0.349, 0.686, 0.168],
+    [0.272, 0.534, 0.131]
+])
+# Hệ số luma giống Image.convert("L") mà ImageEnhance dùng
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114])
+
+def hue_rotate_matrix(degrees):
+    """Ma trận hue-rotate theo CSS filter (feColorMatrix type=hueRotate)"""
+    angle = np.radians(degrees)
+    cos_a, sin_a = np.cos(angle), np.sin(angle)
+    return (np.array([[0.213, 0.715, 0.072], [0.213, 0.715, 0.072], [0.213, 0.715, 0.072]])
+            + cos_a * np.array([[0.787, -0.715, -0.072], [-0.213, 0.285, -0.072], [-0.213, -0.715, 0.928]])
+            + sin_a * np.array([[-0.213, -0.715, 0.928], [0.143, 0.140, -0.283], [-0.787, 0.715, 0.072]]))
+
+def grayscale_matrix(amount):
+    """Ma trận grayscale theo CSS filter, amount 0..1"""
+    amount = min(max(amount, 0.0), 1.0)
+    gray = np.array([[0.2126, 0.7152, 0.0722]] * 3)
+    return (1 - amount) * np.eye(3) + amount * gray
+
+def _apply_color_steps(rgb, steps, contrast_mean=None):
+    """
+    Áp dụng các bước màu lên mảng float (..., 3), clip sau mỗi bước như khi PIL
+    ghi ra ảnh uint8 giữa các lượt ImageEnhance.
+    """
+    for name, value in steps:
+        if name == "sepia":
+            # apply_sepia luôn áp dụng sepia đầy đủ (không dùng intensity), giữ nguyên để không đổi màu filter
+            rgb = rgb @ SEPIA_MATRIX.T
+        elif name == "brightness":
+            rgb = rgb * value
+        elif name == "contrast":
+            rgb = contrast_mean + value * (rgb - contrast_mean)
+        elif name == "saturation":
+            luma = (rgb @ LUMA_WEIGHTS)[..., None]
+            rgb = luma + value * (rgb - luma)
+        elif name == "hue_rotate":
+            rgb = rgb @ hue_rotate_matrix(value).T
+        elif name == "grayscale":
+            rgb = rgb @ grayscale_matrix(value).T
+        rgb = np.clip(rgb, 0, 255)
+    return rgb
+
+class CompiledFilter:
+    """
+    Một filter trong FILTERS được biên dịch thành:
+    - các bước màu gộp vào một 3D LUT (Color3DLUT, áp dụng một lượt uint8 trong C)
+    - các bước tích chập còn lại (sharpness, blur)
+
+    Contrast của ImageEnhance phụ thuộc độ sáng trung bình của ảnh, nên LUT có contrast
+    được dựng theo từng giá trị trung bình (0..255) và giữ FILTER_LUT_CACHE_SIZE LUT dùng gần nhất
+    (ảnh trong cùng một buổi chụp có độ sáng gần nhau nên số giá trị thực tế ít).
+    """
+
+    def __init__(self, filter_id, params):
+        self.filter_id = filter_id
+        self.color_steps = [(name, params[name]) for name in COLOR_STEPS if name in params]
+        self.sharpness = params.get("sharpness")
+        self.blur = params.get("blur")
+        names = [name for name, _ in self.color_steps]
+        self._pre_contrast = self.color_steps[:names.index("contrast")] if "contrast" in names else None
+        self._luts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _contrast_mean(self, img):
+        """Độ sáng trung bình (L) của ảnh tại bước contrast, đo trên ảnh thu nhỏ"""
+        if self._pre_contrast is None:
+            return None
+        sample = img.convert("RGB")
+        factor = max(1, min(sample.width, sample.height) // 128)
+        if factor > 1:
+            sample = sample.reduce(factor)
+        rgb = _apply_color_steps(np.asarray(sample, dtype=np.float32), self._pre_contrast)
+        return int((np.rint(rgb) @ LUMA_WEIGHTS).mean() + 0.5)
+
+    def _build_lut(self, contrast_mean):
+        # Color3DLUT: kênh r thay đổi nhanh nhất, rồi g, rồi b
+        axis = np.linspace(0, 255, LUT_SIZE, dtype=np.float32)
+        b, g, r = np.meshgrid(axis, axis, axis, indexing="ij")
+        grid = np.stack([r, g, b], axis=-1).reshape(-1, 3)
+        table = (_apply_color_steps(grid, self.color_steps, contrast_mean) / 255.0).astype(np.float32)
+        # Bảng float32 numpy (~0.4 MB) thay vì list float Python (~3.4 MB)
+        return ImageFilter.Color3DLUT(LUT_SIZE, table, copy_table=False)
+
+    def get_lut(self, contrast_mean=None):
+        with self._lock:
+            lut = self._luts.get(contrast_mean)
+            if lut is not None:
+                self._luts.move_to_end(contrast_mean)
+                return lut
+        # Dựng LUT ngoài lock để các thread khác dùng filter này không phải chờ
+        lut = self._build_lut(contrast_mean)
+        with self._lock:
+            self._luts[contrast_mean] = lut
+            self._luts.move_to_end(contrast_mean)
+            while len(self._luts) > FILTER_LUT_CACHE_SIZE:
+                self._luts.popitem(last=False)
+        return lut
+
+    def apply(self, img):
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+        if self.color_steps:
+            # Color3DLUT giữ nguyên kênh alpha của ảnh RGBA
+            img = img.filter(self.get_lut(self._contrast_mean(img)))
+        if self.sharpness is not None:
+            img = ImageEnhance.Sharpness(img).enhance(self.sharpness)
+        # Blur được áp dụng cuối cùng để tránh làm mờ các enhancement khác
+        if self.blur:
+            img = img.filter(ImageFilter.GaussianBlur(radius=self.blur))
+        return img
+
+_compiled_filters = {}
+_compiled_lock = threading.Lock()
+
+def get_compiled_filter(filter_id):
+    """CompiledFilter cho filter_id (biên dịch một lần), None nếu không có trong FILTERS"""
+    if filter_id not in FILTERS:
+        return None
+    with _compiled_lock:
+        compiled = _compiled_filters.get(filter_id)
+        if compiled is None:
+            compiled = CompiledFilter(filter_id, FILTERS[filter_id])
+            _compiled_filters[filter_id] = compiled
+        return compiled
+
 def apply_filter_to_image(img, filter_id):
+    compiled = get_compiled_filter(filter_id)
+    if compiled is None:
+        return img
+    return compiled.apply(img)
+
+def apply_filter_to_image_pil(img, filter_id):
+    """Bản cũ: mỗi bước là một lượt ImageEnhance riêng (giữ lại làm chuẩn so sánh / benchmark)"""
     if filter_id not in FILTERS:
         return img
     
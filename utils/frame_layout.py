@@ -0,0 +1,122 @@
+# utils/frame_layout.py
+"""
+Layout đã tính sẵn cho từng frame type ở hai tỉ lệ: "print" (khung in) và "video" (thu nhỏ ~1500px).
+Được dựng một lần khi import, mọi đường xử lý ảnh/video dùng chung để không phải tính lại
+kích thước, vị trí slot, hướng crop và vị trí QR ở mỗi request (mask tròn dựng ở lần dùng đầu tiên).
+"""
+from config import FRAME_TYPES, get_frame_margin, get_frame_gap
+from utils.image_processing import (
+    get_frame_size, calc_positions, get_image_crop_direction, get_slot_crop_top, get_circle_mask, get_circle_alpha
+)
+
+SCALE_PRINT = "print"
+SCALE_VIDEO = "video"
+
+QR_SIZE = 180
+VIDEO_MAX_SIDE = 1500
+
+class FrameLayout:
+    __slots__ = (
+        "frame_id", "frame_type", "scale", "columns", "rows", "is_custom", "is_circle",
+        "width", "height", "print_size", "output_width", "is_doubled",
+        "slot_width", "slot_height", "positions", "slot_count",
+        "slot_crop_top", "template_crop", "qr_position", "qr_size",
+    )
+
+    def __init__(self, frame_id, frame_type, scale=SCALE_PRINT):
+        self.frame_id = frame_id
+        self.frame_type = frame_type
+        self.scale = scale
+        self.columns = frame_type["columns"]
+        self.rows = frame_type["rows"]
+        self.is_custom = frame_type.get("isCustom", False)
+        self.is_circle = frame_type.get("isCircle", False)
+        self.slot_crop_top = get_slot_crop_top(frame_type)
+        self.template_crop = get_image_crop_direction(frame_type)
+
+        print_width, print_height = get_frame_size(frame_type)
+        self.print_size = (print_width, print_height)
+        slot_width, slot_height, positions = calc_positions(
+            frame_type, print_width, print_height, get_frame_margin(frame_id), get_frame_gap(frame_id)
+        )
+
+        if scale == SCALE_VIDEO:
+            factor = min(VIDEO_MAX_SIDE / max(print_width, print_height), 1.0) if max(print_width, print_height) > 2000 else 1.0
+            self.width = int(print_width * factor) & ~1
+            self.height = int(print_height * factor) & ~1
+            self.positions = tuple((int(x * factor), int(y * factor)) for x, y in positions)
+            self.slot_width = int(slot_width * factor)
+            self.slot_height = int(slot_height * factor)
+            self.is_doubled = False
+            self.output_width = self.width
+            self.qr_position = None
+            self.qr_size = 0
+        else:
+            self.width, self.height = print_width, print_height
+            self.positions = tuple(positions)
+            self.slot_width, self.slot_height = slot_width, slot_height
+            # Frame custom 1 cột được in thành ảnh kép (2 dải cạnh nhau)
+            self.is_doubled = self.is_custom and self.columns == 1
+            self.output_width = print_width * 2 if self.is_doubled else print_width
+            qr_margin = 160 if self.is_custom and self.rows == 4 else 80
+            self.qr_size = QR_SIZE
+            self.qr_position = (self.width - QR_SIZE - qr_margin, self.height - QR_SIZE - qr_margin)
+
+        self.slot_count = self.columns * self.rows
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def slot_size(self):
+        return self.slot_width, self.slot_height
+
+    @property
+    def strip_offsets(self):
+        """Toạ độ x của từng dải trên ảnh output (ảnh kép có hai dải cạnh nhau)"""
+        return (0, self.width) if self.is_doubled else (0,)
+
+    @property
+    def circle_mask(self):
+        """
+        Mask tròn dùng chung (cache theo kích thước, dựng ở lần dùng đầu tiên chứ không khi import):
+        PIL "L" cho ảnh in, cặp trọng số (alpha, 1 - alpha) cho video. None nếu slot không tròn.
+        """
+        if not self.is_circle:
+            return None
+        if self.scale == SCALE_VIDEO:
+            return get_circle_alpha(self.slot_size)
+        side = min(self.slot_width, self.slot_height)
+        return get_circle_mask((side, side))
+
+    def __repr__(self):
+        return (f"FrameLayout({self.frame_id!r}, {self.scale}, {self.width}x{self.height}, "
+                f"slots={self.slot_count} @ {self.slot_width}x{self.slot_height})")
+
+def _layout_key(frame_type):
+    return (frame_type["columns"], frame_type["rows"], frame_type.get("isCustom", False), frame_type.get("isCircle", False))
+
+FRAME_LAYOUTS = {}
+_LAYOUT_IDS = {}
+for _frame_id, _frame_type in FRAME_TYPES.items():
+    _LAYOUT_IDS.setdefault(_layout_key(_frame_type), _frame_id)
+    for _scale in (SCALE_PRINT, SCALE_VIDEO):
+        FRAME_LAYOUTS[(_frame_id, _scale)] = FrameLayout(_frame_id, _frame_type, _scale)
+
+def get_frame_layout(frame, scale=SCALE_PRINT):
+    """
+    Args:
+        frame: frame_id (str/int) hoặc dict frame type trong FRAME_TYPES
+        scale (str): "print" hoặc "video"
+
+    Raises:
+        ValueError: Nếu frame type không tồn tại
+    """
+    if isinstance(frame, FrameLayout):
+        frame = frame.frame_id
+    frame_id = _LAYOUT_IDS.get(_layout_key(frame)) if isinstance(frame, dict) else str(frame)
+    try:
+        return FRAME_LAYOUTS[(frame_id, scale)]
+    except KeyError:
+        raise ValueError("Invalid frame type!")
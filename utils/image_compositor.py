@@ -0,0 +1,45 @@
+# utils/image_compositor.py
+"""
+Ghép ảnh in từ các tile slot đã chuẩn bị sẵn. Canvas làm việc ở RGB (không cần kênh alpha cho
+toàn khung), alpha chỉ còn ở tile slot và overlay khi dán. Ảnh kép (frame custom 1 cột) được
+ghép thẳng hai dải lên canvas output, không tạo thêm bản sao của dải.
+"""
+from PIL import Image
+from utils.image_processing import get_tile_paste_mask
+
+def compose_print_image(layout, tiles, background_img=None, overlay_img=None, qr_img=None):
+    """
+    Args:
+        layout (FrameLayout): Layout khung in
+        tiles (list): Tile PIL RGBA đã fit đúng layout.slot_size theo thứ tự layout.positions
+        background_img (PIL.Image, optional): Background RGB kích thước layout.size
+        overlay_img (PIL.Image, optional): Overlay RGBA kích thước layout.size
+        qr_img (PIL.Image, optional): QR code dán tại layout.qr_position
+
+    Returns:
+        PIL.Image: Ảnh RGB kích thước (layout.output_width, layout.height)
+    """
+    frame = Image.new("RGB", (layout.output_width, layout.height), (255, 255, 255))
+    offsets = layout.strip_offsets
+
+    if background_img:
+        background_img = background_img if background_img.mode == "RGB" else background_img.convert("RGB")
+        for offset_x in offsets:
+            frame.paste(background_img, (offset_x, 0))
+
+    for tile, (x, y) in zip(tiles, layout.positions):
+        # Tile đục và không tròn được copy thẳng, không blend
+        mask = get_tile_paste_mask(tile, layout.circle_mask)
+        for offset_x in offsets:
+            frame.paste(tile, (x + offset_x, y), mask)
+
+    if overlay_img:
+        for offset_x in offsets:
+            frame.paste(overlay_img, (offset_x, 0), overlay_img if overlay_img.mode == "RGBA" else None)
+
+    # QR code nằm trong từng dải (trước đây được thêm trước khi nhân đôi dải)
+    if qr_img is not None and layout.qr_position:
+        qr_x, qr_y = layout.qr_position
+        for offset_x in offsets:
+            frame.paste(qr_img, (qr_x + offset_x, qr_y))
+    return frame
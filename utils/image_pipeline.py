@@ -0,0 +1,98 @@
+# utils/image_pipeline.py
+"""
+Stage chuẩn bị ảnh cho từng slot (decode, resize/crop về kích thước slot, filter) chạy song song
+trên một worker pool dùng chung; bước composite chỉ còn dán các tile đã sẵn sàng.
+"""
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from PIL import Image
+from config import MAX_INPUT_IMAGE_SIZE, IMAGE_SLOT_EXECUTOR, IMAGE_SLOT_WORKERS
+from utils.filters import apply_filter_to_image
+from utils.image_processing import fit_slot_image
+from utils.logging import setup_logging
+
+logger = setup_logging()
+
+SLOT_EXECUTOR_THREAD = "thread"
+SLOT_EXECUTOR_PROCESS = "process"
+SLOT_EXECUTORS = (SLOT_EXECUTOR_THREAD, SLOT_EXECUTOR_PROCESS)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_slot_pool(kind=None):
+    """Worker pool dùng chung cho mọi request (tạo lần đầu khi cần)"""
+    kind = kind or IMAGE_SLOT_EXECUTOR
+    with _pools_lock:
+        pool = _pools.get(kind)
+        if pool is None:
+            if kind == SLOT_EXECUTOR_PROCESS:
+                pool = ProcessPoolExecutor(max_workers=IMAGE_SLOT_WORKERS)
+            else:
+                pool = ThreadPoolExecutor(max_workers=IMAGE_SLOT_WORKERS, thread_name_prefix="image-slot")
+            _pools[kind] = pool
+        return pool
+
+def plan_slot_decode(image_size, slot_size, is_circle=False):
+    """
+    Tính kích thước decode nhỏ nhất vẫn đủ cho slot: ảnh phải phủ kín slot sau resize,
+    và không lớn hơn giới hạn MAX_INPUT_IMAGE_SIZE (ảnh lớn hơn vốn bị thumbnail về đó).
+
+    Returns:
+        tuple: (width, height) cần decode, giữ tỉ lệ ảnh gốc
+    """
+    img_w, img_h = image_size
+    slot_w, slot_h = slot_size
+    if is_circle:
+        slot_w = slot_h = min(slot_w, slot_h)
+    cover_scale = max(slot_w / img_w, slot_h / img_h)
+    limit_scale = min(MAX_INPUT_IMAGE_SIZE / img_w, MAX_INPUT_IMAGE_SIZE / img_h)
+    scale = min(1.0, cover_scale, limit_scale)
+    return max(1, math.ceil(img_w * scale)), max(1, math.ceil(img_h * scale))
+
+def prepare_slot_tile(image_path, size, is_circle, crop_top=False, filter_id=None):
+    """
+    Decode + resize/crop + filter một ảnh về đúng kích thước slot (RGBA).
+    JPEG được decode ở tỉ lệ DCT nhỏ nhất còn đủ cho slot (draft 1/2, 1/4, 1/8),
+    filter áp dụng sau khi đã về kích thước slot. Hàm top-level để chạy được trong process pool.
+    """
+    img = Image.open(image_path)
+    decode_size = plan_slot_decode(img.size, size, is_circle)
+    if img.format == "JPEG":
+        # draft chọn scale DCT lớn nhất mà ảnh vẫn >= decode_size
+        img.draft("RGB", decode_size)
+    else:
+        # Ảnh không phải JPEG: box-reduce theo hệ số nguyên, chừa gấp đôi cho bước LANCZOS
+        factor = int(min(img.width / decode_size[0], img.height / decode_size[1]) / 2)
+        if factor >= 2:
+            img = img.reduce(factor)
+    img = img.convert("RGBA")
+    if img.width > MAX_INPUT_IMAGE_SIZE or img.height > MAX_INPUT_IMAGE_SIZE:
+        img.thumbnail((MAX_INPUT_IMAGE_SIZE, MAX_INPUT_IMAGE_SIZE), Image.Resampling.BICUBIC)
+
+    img = fit_slot_image(img, size, is_circle, crop_top=crop_top)
+    if filter_id and filter_id != 'none':
+        img = apply_filter_to_image(img, filter_id)
+    return img
+
+def prepare_slot_tiles(image_files, size, is_circle, crop_top=False, filter_id=None, executor=None):
+    """
+    Chuẩn bị tile cho tất cả slot song song.
+
+    Args:
+        executor (str, optional): "thread" hoặc "process" (mặc định IMAGE_SLOT_EXECUTOR).
+            Process pool phù hợp với filter nặng CPU (blur, sharpness, sepia)
+
+    Returns:
+        list: Tile PIL RGBA theo thứ tự image_files
+    """
+    start_time = time.perf_counter()
+    pool = get_slot_pool(executor)
+    futures = [pool.submit(prepare_slot_tile, image_path, size, is_circle, crop_top, filter_id)
+               for image_path in image_files]
+    tiles = [future.result() for future in futures]
+    logger.info(f"[IMAGE SLOTS] {len(tiles)} tiles ({executor or IMAGE_SLOT_EXECUTOR}, filter={filter_id}) "
+                f"in {time.perf_counter() - start_time:.2f}s")
+    return tiles
@@ -1,5 +1,6 @@
 # utils/image_processing.py
-from PIL import Image, ImageDraw, ImageFilter, ImageEnhance
+from functools import lru_cache
+from PIL import Image, ImageChops, ImageEnhance
 import numpy as np
 from config import FRAME_TYPES, ASPECT_RATIOS, HEIGHT_IMAGE, WIDTH_IMAGE, HEIGHT_IMAGE_CUSTOM
 from .file_handling import save_file
@@ -50,6 +51,21 @@ def calc_positions(frame_type, total_width, total_height, margin, gap):
         for r in range(rows) for c in range(cols)
     ]
 
+def get_slot_crop_top(frame_type):
+    """Ảnh/video trong slot crop từ trên xuống với frame 1x1 (không tròn), 2x2 và 1x2 ngang, còn lại crop giữa"""
+    if not frame_type:
+        return False
+    if frame_type.get("columns") == 1 and frame_type.get("rows") == 1 and not frame_type.get("isCircle", False):
+        return True
+    if frame_type.get("columns") == 2 and frame_type.get("rows") == 2:
+        return True
+    # Frame 1x2 ngang cũng crop từ top như frame 2x2
+    return frame_type.get("columns") == 1 and frame_type.get("rows") == 2 and not frame_type.get("isCustom", False)
+
+def get_image_crop_direction(frame_type):
+    """Hướng crop background/overlay cho ảnh in: từ trên xuống với frame 1x1 (không tròn), 2x2 và 1x2 ngang"""
+    return "top" if get_slot_crop_top(frame_type) else "center"
+
 def fit_cover_image(image, output_size, crop_direction="center"):
     if image.size == output_size:
         return image
@@ -79,7 +95,11 @@ def fit_cover_image(image, output_size, crop_direction="center"):
         return enhancer.enhance(1.1)  # Giảm sharpness để nhanh hơn
     return image
 
-def paste_image(frame, img, pos, size, is_circle, frame_type=None):
+def fit_slot_image(img, size, is_circle, frame_type=None, crop_top=None):
+    """
+    Resize + crop ảnh phủ kín slot. crop_top mặc định theo get_slot_crop_top(frame_type)
+    (FrameLayout.slot_crop_top khi đã có layout).
+    """
     if is_circle:
         size = (min(size[0], size[1]), min(size[0], size[1]))
     
@@ -90,34 +110,84 @@ def paste_image(frame, img, pos, size, is_circle, frame_type=None):
     if scale != 1.0:
         img = img.resize((int(img.width * scale), int(img.height * scale)), Image.Resampling.LANCZOS)
 
-    crop_left = crop_top = False
-    if frame_type:
-        if frame_type.get("columns") == 1 and frame_type.get("rows") == 1 and not frame_type.get("isCircle", False):
-            crop_top = True
-        elif frame_type.get("columns") == 2 and frame_type.get("rows") == 2:
-            crop_top = True
-        # Frame 1x2 ngang cũng crop từ top như frame 2x2
-        elif frame_type.get("columns") == 1 and frame_type.get("rows") == 2 and not frame_type.get("isCustom", False):
-            crop_top = True
+    crop_left = False
+    if crop_top is None:
+        crop_top = get_slot_crop_top(frame_type)
     
     left = 0 if crop_left else (img.width - size[0]) // 2
     top = 0 if crop_top else (img.height - size[1]) // 2
     left = max(0, min(left, img.width - size[0]))
     top = max(0, min(top, img.height - size[1]))
     
-    img = img.crop((left, top, left + size[0], top + size[1]))
+    if (left, top, left + size[0], top + size[1]) != (0, 0, img.width, img.height):
+        img = img.crop((left, top, left + size[0], top + size[1]))
     if img.size != size:
         img = img.resize(size, Image.Resampling.LANCZOS)
-    
-    if is_circle:
-        mask = Image.new('L', size, 0)
-        ImageDraw.Draw(mask).ellipse((0, 0, size[0]-1, size[1]-1), fill=255)
-        # Giảm blur radius để nhanh hơn
-        mask = mask.filter(ImageFilter.GaussianBlur(radius=0.3))
-        bg = Image.new('RGBA', size, (255, 255, 255, 0))
-        bg.paste(img, (0, 0), mask)
-        frame.paste(bg, pos, bg)
-    else:
-        frame.paste(img, pos, img)
-    
-    return frame
\ No newline at end of file
+    return img
+
+CIRCLE_MASK_BLOCK_ROWS = 256
+
+def _circle_coverage(size, scale=1.0, dtype=np.float32):
+    """
+    Độ phủ của ellipse nội tiếp khung size (mảng (h, w), nhân với scale), tính trực tiếp ở 1x:
+    khoảng cách có dấu (xấp xỉ bậc một) từ tâm pixel tới viền, viền khử răng cưa trong 1 pixel.
+    Không vẽ ở độ phân giải gấp nhiều lần (slot ~3000px vẽ 4x tốn ~144 MB); tính theo từng khối
+    CIRCLE_MASK_BLOCK_ROWS dòng nên bộ nhớ tạm chỉ cỡ vài khối.
+    """
+    width, height = size
+    rx, ry = width / 2.0, height / 2.0
+    dx = ((np.arange(width, dtype=np.float32) + 0.5 - rx) / rx)[np.newaxis, :]
+    coverage = np.empty((height, width), dtype=dtype)
+    for top in range(0, height, CIRCLE_MASK_BLOCK_ROWS):
+        rows = np.arange(top, min(height, top + CIRCLE_MASK_BLOCK_ROWS), dtype=np.float32)
+        dy = ((rows + 0.5 - ry) / ry)[:, np.newaxis]
+        radius = np.sqrt(dx * dx + dy * dy)
+        # |grad radius| theo pixel; gần tâm chặn dưới để không chia cho 0 (ở đó độ phủ luôn là 1)
+        gradient = np.sqrt((dx / rx) ** 2 + (dy / ry) ** 2) / np.maximum(radius, 1e-6)
+        block = np.clip((1.0 - radius) / np.maximum(gradient, 1.0 / max(rx, ry)) + 0.5, 0.0, 1.0) * scale
+        coverage[top:top + len(rows)] = np.round(block) if np.issubdtype(dtype, np.integer) else block
+    return coverage
+
+@lru_cache(maxsize=32)
+def get_circle_mask(size):
+    """
+    Mask tròn (PIL "L") cho slot kích thước size, viền khử răng cưa (xem _circle_coverage).
+    Cache theo size, caller không được sửa mask.
+    """
+    return Image.fromarray(_circle_coverage(size, 255.0, np.uint8), 'L')
+
+@lru_cache(maxsize=32)
+def get_circle_alpha(size):
+    """
+    Trọng số blend (alpha, 1 - alpha) float32 kích thước (h, w) của mask tròn,
+    dùng cho cv2.blendLinear khi dán slot tròn vào frame video.
+    """
+    alpha = _circle_coverage(size)
+    alpha.setflags(write=False)
+    inv_alpha = 1.0 - alpha
+    inv_alpha.setflags(write=False)
+    return alpha, inv_alpha
+
+def get_tile_paste_mask(tile, circle_mask=None):
+    """
+    Mask dùng khi dán tile slot: None nếu tile đục và slot không tròn (copy thẳng),
+    ngược lại là mask tròn và/hoặc alpha của tile.
+    """
+    alpha = None
+    if tile.mode == 'RGBA':
+        alpha = tile.getchannel('A')
+        if alpha.getextrema()[0] == 255:
+            alpha = None
+    if circle_mask is None:
+        return alpha
+    if circle_mask.size != tile.size:
+        circle_mask = get_circle_mask(tile.size)
+    # Ảnh có vùng trong suốt thì giữ alpha gốc bên trong hình tròn
+    return ImageChops.multiply(circle_mask, alpha) if alpha is not None else circle_mask
+
+def paste_image(frame, img, pos, size, is_circle, frame_type=None, mask=None):
+    img = fit_slot_image(img, size, is_circle, frame_type)
+    if is_circle and mask is None:
+        mask = get_circle_mask(img.size)
+    frame.paste(img, pos, get_tile_paste_mask(img, mask if is_circle else None))
+    return frame
@@ -0,0 +1,137 @@
+# utils/media_probe.py
+"""
+Service probe media dùng chung: mỗi file chỉ chạy ffprobe một lần, kết quả cache theo
+(path, size, mtime) nên các bước trong cùng request (kiểm tra codec, lấy fps, kiểm tra
+toàn vẹn trước upload...) không phải spawn ffprobe lại. Probe lỗi không được cache
+(file có thể đang được ghi dở), lần gọi sau chạy lại ffprobe.
+"""
+import json
+import os
+import platform
+import subprocess
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+from config import MEDIA_PROBE_CACHE_SIZE
+from utils.logging import setup_logging
+from utils.ffmpeg_utils import get_ffprobe_command, check_ffprobe_availability
+
+logger = setup_logging()
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def get_subprocess_args():
+    """
+    Trả về các tham số phù hợp cho subprocess.run tùy theo hệ điều hành
+
+    Returns:
+        dict: Dictionary chứa các tham số cho subprocess.run
+    """
+    args = {}
+    if platform.system() == "Windows":
+        args["creationflags"] = subprocess.CREATE_NO_WINDOW
+    return args
+
+def parse_frame_rate(rate, default=None):
+    """
+    Parse frame rate dạng "30000/1001", "30/1" hoặc "29.97" (không dùng eval).
+
+    Returns:
+        float: FPS, hoặc default nếu không hợp lệ (vd. "0/0")
+    """
+    try:
+        value = Fraction(str(rate))
+    except (ValueError, ZeroDivisionError):
+        return default
+    return float(value) if value > 0 else default
+
+def _to_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def _summarize(data):
+    streams = data.get('streams', [])
+    fmt = data.get('format', {})
+    video_stream = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio_stream = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    info = {
+        'streams': streams,
+        'format': fmt,
+        'video_codec': video_stream.get('codec_name') if video_stream else None,
+        'audio_codec': audio_stream.get('codec_name') if audio_stream else None,
+        'pix_fmt': video_stream.get('pix_fmt') if video_stream else None,
+        'width': int(video_stream.get('width') or 0) if video_stream else 0,
+        'height': int(video_stream.get('height') or 0) if video_stream else 0,
+        'fps': None,
+        'duration': _to_float(fmt.get('duration')),
+        'frame_count': 0,
+    }
+    if video_stream:
+        info['fps'] = (parse_frame_rate(video_stream.get('r_frame_rate'))
+                       or parse_frame_rate(video_stream.get('avg_frame_rate')))
+        info['duration'] = _to_float(video_stream.get('duration'), info['duration'])
+        nb_frames = video_stream.get('nb_frames')
+        if nb_frames and str(nb_frames).isdigit():
+            info['frame_count'] = int(nb_frames)
+        elif info['fps'] and info['duration']:
+            # WebM thường không có nb_frames: ước lượng từ duration (đếm frame thật phải decode cả file)
+            info['frame_count'] = int(round(info['duration'] * info['fps']))
+    return info
+
+def probe_media(file_path):
+    """
+    Probe file media (cache theo path + size + mtime).
+
+    Returns:
+        dict: {'streams', 'format', 'video_codec', 'audio_codec', 'pix_fmt', 'width', 'height',
+               'fps', 'duration', 'frame_count'}, hoặc None nếu không có ffprobe / không probe được
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    if not check_ffprobe_availability():
+        return None
+
+    try:
+        cmd = [
+            get_ffprobe_command(), '-v', 'quiet', '-print_format', 'json',
+            '-show_format', '-show_streams', file_path
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True, **get_subprocess_args())
+        info = _summarize(json.loads(result.stdout))
+    except (subprocess.CalledProcessError, json.JSONDecodeError, OSError) as e:
+        logger.warning(f"[MEDIA PROBE] ffprobe failed for {file_path}: {e}")
+        return None
+
+    with _cache_lock:
+        _cache[key] = info
+        while len(_cache) > MEDIA_PROBE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
+
+def has_video_stream(file_path):
+    """
+    File có video stream hợp lệ (kích thước và ít nhất một frame) theo metadata ffprobe.
+    Chỉ đọc metadata, không decode: file hỏng phần dữ liệu frame vẫn có thể trả về True.
+
+    Returns:
+        bool | None: None nếu không probe được bằng ffprobe (caller tự fallback)
+    """
+    if not check_ffprobe_availability():
+        return None
+    info = probe_media(file_path)
+    if not info or not info['video_codec']:
+        return False
+    return info['width'] > 0 and info['height'] > 0 and (info['frame_count'] > 0 or info['duration'] > 0)
@@ -0,0 +1,174 @@
+# utils/media_session.py
+"""
+Cập nhật media session trên URL_FRONTEND (URL ảnh/video cho trang session của khách).
+
+update_media_session không gửi ngay mà đưa vào bộ gộp: các field của cùng session code trong
+MEDIA_SESSION_COALESCE_WINDOW giây được gửi chung một PUT (session keep-alive) từ một thread nền,
+không chặn render job. Mỗi URL mang thứ tự (thời điểm tạo output, URL trên host xếp sau URL local
+của cùng output) nên URL cũ gửi trễ không bao giờ ghi đè URL mới hơn, URL đã gửi thì không gửi lại.
+
+Request có timeout và đi qua circuit breaker: khi frontend lỗi/không phản hồi, cập nhật được giữ
+lại và gửi khi breaker cho phép.
+"""
+import threading
+import time
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from config import (
+    URL_MAIN, URL_FRONTEND, MEDIA_SESSION_TIMEOUT, MEDIA_SESSION_RETRY_DELAY,
+    MEDIA_SESSION_COALESCE_WINDOW, MEDIA_SESSION_HISTORY,
+)
+from utils.circuit_breaker import media_session_breaker
+from utils.logging import setup_logging
+
+logger = setup_logging()
+
+SESSION_FIELDS = {"image_url": "imageUrl", "video_url": "videoUrl", "fast_video_url": "gifUrl"}
+
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+_pending = {}  # session code -> {field: (thứ tự, URL)} chưa gửi
+_due = {}  # session code -> thời điểm gửi
+_delivered = OrderedDict()  # session code -> {field: (thứ tự, URL)} đã gửi, giữ MEDIA_SESSION_HISTORY session gần nhất
+_stats = {"queued": 0, "requests": 0, "coalesced": 0, "skipped": 0}
+_cond = threading.Condition()
+_worker_thread = None
+
+def _order_key(url, created_at):
+    # Cùng thời điểm tạo: URL trên host thay URL local tạm, không có chiều ngược lại
+    return (created_at, not url.startswith(URL_MAIN))
+
+def _send(media_session_code, fields):
+    """
+    Gửi một cập nhật. Returns: True nếu xong (thành công hoặc frontend từ chối với 4xx, không
+    nên gửi lại), False nếu cần thử lại (lỗi mạng/5xx).
+    """
+    update_data = {"sessionCode": media_session_code}
+    for field, key in SESSION_FIELDS.items():
+        if field in fields:
+            update_data[key] = fields[field][1]
+
+    try:
+        response = _session.put(f"{URL_FRONTEND}/api/media-session", json=update_data, timeout=MEDIA_SESSION_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        media_session_breaker.record_failure(e)
+        logger.error(f"Error updating media session {media_session_code}: {str(e)}")
+        return False
+
+    if response.status_code >= 500:
+        media_session_breaker.record_failure(f"HTTP {response.status_code}")
+        logger.error(f"Failed to update media session: {response.status_code}, {response.text}")
+        return False
+
+    # Frontend vẫn trả lời: breaker coi là thành công kể cả khi request bị từ chối
+    media_session_breaker.record_success()
+    if response.status_code == 200:
+        logger.info(f"Media session {media_session_code} updated ({', '.join(fields)}): {response.text}")
+    else:
+        logger.error(f"Media session update rejected: {response.status_code}, {response.text}")
+    return True
+
+def _is_newer(fields, field, entry):
+    return field not in fields or entry[0] >= fields[field][0]
+
+def _merge_locked(media_session_code, fields):
+    """Gộp fields vào cập nhật chờ gửi, bỏ URL đã gửi hoặc cũ hơn URL đã biết. Returns: số field được nhận"""
+    delivered = _delivered.get(media_session_code, {})
+    pending = _pending.setdefault(media_session_code, {})
+    accepted = 0
+    for field, entry in fields.items():
+        if field in delivered and (entry[1] == delivered[field][1] or entry[0] < delivered[field][0]):
+            _stats["skipped"] += 1
+            continue
+        if not _is_newer(pending, field, entry):
+            _stats["skipped"] += 1
+            continue
+        if field in pending:
+            _stats["coalesced"] += 1
+        pending[field] = entry
+        accepted += 1
+    if not pending:
+        del _pending[media_session_code]
+    return accepted
+
+def update_media_session(media_session_code, image_url=None, video_url=None, fast_video_url=None, created_at=None):
+    """
+    Đưa URL vào bộ gộp cập nhật media session (không chặn, request gửi từ thread nền).
+
+    Args:
+        created_at (float, optional): Thời điểm tạo output (time.time()) dùng để xếp thứ tự URL,
+            mặc định là lúc gọi. URL có created_at cũ hơn URL đã biết cho cùng field bị bỏ qua.
+
+    Returns:
+        bool: True nếu có URL mới được đưa vào hàng đợi gửi
+    """
+    if not media_session_code:
+        logger.warning("No media session code provided")
+        return False
+
+    created_at = time.time() if created_at is None else created_at
+    fields = {field: (_order_key(url, created_at), url) for field, url in
+              (("image_url", image_url), ("video_url", video_url), ("fast_video_url", fast_video_url)) if url}
+    with _cond:
+        if not _merge_locked(media_session_code, fields):
+            return False
+        _stats["queued"] += 1
+        # Lần cập nhật đầu tiên mở cửa sổ gộp, các cập nhật sau đi cùng request đó
+        _due.setdefault(media_session_code, time.time() + MEDIA_SESSION_COALESCE_WINDOW)
+        _start_worker_locked()
+        _cond.notify()
+    return True
+
+def pending_updates():
+    with _cond:
+        return len(_pending)
+
+def media_session_stats():
+    with _cond:
+        return {"pending_sessions": len(_pending), **_stats}
+
+def _start_worker_locked():
+    global _worker_thread
+    if _worker_thread is None:
+        _worker_thread = threading.Thread(target=_worker, name="media-session", daemon=True)
+        _worker_thread.start()
+
+def _next_update():
+    """Chờ tới khi có session tới hạn gửi và breaker cho phép, trả về (session code, fields)"""
+    with _cond:
+        while True:
+            now = time.time()
+            media_session_code = min(_due, key=_due.get) if _due else None
+            if media_session_code is None or _due[media_session_code] > now:
+                _cond.wait(timeout=_due[media_session_code] - now if media_session_code else None)
+                continue
+            if not media_session_breaker.allow_request():
+                # Frontend đang lỗi: giữ nguyên cập nhật, gửi khi breaker cho thử lại
+                _due[media_session_code] = max(media_session_breaker.retry_at(), now + MEDIA_SESSION_RETRY_DELAY)
+                continue
+            del _due[media_session_code]
+            fields = _pending.pop(media_session_code, None)
+            if fields:
+                return media_session_code, fields
+
+def _worker():
+    while True:
+        media_session_code, fields = _next_update()
+        delivered = _send(media_session_code, fields)
+        with _cond:
+            _stats["requests"] += 1
+            if delivered:
+                history = _delivered.setdefault(media_session_code, {})
+                for field, entry in fields.items():
+                    if _is_newer(history, field, entry):
+                        history[field] = entry
+                _delivered.move_to_end(media_session_code)
+                while len(_delivered) > MEDIA_SESSION_HISTORY:
+                    _delivered.popitem(last=False)
+            else:
+                # Gửi lại cùng các cập nhật mới tới trong lúc chờ (URL mới hơn được giữ)
+                _merge_locked(media_session_code, fields)
+                _due[media_session_code] = max(media_session_breaker.retry_at(), time.time() + MEDIA_SESSION_RETRY_DELAY)
@@ -33,6 +33,11 @@ def performance_monitor(func):
     
     return wrapper
 
+def get_cpu_seconds():
+    """Tổng CPU time (user + system) của process hiện tại và các process con đã kết thúc"""
+    cpu = psutil.Process(os.getpid()).cpu_times()
+    return cpu.user + cpu.system + getattr(cpu, 'children_user', 0) + getattr(cpu, 'children_system', 0)
+
 def get_system_stats():
     """Lấy thông tin hệ thống hiện tại"""
     cpu_percent = psutil.cpu_percent(interval=1)
@@ -0,0 +1,417 @@
+# utils/render_jobs.py
+"""
+Job render bất đồng bộ: một executor giới hạn dùng chung cho cả process (RENDER_WORKERS worker)
+với hàng đợi tối đa RENDER_QUEUE_SIZE job. Endpoint submit trả về job_id ngay, client theo dõi
+trạng thái/kết quả bằng polling hoặc Server-Sent Events. Hàng đợi đầy thì submit bị từ chối
+(QueueFullError) thay vì tạo thêm thread.
+
+Job được xếp vào lane theo độ ưu tiên (ảnh > video 2s > video 10s/fast video). Khi nhiều lane
+cùng có job chờ, worker chọn lane theo weighted round robin (RENDER_LANE_WEIGHTS), video không
+được chiếm các worker dành riêng cho ảnh, và ffmpeg của video bị giảm thread khi có job ảnh.
+
+Trong mỗi lane, job được chia theo booth (client) và phục vụ xoay vòng giữa các booth, mỗi booth
+có giới hạn job video chạy cùng lúc và số job chờ, nên một booth gửi liên tục không chiếm hết worker.
+Job ảnh không tính vào giới hạn chạy của booth: ảnh của khách sau vẫn chạy ngay khi video của khách
+trước (video 10s + fast video) còn đang render.
+"""
+import threading
+import time
+import uuid
+import math
+from collections import deque, OrderedDict
+from config import (
+    RENDER_WORKERS, RENDER_QUEUE_SIZE, RENDER_JOB_RETENTION, RENDER_LANE_WEIGHTS,
+    RENDER_IMAGE_RESERVED_WORKERS, RENDER_LATENCY_SAMPLES, RENDER_BOOTH_MAX_RUNNING, RENDER_BOOTH_MAX_WAITING,
+    RENDER_BOOTH_LIMITS, RENDER_DEFAULT_RUN_SECONDS,
+)
+from utils.ffmpeg_budget import ffmpeg_thread_budget
+from utils.logging import setup_logging
+
+logger = setup_logging()
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+FINISHED_STATES = (JOB_DONE, JOB_FAILED)
+
+LANE_IMAGE = "image"
+LANE_VIDEO_SHORT = "video_short"
+LANE_VIDEO_LONG = "video_long"
+RENDER_LANES = (LANE_IMAGE, LANE_VIDEO_SHORT, LANE_VIDEO_LONG)  # Theo thứ tự ưu tiên
+
+DEFAULT_BOOTH = "default"
+
+class QueueFullError(Exception):
+    """Hàng đợi render đã đầy"""
+
+class RenderJob:
+    __slots__ = ("job_id", "kind", "lane", "booth_id", "status", "result", "error", "version",
+                 "created_at", "started_at", "finished_at", "func", "args", "kwargs")
+
+    def __init__(self, kind, lane, booth_id, func, args, kwargs):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.lane = lane
+        self.booth_id = booth_id
+        self.status = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.version = 0  # Tăng mỗi lần trạng thái đổi, SSE dựa vào đây để biết có gì mới
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "lane": self.lane,
+            "booth_id": self.booth_id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "version": self.version,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+def percentile(values, percent):
+    """Percentile theo nearest-rank, None nếu chưa có mẫu"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+class RenderJobManager:
+    def __init__(self, workers=RENDER_WORKERS, queue_size=RENDER_QUEUE_SIZE, retention=RENDER_JOB_RETENTION,
+                 lane_weights=None, image_reserved_workers=RENDER_IMAGE_RESERVED_WORKERS,
+                 booth_max_running=RENDER_BOOTH_MAX_RUNNING, booth_max_waiting=RENDER_BOOTH_MAX_WAITING, booth_limits=None):
+        self.workers = max(1, int(workers))
+        self.queue_size = max(0, int(queue_size))
+        self.retention = retention
+        self.lane_weights = {lane: max(1, int((lane_weights or RENDER_LANE_WEIGHTS).get(lane, 1))) for lane in RENDER_LANES}
+        # Luôn chừa ít nhất 1 worker cho video để lane video không bị bỏ đói hoàn toàn
+        self.image_reserved_workers = min(max(0, int(image_reserved_workers)), self.workers - 1)
+        self.booth_max_running = max(1, int(booth_max_running))
+        self.booth_max_waiting = max(1, int(booth_max_waiting))
+        self.booth_limits = dict(RENDER_BOOTH_LIMITS if booth_limits is None else booth_limits)
+        self.rejected = 0
+        self._pending = {lane: OrderedDict() for lane in RENDER_LANES}  # lane -> booth_id -> deque, thứ tự xoay vòng
+        self._running = {lane: 0 for lane in RENDER_LANES}
+        self._booth_running = {}
+        self._booth_video_running = {}  # Job video đang chạy theo booth (tính giới hạn booth_limit)
+        self._booth_waiting = {}
+        self._running_jobs = set()
+        self._credits = {lane: 0 for lane in RENDER_LANES}  # Smooth weighted round robin
+        self._completed = {lane: 0 for lane in RENDER_LANES}
+        self._latencies = {lane: deque(maxlen=RENDER_LATENCY_SAMPLES) for lane in RENDER_LANES}  # (chờ, tổng, chạy) giây
+        self._jobs = OrderedDict()  # job_id -> RenderJob, theo thứ tự submit
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def _ensure_workers(self):
+        # Worker được tạo lần đầu có job (không sinh thread khi chỉ import module)
+        if not self._threads:
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"render-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def booth_limit(self, booth_id):
+        """Số job video tối đa booth được chạy cùng lúc (RENDER_BOOTH_LIMITS ghi đè mặc định)"""
+        return max(1, int(self.booth_limits.get(booth_id, self.booth_max_running)))
+
+    def _lane_waiting_locked(self, lane):
+        return sum(len(queue) for queue in self._pending[lane].values())
+
+    def _waiting_locked(self):
+        return sum(self._lane_waiting_locked(lane) for lane in RENDER_LANES)
+
+    def _running_total_locked(self):
+        return sum(self._running.values())
+
+    def submit(self, kind, func, *args, lane=LANE_IMAGE, booth_id=None, **kwargs):
+        """
+        Đưa job vào hàng đợi của lane, phần của booth_id.
+
+        Returns:
+            dict: Snapshot trạng thái job (có job_id, queue_position, eta)
+
+        Raises:
+            QueueFullError: Nếu mọi worker đều bận và đã có queue_size job đang chờ,
+                hoặc booth đã có booth_max_waiting job đang chờ
+            ValueError: Nếu lane không hợp lệ
+        """
+        if lane not in self._pending:
+            raise ValueError(f"Unknown render lane: {lane}")
+        booth_id = booth_id or DEFAULT_BOOTH
+        with self._cond:
+            waiting = self._waiting_locked()
+            if self._running_total_locked() + waiting >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise QueueFullError(f"Render queue is full ({waiting} jobs waiting), retry later")
+            if self._booth_waiting.get(booth_id, 0) >= self.booth_max_waiting:
+                self.rejected += 1
+                raise QueueFullError(f"Booth {booth_id} already has {self.booth_max_waiting} jobs waiting, retry later")
+            self._ensure_workers()
+            job = RenderJob(kind, lane, booth_id, func, args, kwargs)
+            self._jobs[job.job_id] = job
+            self._pending[lane].setdefault(booth_id, deque()).append(job)
+            self._booth_waiting[booth_id] = self._booth_waiting.get(booth_id, 0) + 1
+            self._prune_locked()
+            self._update_throttle_locked()
+            self._cond.notify_all()
+            logger.info(f"[RENDER JOB] Queued {kind} job {job.job_id} in lane {lane} for booth {booth_id} "
+                        f"(waiting={waiting + 1}, running={self._running_total_locked()})")
+            return self._snapshot_locked(job)
+
+    def get(self, job_id):
+        """Snapshot trạng thái job, None nếu không tồn tại (hoặc đã hết hạn giữ)"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return self._snapshot_locked(job) if job else None
+
+    def wait(self, job_id, version=None, timeout=None):
+        """
+        Chờ tới khi job đổi trạng thái so với version (None: trả về ngay) hoặc hết timeout.
+
+        Returns:
+            dict: Snapshot mới nhất, None nếu job không tồn tại
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id].version != version, timeout=timeout
+            )
+            job = self._jobs.get(job_id)
+            return self._snapshot_locked(job) if job else None
+
+    def wait_finished(self, job_id, timeout=None):
+        """Chờ job chạy xong (done/failed) tối đa timeout giây, trả về snapshot mới nhất"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id].status in FINISHED_STATES, timeout=timeout
+            )
+            job = self._jobs.get(job_id)
+            return self._snapshot_locked(job) if job else None
+
+    def stats(self):
+        with self._cond:
+            lanes = {}
+            for lane in RENDER_LANES:
+                samples = self._latencies[lane]
+                waits = [sample[0] for sample in samples]
+                totals = [sample[1] for sample in samples]
+                lanes[lane] = {
+                    "weight": self.lane_weights[lane],
+                    "waiting": self._lane_waiting_locked(lane),
+                    "running": self._running[lane],
+                    "completed": self._completed[lane],
+                    "wait_p95": percentile(waits, 95),
+                    "latency_p50": percentile(totals, 50),
+                    "latency_p95": percentile(totals, 95),
+                }
+            return {
+                "workers": self.workers,
+                "image_reserved_workers": self.image_reserved_workers,
+                "queue_size": self.queue_size,
+                "booth_max_running": self.booth_max_running,
+                "booth_max_waiting": self.booth_max_waiting,
+                "running": self._running_total_locked(),
+                "waiting": self._waiting_locked(),
+                "rejected": self.rejected,
+                "tracked_jobs": len(self._jobs),
+                "ffmpeg_throttled": ffmpeg_thread_budget.throttled,
+                "booths": {
+                    booth_id: {"running": self._booth_running.get(booth_id, 0), "waiting": self._booth_waiting.get(booth_id, 0)}
+                    for booth_id in set(self._booth_running) | set(self._booth_waiting)
+                },
+                "lanes": lanes,
+            }
+
+    def queue_info(self, booth_id=None):
+        """
+        Độ sâu hàng đợi và thời gian chờ ước tính cho booth: job mới gửi lúc này ở mỗi lane
+        và các job của booth đang chờ/chạy. ETA tính từ thời gian chạy trung vị gần đây của từng lane.
+        """
+        booth_id = booth_id or DEFAULT_BOOTH
+        with self._cond:
+            lanes = {}
+            for lane in RENDER_LANES:
+                start_eta = self._estimate_start_locked(lane, booth_id)
+                lanes[lane] = {
+                    "waiting": self._lane_waiting_locked(lane),
+                    "running": self._running[lane],
+                    "eta_start_seconds": round(start_eta, 1),
+                    "eta_seconds": round(start_eta + self._run_seconds_locked(lane), 1),
+                }
+            jobs = [self._snapshot_locked(job) for job in self._jobs.values()
+                    if job.booth_id == booth_id and job.status not in FINISHED_STATES]
+            return {
+                "booth_id": booth_id,
+                "running": self._booth_running.get(booth_id, 0),
+                "running_video": self._booth_video_running.get(booth_id, 0),
+                "waiting": self._booth_waiting.get(booth_id, 0),
+                "max_running": self.booth_limit(booth_id),
+                "max_waiting": self.booth_max_waiting,
+                "lanes": lanes,
+                "jobs": jobs,
+            }
+
+    def _run_seconds_locked(self, lane):
+        """Thời gian chạy trung vị của lane (mặc định RENDER_DEFAULT_RUN_SECONDS khi chưa có mẫu)"""
+        runs = [sample[2] for sample in self._latencies[lane]]
+        return percentile(runs, 50) or RENDER_DEFAULT_RUN_SECONDS.get(lane, 30)
+
+    def _fair_position_locked(self, lane, booth_id, index):
+        """
+        Vị trí (từ 1) của job thứ index trong hàng của booth khi các booth được phục vụ xoay vòng:
+        mỗi booth khác có tối đa index + 1 job (hoặc index job nếu đứng sau trong vòng) chạy trước.
+        """
+        position = index + 1
+        before = True
+        for other_id, queue in self._pending[lane].items():
+            if other_id == booth_id:
+                before = False
+                continue
+            position += min(len(queue), index + 1 if before else index)
+        return position
+
+    def _estimate_start_locked(self, lane, booth_id, index=None):
+        """Ước tính số giây tới khi job (index trong hàng của booth, None = job mới) bắt đầu chạy"""
+        queue = self._pending[lane].get(booth_id, ())
+        index = len(queue) if index is None else index
+        lane_rank = RENDER_LANES.index(lane)
+        # Việc phải xong trước: job chờ ở các lane ưu tiên cao hơn + các job đứng trước trong lane này
+        higher = RENDER_LANES[:lane_rank]
+        ahead_in_lane = self._fair_position_locked(lane, booth_id, index) - 1
+        ahead = sum(self._lane_waiting_locked(other) for other in higher) + ahead_in_lane
+        work = sum(self._lane_waiting_locked(other) * self._run_seconds_locked(other) for other in higher)
+        work += ahead_in_lane * self._run_seconds_locked(lane)
+        now = time.time()
+        remaining = [max(0.0, self._run_seconds_locked(job.lane) - (now - job.started_at)) for job in self._running_jobs]
+        if lane == LANE_IMAGE:
+            capacity, busy = self.workers, self._running_total_locked()
+        else:
+            capacity = self.workers - self.image_reserved_workers
+            busy = self._running_total_locked() - self._running[LANE_IMAGE]
+        # Còn worker rảnh cho mọi job đứng trước thì bắt đầu ngay, không thì chờ phần việc chia đều cho các worker
+        start = 0.0 if ahead < capacity - busy else (work + sum(remaining)) / capacity
+        # Video của booth đã chạy đủ giới hạn thì phải chờ một video của chính nó xong (ảnh không bị giới hạn)
+        if lane != LANE_IMAGE and self._booth_video_running.get(booth_id, 0) >= self.booth_limit(booth_id):
+            start = max(start, min(max(0.0, self._run_seconds_locked(job.lane) - (now - job.started_at))
+                                   for job in self._running_jobs if job.booth_id == booth_id and job.lane != LANE_IMAGE))
+        return start
+
+    def _snapshot_locked(self, job):
+        snapshot = job.to_dict()
+        if job.status == JOB_QUEUED:
+            index = self._pending[job.lane][job.booth_id].index(job)
+            snapshot["queue_position"] = self._fair_position_locked(job.lane, job.booth_id, index)
+            snapshot["eta_start_seconds"] = round(self._estimate_start_locked(job.lane, job.booth_id, index), 1)
+        return snapshot
+
+    def _prune_locked(self):
+        """Bỏ các job đã xong quá retention giây"""
+        expire_before = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.status in FINISHED_STATES and job.finished_at < expire_before]:
+            del self._jobs[job_id]
+
+    def _update_throttle_locked(self):
+        # Giảm thread ffmpeg của video khi có ảnh đang chờ hoặc đang render
+        ffmpeg_thread_budget.set_throttled(bool(self._pending[LANE_IMAGE]) or self._running[LANE_IMAGE] > 0)
+
+    def _runnable_booth_locked(self, lane):
+        """Booth đầu tiên theo vòng xoay của lane còn job chờ và chưa chạm giới hạn chạy video cùng lúc"""
+        if lane == LANE_IMAGE:
+            # Lane ảnh không áp giới hạn booth, chỉ xoay vòng giữa các booth
+            return next(iter(self._pending[lane]), None)
+        for booth_id in self._pending[lane]:
+            if self._booth_video_running.get(booth_id, 0) < self.booth_limit(booth_id):
+                return booth_id
+        return None
+
+    def _runnable_lanes_locked(self):
+        video_running = self._running_total_locked() - self._running[LANE_IMAGE]
+        video_slots = self.workers - self.image_reserved_workers
+        return [lane for lane in RENDER_LANES
+                if (lane == LANE_IMAGE or video_running < video_slots) and self._runnable_booth_locked(lane) is not None]
+
+    def _next_job_locked(self):
+        """Smooth weighted round robin giữa các lane, xoay vòng giữa các booth trong lane"""
+        lanes = self._runnable_lanes_locked()
+        for lane in RENDER_LANES:
+            if not self._pending[lane]:
+                self._credits[lane] = 0  # Lane trống không tích luỹ credit cho lần sau
+        total_weight = sum(self.lane_weights[lane] for lane in lanes)
+        for lane in lanes:
+            self._credits[lane] += self.lane_weights[lane]
+        # Bằng credit thì lane ưu tiên cao hơn (đứng trước trong RENDER_LANES) thắng
+        chosen = max(lanes, key=lambda lane: self._credits[lane])
+        self._credits[chosen] -= total_weight
+
+        booth_id = self._runnable_booth_locked(chosen)
+        booth_queues = self._pending[chosen]
+        job = booth_queues[booth_id].popleft()
+        if booth_queues[booth_id]:
+            booth_queues.move_to_end(booth_id)  # Booth vừa được phục vụ xuống cuối vòng
+        else:
+            del booth_queues[booth_id]
+        self._booth_waiting[booth_id] -= 1
+        if not self._booth_waiting[booth_id]:
+            del self._booth_waiting[booth_id]
+        return job
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(self._runnable_lanes_locked)
+                job = self._next_job_locked()
+                job.status = JOB_RUNNING
+                job.started_at = time.time()
+                job.version += 1
+                self._running[job.lane] += 1
+                self._booth_running[job.booth_id] = self._booth_running.get(job.booth_id, 0) + 1
+                if job.lane != LANE_IMAGE:
+                    self._booth_video_running[job.booth_id] = self._booth_video_running.get(job.booth_id, 0) + 1
+                self._running_jobs.add(job)
+                self._cond.notify_all()
+
+            logger.info(f"[RENDER JOB] Started {job.kind} job {job.job_id} ({job.lane}, booth {job.booth_id}) "
+                        f"after {job.started_at - job.created_at:.2f}s in queue")
+            try:
+                result, error, status = job.func(*job.args, **job.kwargs), None, JOB_DONE
+            except Exception as e:
+                logger.error(f"[RENDER JOB] {job.kind} job {job.job_id} failed: {str(e)}")
+                result, error, status = None, str(e), JOB_FAILED
+
+            with self._cond:
+                job.result, job.error, job.status = result, error, status
+                job.finished_at = time.time()
+                job.version += 1
+                job.func = job.args = job.kwargs = None  # Không giữ ảnh/đường dẫn tạm sau khi xong
+                self._running[job.lane] -= 1
+                self._booth_running[job.booth_id] -= 1
+                if not self._booth_running[job.booth_id]:
+                    del self._booth_running[job.booth_id]
+                if job.lane != LANE_IMAGE:
+                    self._booth_video_running[job.booth_id] -= 1
+                    if not self._booth_video_running[job.booth_id]:
+                        del self._booth_video_running[job.booth_id]
+                self._running_jobs.discard(job)
+                self._completed[job.lane] += 1
+                self._latencies[job.lane].append((
+                    round(job.started_at - job.created_at, 3),
+                    round(job.finished_at - job.created_at, 3),
+                    round(job.finished_at - job.started_at, 3),
+                ))
+                self._update_throttle_locked()
+                self._cond.notify_all()
+            logger.info(f"[RENDER JOB] {job.kind} job {job.job_id} {status} in {job.finished_at - job.started_at:.2f}s")
+
+render_jobs = RenderJobManager()
@@ -0,0 +1,173 @@
+# utils/template_cache.py
+"""
+Cache template (background / overlay) đã chuẩn bị sẵn, key theo hash nội dung file + hướng crop
+(phụ thuộc frame type) + kích thước đích. Một sự kiện dùng cùng template cho hàng trăm session,
+nên chỉ phải decode PNG và resize LANCZOS lần đầu.
+
+Các biến thể:
+- ảnh in: PIL RGB/RGBA đã fit cover về kích thước khung in
+- ảnh video: thu nhỏ từ biến thể ảnh in về kích thước video
+- layer video OpenCV: VideoLayerStack (BGR + overlay premultiplied)
+
+Giá trị trong cache được dùng chung giữa các request, caller không được sửa trực tiếp.
+"""
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+from config import TEMPLATE_CACHE_MAX_BYTES
+from utils.file_handling import hash_file_content
+from utils.image_processing import fit_cover_image
+from utils.video_layers import VideoLayerStack
+from utils.logging import setup_logging
+
+logger = setup_logging()
+
+_hash_memo = {}
+_hash_memo_lock = threading.Lock()
+
+def get_content_hash(file_path):
+    """Hash nội dung file, nhớ theo (path, size, mtime) để template dùng lại không phải hash lại mỗi request"""
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _hash_memo_lock:
+        content_hash = _hash_memo.get(key)
+    if content_hash is None:
+        content_hash = hash_file_content(file_path)
+        with _hash_memo_lock:
+            if len(_hash_memo) > 1024:
+                _hash_memo.clear()
+            _hash_memo[key] = content_hash
+    return content_hash
+
+def _image_nbytes(img):
+    return img.width * img.height * len(img.getbands())
+
+class TemplateCache:
+    def __init__(self, max_bytes=TEMPLATE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get_or_create(self, key, factory, nbytes_fn):
+        """
+        Lấy value theo key, tạo bằng factory() nếu chưa có. Mỗi key chỉ được tạo một lần
+        kể cả khi nhiều request cùng cần (các request khác chờ kết quả).
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+                self.misses += 1
+            try:
+                value = factory()
+                self._store(key, value, nbytes_fn(value))
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+            return value
+
+    def _store(self, key, value, nbytes):
+        with self._lock:
+            if nbytes > self.max_bytes:
+                return  # Lớn hơn cả ngân sách: dùng một lần, không cache
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def evict_content(self, content_hashes):
+        """Bỏ mọi biến thể tạo từ các file có hash nội dung trong content_hashes (vd. template bị xoá)"""
+        content_hashes = set(content_hashes)
+        with self._lock:
+            keys = [key for key in self._entries if content_hashes.intersection(key)]
+            for key in keys:
+                _, nbytes = self._entries.pop(key)
+                self.current_bytes -= nbytes
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+template_cache = TemplateCache()
+
+def get_template_image(image_path, mode, size, crop_direction="center", content_hash=None):
+    """
+    Template PIL đã fit cover về size (mode "RGB" cho background, "RGBA" cho overlay).
+
+    Returns:
+        PIL.Image hoặc None nếu không có file
+    """
+    if not image_path:
+        return None
+    content_hash = content_hash or get_content_hash(image_path)
+
+    def create():
+        img = Image.open(image_path).convert(mode)
+        return fit_cover_image(img, size, crop_direction)
+
+    return template_cache.get_or_create(("image", content_hash, mode, crop_direction, tuple(size)), create, _image_nbytes)
+
+def get_scaled_template_image(image_path, mode, total_size, output_size, crop_direction="center", content_hash=None):
+    """Biến thể nhỏ hơn (vd. cho video) được thu nhỏ từ biến thể kích thước khung in đã cache"""
+    if not image_path:
+        return None
+    content_hash = content_hash or get_content_hash(image_path)
+    full = get_template_image(image_path, mode, total_size, crop_direction, content_hash)
+    if full.size == tuple(output_size):
+        return full
+
+    def create():
+        return full.resize(output_size, Image.Resampling.LANCZOS)
+
+    return template_cache.get_or_create(("scaled", content_hash, mode, crop_direction, tuple(total_size), tuple(output_size)),
+                                        create, _image_nbytes)
+
+def get_video_layer_stack(background_path, overlay_path, total_size, output_size, crop_direction="center"):
+    """
+    VideoLayerStack cho compositor OpenCV, mỗi lần gọi trả về một bản fork có buffer frame riêng.
+    """
+    bg_hash = get_content_hash(background_path) if background_path else None
+    ov_hash = get_content_hash(overlay_path) if overlay_path else None
+
+    def create():
+        return VideoLayerStack.from_images(
+            output_size,
+            get_scaled_template_image(background_path, "RGB", total_size, output_size, crop_direction, bg_hash),
+            get_scaled_template_image(overlay_path, "RGBA", total_size, output_size, crop_direction, ov_hash)
+        )
+
+    stack = template_cache.get_or_create(("video_layers", bg_hash, ov_hash, crop_direction, tuple(total_size), tuple(output_size)),
+                                         create, lambda value: value.nbytes)
+    return stack.fork()
@@ -0,0 +1,225 @@
+# utils/template_registry.py
+"""
+Đăng ký template (background + overlay) một lần, các request render chỉ gửi template_id.
+File template được lưu lâu dài trong TEMPLATE_FOLDER (không bị xoá cuối request),
+các biến thể đã fit cho frame type / tỉ lệ booth khai báo được chuẩn bị sẵn trong template cache.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from werkzeug.utils import secure_filename
+from config import TEMPLATE_FOLDER, FRAME_TYPES, TEMPLATE_WARM_MAX_BYTES
+from utils.file_handling import allowed_file, hash_file_content
+from utils.frame_layout import get_frame_layout, SCALE_PRINT, SCALE_VIDEO
+from utils.template_cache import get_template_image, template_cache
+from utils.logging import setup_logging
+
+logger = setup_logging()
+
+_TEMPLATE_ID_RE = re.compile(r"^[0-9a-f]{16}$")
+_registry_lock = threading.Lock()
+
+def _metadata_path(template_id):
+    return os.path.join(TEMPLATE_FOLDER, f"{template_id}.json")
+
+def _stage_asset(file, kind):
+    """Lưu file upload ra file tạm và hash nội dung (chạy ngoài lock). Returns: (file tạm, file đích, hash)"""
+    filename = secure_filename(file.filename)
+    ext = os.path.splitext(filename)[1].lower() or ".png"
+    tmp_path = os.path.join(TEMPLATE_FOLDER, f"upload_{threading.get_ident()}_{time.time_ns()}{ext}")
+    file.save(tmp_path)
+    content_hash = hash_file_content(tmp_path)
+    return tmp_path, os.path.join(TEMPLATE_FOLDER, f"{kind}_{content_hash}{ext}"), content_hash
+
+def _commit_asset_locked(tmp_path, final_path):
+    """
+    Đổi file tạm thành file theo hash (file trùng chỉ lưu một lần). Gọi trong _registry_lock cùng với
+    việc ghi metadata, để delete_template không xoá asset vừa được dùng lại trước khi metadata có mặt.
+    """
+    if os.path.exists(final_path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, final_path)
+
+def register_template(background_file=None, overlay_file=None, name=None, warm_frame_types=None,
+                      warm_scales=(SCALE_PRINT, SCALE_VIDEO)):
+    """
+    Lưu background/overlay và trả về metadata template. Cùng nội dung luôn ra cùng template_id.
+
+    Args:
+        warm_frame_types (list, optional): Frame type sẽ dùng template, được chuẩn bị sẵn ở nền
+            (xem warm_template). Không truyền thì biến thể được tạo ở request render đầu tiên
+        warm_scales (tuple): Tỉ lệ cần chuẩn bị ("print" cho ảnh, "video" cho video)
+
+    Raises:
+        ValueError: Nếu không có file hợp lệ nào hoặc frame type / tỉ lệ không tồn tại
+    """
+    background_file = background_file if background_file and allowed_file(background_file.filename) else None
+    overlay_file = overlay_file if overlay_file and allowed_file(overlay_file.filename) else None
+    if not background_file and not overlay_file:
+        raise ValueError("Template needs a valid background or overlay image")
+    warm_frame_types = [str(frame_id) for frame_id in warm_frame_types or []]
+    unknown = [frame_id for frame_id in warm_frame_types if frame_id not in FRAME_TYPES]
+    unknown += [scale for scale in warm_scales if scale not in (SCALE_PRINT, SCALE_VIDEO)]
+    if unknown:
+        raise ValueError(f"Unknown frame types / scales to warm: {', '.join(unknown)}")
+
+    os.makedirs(TEMPLATE_FOLDER, exist_ok=True)
+    staged = []
+    try:
+        # Ghi file upload + hash (chậm) ngoài lock, chỉ bước dùng lại/đổi tên nằm trong lock
+        background = _stage_asset(background_file, "bg") if background_file else None
+        staged.append(background)
+        overlay = _stage_asset(overlay_file, "ov") if overlay_file else None
+        staged.append(overlay)
+        template_id = hashlib.sha256(f"{background[2] if background else ''}:{overlay[2] if overlay else ''}"
+                                     .encode("utf-8")).hexdigest()[:16]
+
+        template = {
+            "template_id": template_id,
+            "name": name,
+            "background": os.path.basename(background[1]) if background else None,
+            "overlay": os.path.basename(overlay[1]) if overlay else None,
+            "created_at": time.time(),
+        }
+        with _registry_lock:
+            for asset in (background, overlay):
+                if asset:
+                    _commit_asset_locked(asset[0], asset[1])
+            with open(_metadata_path(template_id), "w", encoding="utf-8") as f:
+                json.dump(template, f)
+    finally:
+        for asset in staged:
+            if asset and os.path.exists(asset[0]):
+                os.remove(asset[0])
+
+    logger.info(f"[TEMPLATE] Registered {template_id} (background={template['background']}, overlay={template['overlay']})")
+    if warm_frame_types and warm_scales:
+        threading.Thread(target=warm_template, args=(template_id, warm_frame_types, warm_scales),
+                         name=f"template-warm-{template_id}", daemon=True).start()
+    return template
+
+def get_template(template_id):
+    """
+    Returns:
+        dict: Metadata template kèm 'background_path' / 'overlay_path' tuyệt đối, hoặc None
+    """
+    if not template_id or not _TEMPLATE_ID_RE.match(template_id):
+        return None
+    try:
+        with open(_metadata_path(template_id), "r", encoding="utf-8") as f:
+            template = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    template["background_path"] = os.path.join(TEMPLATE_FOLDER, template["background"]) if template.get("background") else None
+    template["overlay_path"] = os.path.join(TEMPLATE_FOLDER, template["overlay"]) if template.get("overlay") else None
+    for key in ("background_path", "overlay_path"):
+        if template[key] and not os.path.exists(template[key]):
+            logger.warning(f"[TEMPLATE] Missing asset for {template_id}: {template[key]}")
+            return None
+    return template
+
+def _referenced_assets():
+    """Tên các file asset còn được metadata template nào đó tham chiếu"""
+    referenced = set()
+    for filename in os.listdir(TEMPLATE_FOLDER):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(TEMPLATE_FOLDER, filename), "r", encoding="utf-8") as f:
+                template = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        referenced.update(asset for asset in (template.get("background"), template.get("overlay")) if asset)
+    return referenced
+
+def delete_template(template_id):
+    """
+    Xoá metadata template, cùng các asset không còn template nào khác dùng (asset dùng chung theo
+    hash được giữ lại) và các biến thể của chúng trong template cache.
+    """
+    if not template_id or not _TEMPLATE_ID_RE.match(template_id):
+        return False
+    with _registry_lock:
+        try:
+            with open(_metadata_path(template_id), "r", encoding="utf-8") as f:
+                template = json.load(f)
+        except json.JSONDecodeError:
+            template = {}  # Metadata hỏng: vẫn xoá được, asset không xác định thì giữ lại
+        except OSError:
+            return False
+        try:
+            os.remove(_metadata_path(template_id))
+        except OSError:
+            return False
+
+        referenced = _referenced_assets()
+        released_hashes = []
+        for asset in (template.get("background"), template.get("overlay")):
+            if not asset or asset in referenced:
+                continue
+            # Tên asset là <loại>_<hash nội dung><đuôi>, cùng hash với key trong template cache
+            released_hashes.append(os.path.splitext(asset)[0].split("_", 1)[-1])
+            try:
+                os.remove(os.path.join(TEMPLATE_FOLDER, asset))
+            except OSError as e:
+                logger.warning(f"[TEMPLATE] Cannot remove asset {asset}: {e}")
+
+    evicted = template_cache.evict_content(released_hashes) if released_hashes else 0
+    logger.info(f"[TEMPLATE] Deleted {template_id}: removed {len(released_hashes)} assets, evicted {evicted} cache entries")
+    return True
+
+def _warm_variants(template, frame_id, scale):
+    """Các biến thể warm_template tạo cho một frame type ở một tỉ lệ: {(kích thước, hướng crop): số byte ước tính}"""
+    bands = (3 if template["background_path"] else 0) + (4 if template["overlay_path"] else 0)
+    print_layout = get_frame_layout(frame_id, SCALE_PRINT)
+    # Bản video thu nhỏ từ bản khung in nên luôn cần cả bản này
+    variants = {(print_layout.size, print_layout.template_crop): bands * print_layout.width * print_layout.height}
+    if scale == SCALE_VIDEO:
+        video_layout = get_frame_layout(frame_id, SCALE_VIDEO)
+        variants[(video_layout.size, video_layout.template_crop)] = bands * video_layout.width * video_layout.height
+    return variants
+
+def warm_template(template_id, frame_types, scales=(SCALE_PRINT, SCALE_VIDEO)):
+    """
+    Chuẩn bị sẵn các biến thể đã fit cho frame_types ở các tỉ lệ scales (ảnh in / layer video).
+    Bản khung in mỗi frame type tới vài chục MB, nên chỉ warm tới TEMPLATE_WARM_MAX_BYTES để
+    warm-up không đẩy chính nó và các template khác ra khỏi template cache; phần còn lại được tạo
+    ở request render đầu tiên.
+    """
+    from utils.video_processing import prepare_video_layer
+
+    template = get_template(template_id)
+    if not template:
+        return
+    start_time = time.perf_counter()
+    counted = {}  # Biến thể đã warm (frame type cùng kích thước dùng chung một entry cache)
+    warmed, skipped = [], []
+    for frame_id in frame_types:
+        for scale in scales:
+            variants = {key: nbytes for key, nbytes in _warm_variants(template, frame_id, scale).items() if key not in counted}
+            if sum(counted.values()) + sum(variants.values()) > TEMPLATE_WARM_MAX_BYTES:
+                skipped.append(f"{frame_id}/{scale}")
+                continue
+            layout = get_frame_layout(frame_id, scale)
+            try:
+                if scale == SCALE_VIDEO:
+                    prepare_video_layer(template["background_path"], "RGB", layout)
+                    prepare_video_layer(template["overlay_path"], "RGBA", layout)
+                else:
+                    get_template_image(template["background_path"], "RGB", layout.size, layout.template_crop)
+                    get_template_image(template["overlay_path"], "RGBA", layout.size, layout.template_crop)
+            except Exception as e:
+                logger.warning(f"[TEMPLATE] Warm-up failed for {template_id} (frame {frame_id}, {scale}): {e}")
+                continue
+            counted.update(variants)
+            warmed.append(f"{frame_id}/{scale}")
+    if skipped:
+        logger.warning(f"[TEMPLATE] Warm-up of {template_id} capped at {TEMPLATE_WARM_MAX_BYTES // (1024 * 1024)} MB, "
+                       f"skipped {', '.join(skipped)}")
+    logger.info(f"[TEMPLATE] Warmed {template_id} for {', '.join(warmed) or 'nothing'} "
+                f"(~{sum(counted.values()) / (1024 * 1024):.0f} MB) in {time.perf_counter() - start_time:.2f}s")
@@ -0,0 +1,102 @@
+# utils/transcode_cache.py
+"""
+Cache kết quả transcode trên đĩa, key theo hash nội dung file nguồn + tham số encode,
+để clip được gửi lại (retry, submit lại) không phải encode lại lần nữa.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+from config import TRANSCODE_CACHE_FOLDER, TRANSCODE_CACHE_MAX_BYTES
+from utils.logging import setup_logging
+from utils.file_handling import hash_file_content
+
+logger = setup_logging()
+
+def _link_or_copy(src, dst):
+    """Hardlink nếu được (không tốn dung lượng), ngược lại copy"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+class TranscodeCache:
+    def __init__(self, cache_dir=TRANSCODE_CACHE_FOLDER, max_bytes=TRANSCODE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, input_file, params):
+        """Key = hash nội dung + tham số encode (sắp xếp ổn định)"""
+        params_text = json.dumps(params, sort_keys=True)
+        params_hash = hashlib.sha256(params_text.encode('utf-8')).hexdigest()[:16]
+        return f"{hash_file_content(input_file)}_{params_hash}"
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp4")
+
+    def fetch(self, key, output_file):
+        """
+        Nếu cache có key thì link/copy ra output_file.
+
+        Returns:
+            bool: True nếu cache hit
+        """
+        entry = self._entry_path(key)
+        with self._lock:
+            if not os.path.exists(entry) or os.path.getsize(entry) == 0:
+                self.misses += 1
+                return False
+            self.hits += 1
+            os.utime(entry, None)  # Đánh dấu dùng gần đây cho LRU
+        _link_or_copy(entry, output_file)
+        logger.info(f"[TRANSCODE CACHE] Hit {key[:12]} -> {output_file}")
+        return True
+
+    def store(self, key, output_file):
+        """Lưu file transcode vào cache (link/copy), giữ nguyên output_file cho caller"""
+        entry = self._entry_path(key)
+        tmp_entry = f"{entry}.{threading.get_ident()}.tmp"
+        try:
+            _link_or_copy(output_file, tmp_entry)
+            os.replace(tmp_entry, entry)
+        except OSError as e:
+            logger.warning(f"[TRANSCODE CACHE] Cannot store {output_file}: {e}")
+            if os.path.exists(tmp_entry):
+                os.remove(tmp_entry)
+            return
+        self._evict()
+
+    def _evict(self):
+        """Xoá các entry cũ nhất (theo mtime) khi vượt quá dung lượng cho phép"""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.mp4'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "cache_dir": self.cache_dir}
+
+transcode_cache = TranscodeCache()
@@ -2,10 +2,32 @@
 import requests
 import os
 import tempfile
+import threading
+from requests.adapters import HTTPAdapter
 from typing import Optional
 
 UPLOAD_VIDEO_URL = "https://upload.dananggo.com/api.php?action=upload_video"
 UPLOAD_IMAGE_URL = "https://upload.dananggo.com/api.php?action=upload_image"
+UPLOAD_CONNECT_TIMEOUT = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_upload_session() -> requests.Session:
+    """
+    requests.Session dùng chung cho mọi upload: giữ kết nối keep-alive tới upload host
+    (không phải bắt tay TCP/TLS lại mỗi file), pool đủ cho MAX_UPLOAD_WORKERS upload song song.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            from config import MAX_UPLOAD_WORKERS
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, MAX_UPLOAD_WORKERS))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
 
 def wait_for_file_completion(file_path: str, max_wait: int = 5) -> bool:
     """
@@ -83,10 +105,10 @@ def upload_video_to_host(video_file_path: str, cleanup_after_upload: bool = True
             
             # Make upload request
             from config import UPLOAD_TIMEOUT
-            response = requests.post(
+            response = get_upload_session().post(
                 UPLOAD_VIDEO_URL,
                 files=files,
-                timeout=UPLOAD_TIMEOUT or 120  # Use config value or default to 2 minutes
+                timeout=(UPLOAD_CONNECT_TIMEOUT, UPLOAD_TIMEOUT or 120)  # Use config value or default to 2 minutes
             )
             
             response.raise_for_status()  # Raise exception for bad status codes
@@ -196,10 +218,10 @@ def upload_image_to_host(image_file_path: str, cleanup_after_upload: bool = Fals
             
             # Make upload request
             from config import UPLOAD_TIMEOUT
-            response = requests.post(
+            response = get_upload_session().post(
                 UPLOAD_IMAGE_URL,
                 files=files,
-                timeout=UPLOAD_TIMEOUT or 60  # Use config value or default to 1 minute
+                timeout=(UPLOAD_CONNECT_TIMEOUT, UPLOAD_TIMEOUT or 60)  # Use config value or default to 1 minute
             )
             
             response.raise_for_status()  # Raise exception for bad status codes
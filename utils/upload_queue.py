@@ -0,0 +1,278 @@
+# utils/upload_queue.py
+"""
+Hàng đợi upload chạy nền: render job chỉ cần ghi xong file rồi đưa vào hàng đợi, không còn giữ
+worker render trong lúc upload (tối đa UPLOAD_TIMEOUT giây mỗi file).
+
+- MAX_UPLOAD_WORKERS thread upload dùng chung một requests.Session keep-alive (utils.upload)
+- Lỗi mạng thì thử lại với backoff luỹ thừa (UPLOAD_RETRY_BASE_DELAY, tối đa UPLOAD_RETRY_MAX_DELAY)
+- Mỗi task được ghi ra một file JSON trong UPLOAD_QUEUE_FOLDER, upload dở được tiếp tục sau khi restart
+- Upload host lỗi liên tục thì circuit breaker mở: task được hoãn tới lúc breaker cho thử lại,
+  không tốn lượt thử và không giữ worker chờ timeout
+"""
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from config import (
+    UPLOAD_QUEUE_FOLDER, MAX_UPLOAD_WORKERS, UPLOAD_MAX_ATTEMPTS, UPLOAD_RETRY_BASE_DELAY,
+    UPLOAD_RETRY_MAX_DELAY, UPLOAD_TASK_RETENTION,
+)
+from utils.circuit_breaker import upload_breaker
+from utils.upload import upload_image_to_host, upload_video_to_host
+from utils.logging import setup_logging
+
+logger = setup_logging()
+
+UPLOAD_PENDING = "pending"
+UPLOAD_RUNNING = "uploading"
+UPLOAD_DONE = "done"
+UPLOAD_FAILED = "failed"
+
+KIND_IMAGE = "image"
+KIND_VIDEO = "video"
+
+class UploadQueue:
+    def __init__(self, folder=UPLOAD_QUEUE_FOLDER, workers=MAX_UPLOAD_WORKERS, max_attempts=UPLOAD_MAX_ATTEMPTS,
+                 base_delay=UPLOAD_RETRY_BASE_DELAY, max_delay=UPLOAD_RETRY_MAX_DELAY, retention=UPLOAD_TASK_RETENTION):
+        self.folder = folder
+        self.workers = max(1, int(workers))
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retention = retention
+        self.on_complete = None  # callback(task) sau khi upload thành công, vd. cập nhật media session
+        self._tasks = {}  # task_id -> dict
+        self._by_path = {}  # đường dẫn file -> task_id (mỗi file chỉ upload một lần)
+        self._schedule = []  # heap (thời điểm thử tiếp, thứ tự, task_id)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        """
+        Nạp lại các task còn trên đĩa và khởi động worker (gọi nhiều lần không sao).
+        Gọi lười từ enqueue/get/stats (hoặc lúc khởi động server), không gọi lúc import module:
+        process con của pool import lại module chính và không được upload trùng task.
+        """
+        with self._cond:
+            if self._threads:
+                return
+            os.makedirs(self.folder, exist_ok=True)
+            resumed = 0
+            for filename in os.listdir(self.folder):
+                if not filename.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.folder, filename), "r", encoding="utf-8") as f:
+                        task = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    logger.warning(f"[UPLOAD QUEUE] Skipping unreadable task {filename}: {e}")
+                    continue
+                self._tasks[task["task_id"]] = task
+                self._by_path[task["file_path"]] = task["task_id"]
+                if task["status"] in (UPLOAD_PENDING, UPLOAD_RUNNING):
+                    # Upload đang chạy dở lúc tắt server thì thử lại từ đầu
+                    task["status"] = UPLOAD_PENDING
+                    self._schedule_locked(task, task.get("next_attempt_at") or time.time())
+                    resumed += 1
+            self._prune_locked()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"upload-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"[UPLOAD QUEUE] Started {self.workers} upload workers, resumed {resumed} pending uploads")
+
+    def enqueue(self, file_path, kind, media_session_code=None, session_field=None, cleanup=False):
+        """
+        Đưa file vào hàng đợi upload. File đã có trong hàng đợi (hoặc đã upload) thì trả về task cũ.
+
+        Args:
+            kind (str): "image" hoặc "video"
+            media_session_code (str, optional): Session cần cập nhật URL khi upload xong
+            session_field (str, optional): Tham số của update_media_session (image_url, video_url, fast_video_url)
+            cleanup (bool): Xoá file local sau khi upload thành công
+
+        Returns:
+            dict: Snapshot task (task_id, status, url...)
+        """
+        self.start()
+        file_path = os.path.abspath(file_path)
+        with self._cond:
+            task_id = self._by_path.get(file_path)
+            if task_id in self._tasks and self._tasks[task_id]["status"] != UPLOAD_FAILED:
+                return dict(self._tasks[task_id])
+
+            task = {
+                "task_id": uuid.uuid4().hex,
+                "kind": kind,
+                "file_path": file_path,
+                "media_session_code": media_session_code,
+                "session_field": session_field,
+                "cleanup": cleanup,
+                "status": UPLOAD_PENDING,
+                "url": None,
+                "attempts": 0,
+                "last_error": None,
+                "created_at": time.time(),
+                "next_attempt_at": time.time(),
+                "finished_at": None,
+            }
+            self._tasks[task["task_id"]] = task
+            self._by_path[file_path] = task["task_id"]
+            self._persist_locked(task)
+            self._schedule_locked(task, task["next_attempt_at"])
+            self._prune_locked()
+            logger.info(f"[UPLOAD QUEUE] Queued {kind} upload {task['task_id']}: {os.path.basename(file_path)}")
+            return dict(task)
+
+    def get(self, task_id):
+        self.start()
+        with self._cond:
+            task = self._tasks.get(task_id)
+            return dict(task) if task else None
+
+    def wait(self, task_id, timeout):
+        """Chờ task upload xong (thành công hoặc bỏ cuộc) tối đa timeout giây, trả về snapshot task"""
+        self.start()
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                task = self._tasks.get(task_id)
+                remaining = deadline - time.time()
+                if not task or task["status"] in (UPLOAD_DONE, UPLOAD_FAILED) or remaining <= 0:
+                    return dict(task) if task else None
+                self._cond.wait(timeout=remaining)
+
+    def uploaded_url(self, filename):
+        """URL trên host của file output (theo tên file) nếu đã upload xong, dùng khi file local đã bị xoá"""
+        self.start()
+        with self._cond:
+            for file_path, task_id in self._by_path.items():
+                task = self._tasks.get(task_id)
+                if task and task["status"] == UPLOAD_DONE and os.path.basename(file_path) == filename:
+                    return task["url"]
+        return None
+
+    def stats(self):
+        self.start()
+        with self._cond:
+            counts = {status: 0 for status in (UPLOAD_PENDING, UPLOAD_RUNNING, UPLOAD_DONE, UPLOAD_FAILED)}
+            for task in self._tasks.values():
+                counts[task["status"]] += 1
+            return {"workers": self.workers, "max_attempts": self.max_attempts, **counts}
+
+    def _task_path(self, task_id):
+        return os.path.join(self.folder, f"{task_id}.json")
+
+    def _persist_locked(self, task):
+        """Ghi task ra đĩa (ghi file tạm rồi rename để không bao giờ để lại JSON dở)"""
+        path = self._task_path(task["task_id"])
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(task, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"[UPLOAD QUEUE] Cannot persist task {task['task_id']}: {e}")
+
+    def _schedule_locked(self, task, at):
+        task["next_attempt_at"] = at
+        heapq.heappush(self._schedule, (at, next(self._sequence), task["task_id"]))
+        self._cond.notify()
+
+    def _prune_locked(self):
+        """Bỏ task đã xong/thất bại quá retention giây (cả trong bộ nhớ lẫn trên đĩa)"""
+        expire_before = time.time() - self.retention
+        for task_id in [task_id for task_id, task in self._tasks.items()
+                        if task["finished_at"] and task["finished_at"] < expire_before]:
+            task = self._tasks.pop(task_id)
+            if self._by_path.get(task["file_path"]) == task_id:
+                del self._by_path[task["file_path"]]
+            try:
+                os.remove(self._task_path(task_id))
+            except OSError:
+                pass
+
+    def _retry_delay(self, attempts):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)  # Jitter để các booth không cùng thử lại một lúc
+
+    def _next_task(self):
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._schedule and self._schedule[0][0] <= now:
+                    _, _, task_id = heapq.heappop(self._schedule)
+                    task = self._tasks.get(task_id)
+                    if not task or task["status"] != UPLOAD_PENDING:
+                        continue
+                    if not upload_breaker.allow_request(task_id):
+                        self._schedule_locked(task, upload_breaker.retry_at())
+                        continue
+                    task["status"] = UPLOAD_RUNNING
+                    task["attempts"] += 1
+                    self._persist_locked(task)
+                    return task
+                self._cond.wait(timeout=self._schedule[0][0] - now if self._schedule else None)
+
+    def _upload(self, task):
+        if task["kind"] == KIND_VIDEO:
+            return upload_video_to_host(task["file_path"], cleanup_after_upload=False)
+        return upload_image_to_host(task["file_path"])
+
+    def _worker(self):
+        while True:
+            task = self._next_task()
+            name = os.path.basename(task["file_path"])
+            if not os.path.exists(task["file_path"]):
+                url, error = None, "File not found"
+                # Không gọi ra ngoài: trả lại lượt thử half-open (nếu task này đang giữ),
+                # nếu không breaker kẹt ở half-open và không upload nào chạy được nữa
+                upload_breaker.release_probe(task["task_id"])
+            else:
+                start_time = time.perf_counter()
+                try:
+                    url = self._upload(task)
+                    error = None if url else "Upload failed"
+                except Exception as e:
+                    url, error = None, str(e)
+                elapsed = time.perf_counter() - start_time
+                if url:
+                    upload_breaker.record_success()
+                else:
+                    upload_breaker.record_failure(error)
+
+            with self._cond:
+                if url:
+                    task.update(status=UPLOAD_DONE, url=url, last_error=None, finished_at=time.time())
+                    logger.info(f"[UPLOAD QUEUE] Uploaded {name} in {elapsed:.2f}s (attempt {task['attempts']}): {url}")
+                elif error == "File not found" or task["attempts"] >= self.max_attempts:
+                    task.update(status=UPLOAD_FAILED, last_error=error, finished_at=time.time())
+                    logger.error(f"[UPLOAD QUEUE] Giving up on {name} after {task['attempts']} attempts: {error}")
+                else:
+                    task.update(status=UPLOAD_PENDING, last_error=error)
+                    delay = self._retry_delay(task["attempts"])
+                    self._schedule_locked(task, time.time() + delay)
+                    logger.warning(f"[UPLOAD QUEUE] Upload of {name} failed (attempt {task['attempts']}): {error}, "
+                                   f"retrying in {delay:.1f}s")
+                self._persist_locked(task)
+                self._cond.notify_all()  # Đánh thức request đang chờ upload (wait)
+                snapshot = dict(task)
+
+            if snapshot["status"] == UPLOAD_DONE:
+                if snapshot["cleanup"]:
+                    try:
+                        os.remove(snapshot["file_path"])
+                    except OSError:
+                        pass
+                if self.on_complete:
+                    try:
+                        self.on_complete(snapshot)
+                    except Exception as e:
+                        logger.error(f"[UPLOAD QUEUE] Completion callback failed for {name}: {e}")
+
+upload_queue = UploadQueue()
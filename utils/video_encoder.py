@@ -0,0 +1,152 @@
+"""
+Encoder video một lượt: pipe frame BGR thô thẳng vào một tiến trình ffmpeg libx264
+và ghi trực tiếp file MP4 (faststart) cuối cùng, không cần standardize_video sau đó.
+"""
+import os
+import re
+import subprocess
+import platform
+import tempfile
+import time
+import numpy as np
+from utils.logging import setup_logging
+from utils.ffmpeg_utils import get_ffmpeg_command
+from utils.ffmpeg_budget import ffmpeg_thread_budget
+
+logger = setup_logging()
+
+ENCODER_OPENCV = "opencv"
+ENCODER_FFMPEG_PIPE = "ffmpeg_pipe"
+ENCODER_BACKENDS = (ENCODER_OPENCV, ENCODER_FFMPEG_PIPE)
+
+_BENCH_RE = re.compile(r"bench: utime=([\d.]+)s stime=([\d.]+)s rtime=([\d.]+)s")
+
+def get_subprocess_args():
+    """
+    Trả về các tham số phù hợp cho subprocess tùy theo hệ điều hành
+
+    Returns:
+        dict: Dictionary chứa các tham số cho subprocess
+    """
+    args = {}
+    if platform.system() == "Windows":
+        args["creationflags"] = subprocess.CREATE_NO_WINDOW
+    return args
+
+class FFmpegPipeWriter:
+    """
+    Writer tương thích giao diện cv2.VideoWriter (isOpened/write/release) nhưng
+    stream frame bgr24 qua stdin vào ffmpeg libx264. Output đã là h264 yuv420p
+    + faststart nên không cần chuẩn hóa lại.
+    """
+
+    def __init__(self, output_file, fps, width, height, crf=23, preset="fast", threads=1):
+        self.output_file = output_file
+        self.width = width
+        self.height = height
+        self.frame_count = 0
+        self.stats = None
+        self._frame_bytes = width * height * 3
+        self._stderr = tempfile.TemporaryFile()
+        self._start_time = time.perf_counter()
+
+        cmd = [
+            get_ffmpeg_command(), '-y', '-hide_banner', '-nostats', '-benchmark',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+            '-s', f'{width}x{height}', '-r', f'{fps:.3f}',
+            '-i', '-',
+            '-an',
+            '-c:v', 'libx264',
+            '-preset', preset,
+            '-crf', str(crf),
+            '-pix_fmt', 'yuv420p',
+            '-profile:v', 'high',
+            '-level', '4.0',
+            '-movflags', '+faststart',
+            # Phần ngân sách ffmpeg caller đã giữ cho encoder này (không để ffmpeg tự dùng hết core)
+            '-threads', str(threads),
+            output_file,
+        ]
+
+        self.process = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr,
+            **get_subprocess_args()
+        )
+        ffmpeg_thread_budget.track(self.process)
+
+    def isOpened(self):
+        return self.process is not None and self.process.poll() is None
+
+    def write(self, frame):
+        if frame.shape[0] != self.height or frame.shape[1] != self.width:
+            raise ValueError(f"Frame size {frame.shape[1]}x{frame.shape[0]} != encoder size {self.width}x{self.height}")
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        except (BrokenPipeError, OSError) as e:
+            raise RuntimeError(f"FFmpeg encoder closed unexpectedly: {self._read_stderr_tail()}") from e
+        self.frame_count += 1
+
+    def release(self):
+        """
+        Đóng stdin, đợi ffmpeg ghi xong file.
+
+        Returns:
+            bool: True nếu ffmpeg kết thúc thành công và file output không rỗng
+        """
+        if self.process is None:
+            return self.stats is not None and self.stats["ok"]
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        returncode = self.process.wait()
+        ffmpeg_thread_budget.untrack(self.process)
+        stderr_text = self._read_stderr_tail(limit=None)
+        self._stderr.close()
+        self.process = None
+
+        ok = returncode == 0 and os.path.exists(self.output_file) and os.path.getsize(self.output_file) > 0
+        self.stats = {
+            "ok": ok,
+            "frames": self.frame_count,
+            "wall_time": time.perf_counter() - self._start_time,
+        }
+        match = _BENCH_RE.search(stderr_text)
+        if match:
+            self.stats["ffmpeg_cpu_time"] = float(match.group(1)) + float(match.group(2))
+
+        if ok:
+            logger.info(f"[VIDEO ENCODER] ffmpeg_pipe: {self.frame_count} frames -> {self.output_file}, "
+                        f"wall {self.stats['wall_time']:.2f}s, ffmpeg cpu {self.stats.get('ffmpeg_cpu_time', 0):.2f}s")
+        else:
+            logger.error(f"[VIDEO ENCODER] ffmpeg_pipe failed (code {returncode}): {stderr_text[-2000:]}")
+        return ok
+
+    def abort(self):
+        """Huỷ encode khi render lỗi giữa chừng: dừng ffmpeg (không mux file dở) và xoá output"""
+        if self.process is None:
+            return
+        # Kill trước khi đóng stdin: đóng stdin trước thì ffmpeg coi là EOF và mux file dở
+        self.process.kill()
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.wait()
+        ffmpeg_thread_budget.untrack(self.process)
+        self._stderr.close()
+        self.process = None
+        self.stats = {"ok": False, "frames": self.frame_count, "wall_time": time.perf_counter() - self._start_time}
+        try:
+            os.remove(self.output_file)
+        except OSError:
+            pass
+        logger.warning(f"[VIDEO ENCODER] ffmpeg_pipe aborted after {self.frame_count} frames: {self.output_file}")
+
+    def _read_stderr_tail(self, limit=2000):
+        try:
+            self._stderr.seek(0)
+            text = self._stderr.read().decode("utf-8", errors="replace")
+        except (ValueError, OSError):
+            return ""
+        return text if limit is None else text[-limit:]
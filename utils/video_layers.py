@@ -0,0 +1,90 @@
+# utils/video_layers.py
+"""
+Layer tĩnh (background + overlay) cho compositor video, được chuẩn bị một lần cho mỗi job
+thay vì convert lại PIL -> numpy và tính alpha float64 ở mỗi frame.
+"""
+import cv2
+import numpy as np
+
+class VideoLayerStack:
+    """
+    - background: BGR uint8 đúng kích thước output (hoặc nền trắng)
+    - overlay: màu BGR đã premultiply với alpha (uint8) + (255 - alpha) 3 kênh (uint8),
+      chỉ giữ trong bounding box vùng alpha > 0
+
+    Blend mỗi frame: frame = frame * (255 - a) / 255 + premul, dùng cv2.multiply/cv2.add
+    (SIMD, nhả GIL) thay vì float64 theo từng kênh.
+    """
+
+    def __init__(self, output_size, background_bgr=None, overlay_rgba=None):
+        self.width, self.height = output_size
+        if background_bgr is not None:
+            self.background = np.ascontiguousarray(background_bgr, dtype=np.uint8)
+        else:
+            self.background = np.full((self.height, self.width, 3), 255, dtype=np.uint8)
+        self._buffer = np.empty_like(self.background)
+
+        self.overlay_box = None
+        self.overlay_premul = None
+        self.overlay_inv_alpha = None
+        if overlay_rgba is not None and overlay_rgba.shape[2] == 4:
+            self._compile_overlay(overlay_rgba)
+
+    @classmethod
+    def from_images(cls, output_size, background_img=None, overlay_img=None):
+        """Tạo layer stack từ background PIL RGB và overlay PIL RGBA đã fit đúng output_size"""
+        background_bgr = cv2.cvtColor(np.array(background_img), cv2.COLOR_RGB2BGR) if background_img is not None else None
+        overlay_rgba = np.array(overlay_img) if overlay_img is not None else None
+        return cls(output_size, background_bgr, overlay_rgba)
+
+    def _compile_overlay(self, overlay_rgba):
+        alpha = overlay_rgba[:, :, 3]
+        rows = np.flatnonzero(alpha.any(axis=1))
+        cols = np.flatnonzero(alpha.any(axis=0))
+        if rows.size == 0:
+            return  # Overlay trong suốt hoàn toàn
+        y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        self.overlay_box = (y0, y1, x0, x1)
+
+        alpha = alpha[y0:y1, x0:x1]
+        color_bgr = cv2.cvtColor(np.ascontiguousarray(overlay_rgba[y0:y1, x0:x1, :3]), cv2.COLOR_RGB2BGR)
+        alpha3 = cv2.merge([alpha, alpha, alpha])
+        self.overlay_premul = cv2.multiply(color_bgr, alpha3, scale=1.0 / 255)
+        self.overlay_inv_alpha = cv2.subtract(np.full_like(alpha3, 255), alpha3)
+
+    def fork(self):
+        """
+        Bản sao dùng chung các mảng layer (chỉ đọc) nhưng có buffer frame riêng,
+        để nhiều job dùng cùng một layer stack đã cache mà không ghi đè frame của nhau.
+        """
+        clone = object.__new__(type(self))
+        clone.__dict__.update(self.__dict__)
+        clone._buffer = np.empty_like(self.background)
+        return clone
+
+    @property
+    def nbytes(self):
+        """Dung lượng các mảng layer (không tính buffer frame)"""
+        total = self.background.nbytes
+        if self.overlay_box is not None:
+            total += self.overlay_premul.nbytes + self.overlay_inv_alpha.nbytes
+        return total
+
+    def new_frame(self):
+        """
+        Trả về frame nền cho frame tiếp theo. Buffer được dùng lại giữa các frame,
+        caller phải ghi/encode xong frame trước khi gọi new_frame() lần nữa.
+        """
+        np.copyto(self._buffer, self.background)
+        return self._buffer
+
+    def apply_overlay(self, frame):
+        """Blend overlay lên frame (in-place) bằng số nguyên, trả về frame"""
+        if self.overlay_box is None:
+            return frame
+        y0, y1, x0, x1 = self.overlay_box
+        roi = frame[y0:y1, x0:x1]
+        blended = cv2.multiply(roi, self.overlay_inv_alpha, scale=1.0 / 255)
+        cv2.add(blended, self.overlay_premul, dst=blended)
+        roi[...] = blended
+        return frame
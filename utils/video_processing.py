@@ -8,12 +8,21 @@ import shutil
 import subprocess
 import os
 import tempfile
-import json
 import platform
 from pathlib import Path
-from config import VIDEO_FPS, FAST_VIDEO_DURATION, OUTPUT_FOLDER, get_frame_margin, get_frame_gap, FRAME_TYPES, get_daily_folder
-from .image_processing import fit_cover_image, calc_positions
-from .ffmpeg_utils import get_ffmpeg_command, get_ffprobe_command, check_ffmpeg_availability, check_ffprobe_availability
+import time
+from config import VIDEO_FPS, FAST_VIDEO_DURATION, OUTPUT_FOLDER, get_daily_folder, VIDEO_ENCODER_BACKEND, VIDEO_SLOT_DECODER, VIDEO_RENDER_ENGINE, VIDEO_PREFETCH_DEPTH, FFMPEG_PROCESS_THREADS
+from .image_processing import fit_cover_image, get_image_crop_direction
+from .frame_layout import get_frame_layout, SCALE_VIDEO
+from .ffmpeg_utils import get_ffmpeg_command, get_ffprobe_command, check_ffmpeg_availability
+from .video_encoder import FFmpegPipeWriter, ENCODER_OPENCV, ENCODER_FFMPEG_PIPE
+from .video_readers import FFmpegSlotReader, DecimatingReader, iter_looping_frames
+from .decode_pipeline import PrefetchPipeline
+from .ffmpeg_compositor import render_layout_video, ENGINE_FFMPEG
+from .ffmpeg_budget import ffmpeg_thread_budget
+from .template_cache import get_scaled_template_image, get_video_layer_stack
+from .performance import get_cpu_seconds
+from .media_probe import probe_media, has_video_stream
 
 def get_subprocess_args():
     """
@@ -71,6 +80,81 @@ def create_video_writer(output_file, fps, width, height):
     
     raise ValueError(f"Cannot create video output with any available codec. Tried: {codecs}")
 
+def create_video_encoder(output_file, fps, width, height, encoder=None, threads=1):
+    """
+    Tạo encoder theo backend được chọn (ffmpeg_pipe hoặc opencv).
+    ffmpeg_pipe fallback về OpenCV VideoWriter nếu không có ffmpeg.
+    threads: số thread -threads cho ffmpeg, nằm trong phần ngân sách caller đã giữ (acquire_render_threads).
+
+    Returns:
+        tuple: (writer, backend thực tế được dùng)
+    """
+    encoder = encoder or VIDEO_ENCODER_BACKEND
+    if encoder == ENCODER_FFMPEG_PIPE:
+        if check_ffmpeg_availability():
+            try:
+                writer = FFmpegPipeWriter(output_file, fps, width, height, crf=23, preset="fast", threads=threads)
+                if writer.isOpened():
+                    return writer, ENCODER_FFMPEG_PIPE
+                writer.release()
+            except (OSError, ValueError) as e:
+                print(f"[VIDEO] Cannot start ffmpeg pipe encoder: {str(e)}")
+        print("[VIDEO] ffmpeg pipe encoder unavailable, falling back to OpenCV VideoWriter")
+    out, _ = create_video_writer(output_file, fps, width, height)
+    return out, ENCODER_OPENCV
+
+def acquire_render_threads(slot_count, encoder_count):
+    """
+    Giữ thread từ ngân sách ffmpeg chung cho một lượt render: mỗi decoder slot 1 thread, mỗi encoder
+    tối đa FFMPEG_PROCESS_THREADS. Luôn được cấp ít nhất slot_count + encoder_count (1 thread cho mỗi
+    decoder/encoder) nên encoder chia phần còn lại được ít nhất 1 thread mà tổng không vượt phần được cấp.
+    Caller gọi ffmpeg_thread_budget.release sau khi các tiến trình kết thúc.
+
+    Returns:
+        int: Số thread được cấp; encoder chia đều phần còn lại sau decoder
+    """
+    return ffmpeg_thread_budget.acquire(slot_count + encoder_count * FFMPEG_PROCESS_THREADS,
+                                        minimum=slot_count + encoder_count)
+
+def finalize_video_encoder(out, encoder, temp_output_file, start_time, start_cpu, label="VIDEO"):
+    """
+    Đóng encoder và trả về file MP4 h264 cuối cùng.
+    Với opencv cần chuẩn hóa lại bằng standardize_video; ffmpeg_pipe đã ra file cuối.
+    Log wall time và CPU time của cả lượt render để so sánh giữa các backend.
+    """
+    if encoder == ENCODER_FFMPEG_PIPE:
+        if not out.release():
+            raise ValueError(f"FFmpeg pipe encoder failed for {temp_output_file}")
+        optimized_file = temp_output_file
+    else:
+        out.release()
+        # Đảm bảo file hoàn tất trước khi tối ưu và upload
+        time.sleep(0.5)  # Wait for file to be completely written
+        # Chuẩn hóa video thành h264+aac
+        from utils.video_standardizer import standardize_video
+        optimized_file = standardize_video(temp_output_file, crf=23, preset="fast")
+
+    from utils.logging import setup_logging
+    setup_logging().info(f"[{label} ENCODER] backend={encoder}, wall={time.perf_counter() - start_time:.2f}s, "
+                         f"cpu={get_cpu_seconds() - start_cpu:.2f}s, output={optimized_file}")
+    return optimized_file
+
+def abort_video_encoder(out, output_file):
+    """Đóng encoder của lượt render lỗi và xoá file dở (gọi trên encoder đã finalize thì chỉ xoá file)"""
+    if hasattr(out, "abort"):
+        out.abort()
+    else:
+        out.release()
+    remove_video_files([output_file])
+
+def remove_video_files(paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"[VIDEO] Cannot remove {path}: {str(e)}")
+
 def optimize_video_for_opencv(input_file):
     """
     Tối ưu hóa video đặc biệt cho OpenCV processing
@@ -99,12 +183,13 @@ def optimize_video_for_opencv(input_file):
             '-pix_fmt', 'yuv420p',  # Pixel format OpenCV handles well
             '-r', str(min(video_info.get('fps', 30), 30)),  # Cap FPS at 30
             '-an',  # Remove audio for video processing
-            optimized_file
         ]
         
         print(f"[VIDEO OPTIMIZE] Optimizing {input_file} for OpenCV...")
         subprocess_args = get_subprocess_args()
-        subprocess.run(cmd, check=True, capture_output=True, **subprocess_args)
+        with ffmpeg_thread_budget.reserve(FFMPEG_PROCESS_THREADS) as granted_threads:
+            ffmpeg_thread_budget.run(cmd + ['-threads', str(granted_threads), optimized_file],
+                                     check=True, capture_output=True, **subprocess_args)
 
         if os.path.exists(optimized_file) and os.path.getsize(optimized_file) > 0:
             print(f"[VIDEO OPTIMIZE] Successfully optimized: {optimized_file}")
@@ -126,9 +211,7 @@ def apply_background_and_overlay_video(frame, background_path, overlay_path, out
     
     if background_path and os.path.exists(background_path):
         bg = Image.open(background_path).convert("RGB")
-        crop_direction = "top" if frame_type and (
-            (frame_type.get("columns") == 1 and frame_type.get("rows") == 1 and not frame_type.get("isCircle", False)) or
-            (frame_type.get("columns") == 2 and frame_type.get("rows") == 2)) else "center"
+        crop_direction = get_image_crop_direction(frame_type)
         bg = fit_cover_image(bg, working_size if scale_factor != 1.0 else output_size, crop_direction)
         result = cv2.cvtColor(np.array(bg), cv2.COLOR_RGB2BGR)
     
@@ -142,9 +225,7 @@ def apply_background_and_overlay_video(frame, background_path, overlay_path, out
     
     if overlay_path and os.path.exists(overlay_path):
         overlay = Image.open(overlay_path).convert("RGBA")
-        crop_direction = "top" if frame_type and (
-            (frame_type.get("columns") == 1 and frame_type.get("rows") == 1 and not frame_type.get("isCircle", False)) or
-            (frame_type.get("columns") == 2 and frame_type.get("rows") == 2)) else "center"
+        crop_direction = get_image_crop_direction(frame_type)
         overlay = fit_cover_image(overlay, working_size if scale_factor != 1.0 else output_size, crop_direction)
         overlay_np = np.array(overlay)
         if overlay_np.shape[2] == 4:
@@ -159,7 +240,46 @@ def apply_background_and_overlay_video(frame, background_path, overlay_path, out
     
     return result
 
-def process_video_frame(frame, media, pos, size, is_circle, frame_type=None):
+def open_video_captures(video_files, slot_size=None, crop_top=False, decoder=None, loop=False, label="VIDEO"):
+    """
+    Mở reader cho từng slot video.
+
+    Với decoder "ffmpeg" (cần slot_size), ffmpeg decode và scale/crop sẵn về kích thước slot;
+    slot nào ffmpeg không đọc được sẽ fallback về cv2.VideoCapture (có tối ưu hóa nếu cần).
+
+    Returns:
+        list: Danh sách reader theo thứ tự video_files
+    """
+    decoder = decoder or VIDEO_SLOT_DECODER
+    use_ffmpeg = decoder == "ffmpeg" and slot_size is not None and check_ffmpeg_availability()
+    caps = []
+    for video_file in video_files:
+        if use_ffmpeg:
+            info = get_video_info(video_file)
+            reader = FFmpegSlotReader(video_file, slot_size, crop_top, fps=info['fps'] if info else None, loop=loop)
+            if reader.isOpened():
+                caps.append(reader)
+                continue
+            print(f"[{label}] ffmpeg slot reader failed for {video_file}, falling back to OpenCV")
+        
+        cap = cv2.VideoCapture(video_file, cv2.CAP_FFMPEG)
+        # Optimize files for OpenCV if needed
+        if not cap.isOpened():
+            print(f"[{label}] Failed to open {video_file}, trying optimization...")
+            optimized_file = optimize_video_for_opencv(video_file)
+            cap.release()
+            cap = cv2.VideoCapture(optimized_file, cv2.CAP_FFMPEG)
+        caps.append(cap)
+    
+    if not all(cap.isOpened() for cap in caps):
+        for cap in caps:
+            cap.release()
+        raise ValueError("Cannot open video files even after optimization!")
+    return caps
+
+def process_video_frame(frame, media, pos, layout):
+    """Resize/crop frame nguồn về slot của layout (video) rồi dán vào frame tại pos"""
+    size, is_circle = layout.slot_size, layout.is_circle
     scale_factor = min(1500 / max(media.shape[:2][::-1]), 1.0) if max(media.shape[:2]) > 2000 else 1.0
     if scale_factor != 1.0:
         media = cv2.resize(media, (int(media.shape[1] * scale_factor), int(media.shape[0] * scale_factor)), interpolation=cv2.INTER_AREA)
@@ -173,12 +293,8 @@ def process_video_frame(frame, media, pos, size, is_circle, frame_type=None):
         interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
         media = cv2.resize(media, new_size, interpolation=interpolation)
     
-    crop_left = crop_top = False
-    if frame_type:
-        if frame_type.get("columns") == 1 and frame_type.get("rows") == 1 and not frame_type.get("isCircle", False):
-            crop_top = True
-        elif frame_type.get("columns") == 2 and frame_type.get("rows") == 2:
-            crop_top = True
+    crop_left = False
+    crop_top = layout.slot_crop_top
     
     left = 0 if crop_left else (media.shape[1] - size[0]) // 2 if media.shape[1] > size[0] else 0
     top = 0 if crop_top else (media.shape[0] - size[1]) // 2 if media.shape[0] > size[1] else 0
@@ -190,72 +306,43 @@ def process_video_frame(frame, media, pos, size, is_circle, frame_type=None):
         media = cv2.resize(media, size, interpolation=cv2.INTER_LINEAR)
     
     if is_circle:
-        mask = np.zeros((size[1], size[0]), dtype=np.uint8)
-        cv2.circle(mask, (size[0]//2, size[1]//2), min(size)//2, 255, -1)
-        alpha = np.zeros_like(mask)
-        alpha[mask > 0] = 255
-        rgba = cv2.cvtColor(media, cv2.COLOR_BGR2BGRA)
-        rgba[:, :, 3] = alpha
-        
-        frame_rgba = cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA) if frame.shape[2] == 3 else frame
-        roi = frame_rgba[pos[1]:pos[1]+size[1], pos[0]:pos[0]+size[0]]
-        for c in range(3):
-            roi[:, :, c] = roi[:, :, c] * (1 - rgba[:, :, 3]/255.0) + rgba[:, :, c] * (rgba[:, :, 3]/255.0)
-        roi[:, :, 3] = np.maximum(roi[:, :, 3], rgba[:, :, 3])
-        return cv2.cvtColor(frame_rgba, cv2.COLOR_BGRA2BGR)
+        # Chỉ blend trong ROI của slot với trọng số mask đã tính sẵn, không đổi màu cả frame
+        alpha, inv_alpha = layout.circle_mask
+        roi = frame[pos[1]:pos[1]+size[1], pos[0]:pos[0]+size[0]]
+        frame[pos[1]:pos[1]+size[1], pos[0]:pos[0]+size[0]] = cv2.blendLinear(media, roi, alpha, inv_alpha)
+        return frame
     
     frame[pos[1]:pos[1]+size[1], pos[0]:pos[0]+size[0]] = media
     return frame
 
 def convert_webm_to_mp4(input_file):
     """
-    Chuyển đổi file WebM sang MP4 để tăng tương thích với OpenCV
-    và chuẩn hóa về định dạng h264+aac
+    Chuẩn hóa video upload (WebM hoặc MP4) về h264+aac trong một lần encode ffmpeg.
+    File đã đạt chuẩn được dùng luôn; kết quả encode được lưu vào transcode cache
+    nên clip gửi lại không phải encode lần nữa.
     """
-    if not input_file.lower().endswith('.webm'):
-        # Nếu không phải WebM, vẫn chuẩn hóa về h264+aac
-        from utils.video_standardizer import standardize_video
-        return standardize_video(input_file)
-    
-    # Sử dụng WebM handler chuyên dụng trước
-    from utils.webm_handler import prepare_webm_for_processing
-    converted_file = prepare_webm_for_processing(input_file)
-    
-    # Sau đó chuẩn hóa thành h264+aac
-    if converted_file != input_file:
-        from utils.video_standardizer import standardize_video
-        return standardize_video(converted_file)
+    if input_file.lower().endswith('.webm') and not check_ffmpeg_availability():
+        # Không có ffmpeg thì chỉ còn cách kiểm tra OpenCV đọc trực tiếp được không
+        from utils.webm_handler import prepare_webm_for_processing
+        return prepare_webm_for_processing(input_file)
     
-    return converted_file
+    # Output h264 yuv420p đọc được bằng OpenCV nên không cần bước optimize_webm_for_opencv riêng
+    from utils.video_standardizer import standardize_video
+    return standardize_video(input_file, use_cache=True)
 
 def get_video_info(video_path):
-    """Lấy thông tin video bằng ffprobe"""
-    if not check_ffprobe_availability():
+    """Lấy thông tin video từ media probe service (ffprobe một lần, có cache)"""
+    info = probe_media(video_path)
+    if not info or not info['video_codec']:
         return None
         
-    try:
-        ffprobe_cmd = get_ffprobe_command()
-        
-        cmd = [
-            ffprobe_cmd, '-v', 'quiet', '-print_format', 'json', 
-            '-show_format', '-show_streams', video_path
-        ]
-        subprocess_args = get_subprocess_args()
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, **subprocess_args)
-        data = json.loads(result.stdout)
-        
-        video_stream = next((s for s in data['streams'] if s['codec_type'] == 'video'), None)
-        if not video_stream:
-            return None
-            
-        return {
-            'duration': float(video_stream.get('duration', data['format'].get('duration', 0))),
-            'fps': eval(video_stream.get('r_frame_rate', '30/1')),
-            'width': int(video_stream['width']),
-            'height': int(video_stream['height'])
-        }
-    except (subprocess.CalledProcessError, json.JSONDecodeError, KeyError):
-        return None
+    return {
+        'duration': info['duration'],
+        'fps': info['fps'] or VIDEO_FPS,
+        'width': info['width'],
+        'height': info['height'],
+        'frame_count': info['frame_count']
+    }
  
 def optimize_video(video_file):
     """Tối ưu hóa video với FFmpeg hoặc basic optimization nếu không có FFmpeg"""
@@ -377,276 +464,260 @@ def basic_video_optimization(video_file):
         print(f"Basic optimization error: {str(e)}")
         return video_file
 
-def create_video_output(frame_type, video_files, background_path, overlay_path, total_width, total_height, duration=2, upload_to_host=True):
-    frame_id = next((key for key, value in FRAME_TYPES.items() if
-                     value["columns"] == frame_type["columns"] and
-                     value["rows"] == frame_type["rows"] and
-                     value.get("isCustom", False) == frame_type.get("isCustom", False)), None)
-    
-    margin = get_frame_margin(frame_id)
-    gap = get_frame_gap(frame_id)
-    photo_width, photo_height, positions = calc_positions(frame_type, total_width, total_height, margin, gap)
-    
-    scale_factor = min(1500 / max(total_width, total_height), 1.0) if max(total_width, total_height) > 2000 else 1.0
-    output_width = int(total_width * scale_factor) & ~1
-    output_height = int(total_height * scale_factor) & ~1
-    scaled_positions = [(int(pos[0] * scale_factor), int(pos[1] * scale_factor)) for pos in positions]
-    photo_width = int(photo_width * scale_factor)
-    photo_height = int(photo_height * scale_factor)
-    
-    caps = [cv2.VideoCapture(video_file, cv2.CAP_FFMPEG) for video_file in video_files]
-    
-    # Optimize files for OpenCV if needed
-    optimized_files = []
-    for i, video_file in enumerate(video_files):
-        if not caps[i].isOpened():
-            print(f"[VIDEO] Failed to open {video_file}, trying optimization...")
-            optimized_file = optimize_video_for_opencv(video_file)
-            caps[i].release()
-            caps[i] = cv2.VideoCapture(optimized_file, cv2.CAP_FFMPEG)
-            optimized_files.append(optimized_file)
-        else:
-            optimized_files.append(video_file)
-    
-    if not all(cap.isOpened() for cap in caps):
-        for cap in caps:
-            cap.release()
-        raise ValueError("Cannot open video files even after optimization!")
-    
-    fps = min([cap.get(cv2.CAP_PROP_FPS) or VIDEO_FPS for cap in caps])
-    total_frames = int(duration * fps)
-    # Tạo file trong daily folder trước khi upload
-    daily_output_folder = get_daily_folder(OUTPUT_FOLDER)
-    temp_output_file = os.path.join(daily_output_folder, f"photobooth_result_{uuid.uuid4()}.mp4")
-    
-    # Sử dụng helper function để tạo VideoWriter với fallback codec
-    try:
-        out, used_codec = create_video_writer(temp_output_file, fps, output_width, output_height)
-    except ValueError as e:
-        for cap in caps:
-            cap.release()
-        raise e
-    
-    background_frame = None
-    if background_path:
-        bg = Image.open(background_path).convert("RGB")
-        crop_direction = "top" if frame_type.get("columns") in [1, 2] and frame_type.get("rows") in [1, 2] else "center"
-        bg = fit_cover_image(bg, (total_width, total_height), crop_direction)
-        if scale_factor != 1.0:
-            bg = bg.resize((output_width, output_height), Image.Resampling.LANCZOS)
-        background_frame = cv2.cvtColor(np.array(bg), cv2.COLOR_RGB2BGR)
-    
-    overlay_pil = None
-    if overlay_path:
-        overlay_pil = Image.open(overlay_path).convert("RGBA")
-        crop_direction = "top" if frame_type.get("columns") in [1, 2] and frame_type.get("rows") in [1, 2] else "center"
-        overlay_pil = fit_cover_image(overlay_pil, (total_width, total_height), crop_direction)
-        if scale_factor != 1.0:
-            overlay_pil = overlay_pil.resize((output_width, output_height), Image.Resampling.LANCZOS)
-    
-    last_valid_frames = [None] * len(caps)
-    try:
-        for _ in range(total_frames):
-            frame = background_frame.copy() if background_frame is not None else np.ones((output_height, output_width, 3), dtype=np.uint8) * 255
-            for idx, (cap, pos) in enumerate(zip(caps, scaled_positions)):
-                ret, video_frame = cap.read()
-                if not ret or video_frame is None:
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                    ret, video_frame = cap.read()
-                if ret and video_frame is not None:
-                    last_valid_frames[idx] = video_frame.copy()
-                elif last_valid_frames[idx] is not None:
-                    video_frame = last_valid_frames[idx]
-                else:
-                    continue
-                frame = process_video_frame(frame, video_frame, pos, (photo_width, photo_height), frame_type.get("isCircle", False), frame_type)
-            
-            if overlay_pil:
-                overlay_np = np.array(overlay_pil)
-                if overlay_np.shape[2] == 4:
-                    overlay_rgb = overlay_np[:, :, :3]
-                    overlay_alpha = overlay_np[:, :, 3] / 255.0
-                    overlay_bgr = cv2.cvtColor(overlay_rgb, cv2.COLOR_RGB2BGR)
-                    for c in range(3):
-                        frame[:, :, c] = frame[:, :, c] * (1 - overlay_alpha) + overlay_bgr[:, :, c] * overlay_alpha
-            out.write(frame)
-    finally:
-        for cap in caps:
-            cap.release()
-        out.release()
-        cv2.destroyAllWindows()  # Clean up any OpenCV windows
-    
-    # Đảm bảo file hoàn tất trước khi tối ưu và upload
-    import time
-    time.sleep(0.5)  # Wait for file to be completely written
-    
-    # Chuẩn hóa video thành h264+aac
-    from utils.video_standardizer import standardize_video
-    optimized_file = standardize_video(temp_output_file, crf=23, preset="fast")
-    
+def prepare_video_layer(image_path, mode, layout):
+    """
+    Mở background ("RGB") hoặc overlay ("RGBA"), fit cover theo khung in rồi thu nhỏ về kích thước video.
+    Kết quả lấy từ template cache, caller không được sửa ảnh trả về.
+
+    Returns:
+        PIL.Image hoặc None nếu không có file
+    """
+    return get_scaled_template_image(image_path, mode, layout.print_size, layout.size, layout.template_crop)
+
+def deliver_video_output(optimized_file, temp_output_file, upload_to_host, label="Video"):
+    """Đưa video vào hàng đợi upload nếu được yêu cầu, trả về đường dẫn local (URL trên host có sau khi upload xong)"""
     # Upload to host if requested
     if upload_to_host:
         # Kiểm tra tính toàn vẹn của file trước khi upload
         if not verify_video_file_integrity(optimized_file):
-            print(f"Video file integrity check failed: {optimized_file}")
+            print(f"{label} file integrity check failed: {optimized_file}")
             return optimized_file  # Trả về local file nếu có vấn đề
         
-        from utils.upload import upload_video_to_host
-        uploaded_url = upload_video_to_host(optimized_file, cleanup_after_upload=True)  # Xóa file local sau khi upload
-        if uploaded_url:
-            print(f"Video uploaded successfully: {uploaded_url}")
-            # Đảm bảo xóa file gốc và các file trung gian
-            if os.path.exists(temp_output_file) and temp_output_file != optimized_file:
-                os.remove(temp_output_file)
-            return uploaded_url
-        else:
-            # Nếu upload thất bại, trả về đường dẫn local
-            print(f"Upload failed, using local file: {optimized_file}")
-            return optimized_file
+        # Upload chạy nền trong hàng đợi upload (thử lại khi lỗi mạng), xoá file local sau khi upload xong
+        from utils.upload_queue import upload_queue, KIND_VIDEO
+        upload_queue.enqueue(optimized_file, KIND_VIDEO, cleanup=True)
+        print(f"{label} queued for upload: {optimized_file}")
+        # File trung gian không còn cần
+        if os.path.exists(temp_output_file) and temp_output_file != optimized_file:
+            os.remove(temp_output_file)
+        return optimized_file
     else:
         # Trả về đường dẫn local file
+        print(f"Local {label.lower()} created: {optimized_file}")
         return optimized_file
 
-def create_fast_video_output(frame_type, video_files, background_path, overlay_path, total_width, total_height, original_duration=10, upload_to_host=True):
-    frame_id = next((key for key, value in FRAME_TYPES.items() if
-                     value["columns"] == frame_type["columns"] and
-                     value["rows"] == frame_type["rows"] and
-                     value.get("isCustom", False) == frame_type.get("isCustom", False)), None)
+def render_video_with_ffmpeg_engine(frame_type, video_files, background_path, overlay_path, total_width, total_height,
+                                    output_file, duration, speed=1.0, label="VIDEO", extra_outputs=None):
+    """
+    Render layout bằng engine filter_complex của ffmpeg (không có vòng lặp frame Python).
+    Dùng cùng geometry, background/overlay đã fit như engine OpenCV để so sánh trên cùng input.
+    Render lỗi thì output chính và extra_outputs dở được xoá trước khi raise.
+    """
+    start_time, start_cpu = time.perf_counter(), get_cpu_seconds()
+    layout = get_frame_layout(frame_type, SCALE_VIDEO)
     
-    margin = get_frame_margin(frame_id)
-    gap = get_frame_gap(frame_id)
-    photo_width, photo_height, positions = calc_positions(frame_type, total_width, total_height, margin, gap)
+    infos = [get_video_info(video_file) for video_file in video_files]
+    fps = min([info['fps'] if info and info.get('fps') else VIDEO_FPS for info in infos])
     
-    scale_factor = min(1500 / max(total_width, total_height), 1.0) if max(total_width, total_height) > 2000 else 1.0
-    output_width = int(total_width * scale_factor) & ~1
-    output_height = int(total_height * scale_factor) & ~1
-    scaled_positions = [(int(pos[0] * scale_factor), int(pos[1] * scale_factor)) for pos in positions]
-    photo_width = int(photo_width * scale_factor)
-    photo_height = int(photo_height * scale_factor)
+    background_img = prepare_video_layer(background_path, "RGB", layout)
+    overlay_img = prepare_video_layer(overlay_path, "RGBA", layout)
     
-    caps = [cv2.VideoCapture(video_file, cv2.CAP_FFMPEG) for video_file in video_files]
+    # Một tiến trình ffmpeg cho cả layout: decoder mỗi slot 1 thread, filter_complex và từng output
+    # chia phần còn lại, giữ từ ngân sách chung tới khi render xong
+    worker_count = len(extra_outputs or []) + 2
+    granted_threads = acquire_render_threads(len(video_files), worker_count)
+    try:
+        render_layout_video(
+            video_files, output_file, layout.size, layout.slot_size, layout.positions,
+            fps, duration, speed=speed, background_img=background_img, overlay_img=overlay_img,
+            is_circle=layout.is_circle, crop_top=layout.slot_crop_top,
+            threads=(granted_threads - len(video_files)) // worker_count, extra_outputs=extra_outputs
+        )
+    except BaseException:
+        # ffmpeg ghi thẳng vào file output: không để lại file dở khi render lỗi
+        remove_video_files([output_file] + [extra_file for extra_file, _, _ in extra_outputs or []])
+        raise
+    finally:
+        ffmpeg_thread_budget.release(granted_threads)
+    from utils.logging import setup_logging
+    setup_logging().info(f"[{label} ENGINE] engine=ffmpeg, wall={time.perf_counter() - start_time:.2f}s, "
+                         f"cpu={get_cpu_seconds() - start_cpu:.2f}s, output={output_file}")
+    return output_file
+
+def create_video_outputs(frame_type, video_files, background_path, overlay_path, total_width, total_height, duration=10, upload_to_host=True, encoder=None, engine=None, include_fast=True, prefetch_depth=None):
+    """
+    Render video thường và (tuỳ chọn) fast video trong cùng một lượt: mỗi slot chỉ decode một lần,
+    mỗi frame chỉ composite một lần rồi được ghi vào cả hai encoder.
+    Fast video lấy các frame theo original_frame_indices giống create_fast_video_output.
+    prefetch_depth: độ sâu queue decode mỗi slot (mặc định VIDEO_PREFETCH_DEPTH, 0 = decode tuần tự).
+    Kích thước, vị trí slot, hướng crop lấy từ FrameLayout video của frame_type
+    (total_width/total_height chỉ giữ cho tương thích chữ ký).
+
+    Returns:
+        dict: {'video': url/path, 'fast_video': url/path} (fast_video chỉ có khi include_fast)
+    """
+    engine = engine or VIDEO_RENDER_ENGINE
+    prefetch_depth = VIDEO_PREFETCH_DEPTH if prefetch_depth is None else prefetch_depth
+    fast_duration = FAST_VIDEO_DURATION
+    speed_multiplier = duration / fast_duration
     
-    # Optimize files for OpenCV if needed (fast video processing)
+    # Tạo file trong daily folder trước khi upload
+    daily_output_folder = get_daily_folder(OUTPUT_FOLDER)
+    temp_output_file = os.path.join(daily_output_folder, f"photobooth_result_{uuid.uuid4()}.mp4")
+    temp_fast_file = os.path.join(daily_output_folder, f"photobooth_fast_{uuid.uuid4()}.mp4") if include_fast else None
+    
+    if engine == ENGINE_FFMPEG and check_ffmpeg_availability():
+        extra_outputs = [(temp_fast_file, speed_multiplier, fast_duration)] if include_fast else None
+        optimized_file = render_video_with_ffmpeg_engine(frame_type, video_files, background_path, overlay_path,
+                                                         total_width, total_height, temp_output_file, duration,
+                                                         label="VIDEO", extra_outputs=extra_outputs)
+        results = {'video': deliver_video_output(optimized_file, temp_output_file, upload_to_host, "Video")}
+        if include_fast:
+            results['fast_video'] = deliver_video_output(temp_fast_file, temp_fast_file, upload_to_host, "Fast video")
+        return results
+    
+    start_time, start_cpu = time.perf_counter(), get_cpu_seconds()
+    layout = get_frame_layout(frame_type, SCALE_VIDEO)
+    output_width, output_height = layout.size
+    
+    # Thread cho reader từng slot + encoder giữ từ ngân sách ffmpeg tới khi các tiến trình kết thúc
+    encoder_count = 2 if include_fast else 1
+    granted_threads = acquire_render_threads(len(video_files), encoder_count)
+    encoder_threads = (granted_threads - len(video_files)) // encoder_count
+    caps = []
+    out = fast_out = pipeline = None
     optimized_files = []
-    for i, video_file in enumerate(video_files):
-        if not caps[i].isOpened():
-            print(f"[FAST VIDEO] Failed to open {video_file}, trying optimization...")
-            optimized_file = optimize_video_for_opencv(video_file)
-            caps[i].release()
-            caps[i] = cv2.VideoCapture(optimized_file, cv2.CAP_FFMPEG)
-            optimized_files.append(optimized_file)
+    try:
+        # ffmpeg decode + scale/crop sẵn về kích thước slot, lặp lại video khi hết (thay cho seek về 0)
+        caps = open_video_captures(video_files, layout.slot_size, layout.slot_crop_top, loop=True, label="VIDEO")
+        
+        fps = min([cap.get(cv2.CAP_PROP_FPS) or VIDEO_FPS for cap in caps])
+        total_frames = int(duration * fps)
+        
+        # Số lần mỗi frame nguồn xuất hiện trong fast video (index tăng dần, có thể lặp ở cuối)
+        fast_repeats = {}
+        if include_fast:
+            for frame_idx in range(int(fast_duration * fps)):
+                source_idx = min(int(frame_idx * speed_multiplier), total_frames - 1)
+                fast_repeats[source_idx] = fast_repeats.get(source_idx, 0) + 1
+        
+        # Tạo encoder theo backend (ffmpeg pipe hoặc VideoWriter với fallback codec)
+        out, used_encoder = create_video_encoder(temp_output_file, fps, output_width, output_height, encoder, encoder_threads)
+        if include_fast:
+            fast_out, used_fast_encoder = create_video_encoder(temp_fast_file, fps, output_width, output_height, encoder, encoder_threads)
+        
+        # Layer tĩnh lấy từ template cache (chỉ chuẩn bị lần đầu cho mỗi template)
+        layers = get_video_layer_stack(background_path, overlay_path, layout.print_size, layout.size, layout.template_crop)
+        
+        # Mỗi slot decode trong thread riêng, compositor lấy frame theo lockstep
+        pipeline = PrefetchPipeline([iter_looping_frames(cap, total_frames) for cap in caps], prefetch_depth, label="VIDEO",
+                                    releases=[cap.release for cap in caps])
+        for frame_idx in range(total_frames):
+            slot_frames = pipeline.next_frames()
+            if slot_frames is None:
+                break
+            frame = layers.new_frame()
+            for video_frame, pos in zip(slot_frames, layout.positions):
+                if video_frame is None:
+                    continue
+                frame = process_video_frame(frame, video_frame, pos, layout)
+            
+            frame = layers.apply_overlay(frame)
+            out.write(frame)
+            for _ in range(fast_repeats.get(frame_idx, 0)):
+                fast_out.write(frame)
+        
+        # Đóng cả hai encoder trước khi giao file nào: lỗi ở một file không bỏ lại encoder còn lại
+        optimized_files.append(finalize_video_encoder(out, used_encoder, temp_output_file, start_time, start_cpu, "VIDEO"))
+        if include_fast:
+            optimized_files.append(finalize_video_encoder(fast_out, used_fast_encoder, temp_fast_file, start_time, start_cpu, "FAST VIDEO"))
+    finally:
+        if pipeline is not None:
+            # Pipeline giải phóng reader sau khi thread decoder của từng slot đã thoát
+            pipeline.close()
         else:
-            optimized_files.append(video_file)
-    
-    if not all(cap.isOpened() for cap in caps):
-        for cap in caps:
-            cap.release()
-        raise ValueError("Cannot open video files even after optimization!")
-    
-    fps = min([cap.get(cv2.CAP_PROP_FPS) or VIDEO_FPS for cap in caps])
+            for cap in caps:
+                cap.release()
+        cv2.destroyAllWindows()  # Clean up any OpenCV windows
+        if len(optimized_files) < encoder_count:
+            # Lượt render lỗi: huỷ encoder còn mở, xoá mọi file tạm/output dở
+            for writer, temp_file in ((out, temp_output_file), (fast_out, temp_fast_file)):
+                if writer is not None:
+                    abort_video_encoder(writer, temp_file)
+            remove_video_files(optimized_files)
+        ffmpeg_thread_budget.release(granted_threads)
+    
+    results = {'video': deliver_video_output(optimized_files[0], temp_output_file, upload_to_host, "Video")}
+    if include_fast:
+        results['fast_video'] = deliver_video_output(optimized_files[1], temp_fast_file, upload_to_host, "Fast video")
+    return results
+
+def create_video_output(frame_type, video_files, background_path, overlay_path, total_width, total_height, duration=2, upload_to_host=True, encoder=None, engine=None):
+    return create_video_outputs(frame_type, video_files, background_path, overlay_path, total_width, total_height,
+                                duration, upload_to_host, encoder, engine, include_fast=False)['video']
+
+def create_fast_video_output(frame_type, video_files, background_path, overlay_path, total_width, total_height, original_duration=10, upload_to_host=True, encoder=None, engine=None, prefetch_depth=None):
+    engine = engine or VIDEO_RENDER_ENGINE
+    prefetch_depth = VIDEO_PREFETCH_DEPTH if prefetch_depth is None else prefetch_depth
     fast_duration = FAST_VIDEO_DURATION
-    total_frames = int(fast_duration * fps)
     speed_multiplier = original_duration / fast_duration
-    original_total_frames = int(original_duration * fps)
     
     # Tạo file trong daily folder trước khi upload
     daily_output_folder = get_daily_folder(OUTPUT_FOLDER)
     temp_output_file = os.path.join(daily_output_folder, f"photobooth_fast_{uuid.uuid4()}.mp4")
     
-    # Sử dụng helper function để tạo VideoWriter với fallback codec
-    try:
-        out, used_codec = create_video_writer(temp_output_file, fps, output_width, output_height)
-    except ValueError as e:
-        for cap in caps:
-            cap.release()
-        raise e
-    
-    background_frame = None
-    if background_path:
-        bg = Image.open(background_path).convert("RGB")
-        crop_direction = "top" if frame_type.get("columns") in [1, 2] and frame_type.get("rows") in [1, 2] else "center"
-        bg = fit_cover_image(bg, (total_width, total_height), crop_direction)
-        if scale_factor != 1.0:
-            bg = bg.resize((output_width, output_height), Image.Resampling.LANCZOS)
-        background_frame = cv2.cvtColor(np.array(bg), cv2.COLOR_RGB2BGR)
-    
-    overlay_pil = None
-    if overlay_path:
-        overlay_pil = Image.open(overlay_path).convert("RGBA")
-        crop_direction = "top" if frame_type.get("columns") in [1, 2] and frame_type.get("rows") in [1, 2] else "center"
-        overlay_pil = fit_cover_image(overlay_pil, (total_width, total_height), crop_direction)
-        if scale_factor != 1.0:
-            overlay_pil = overlay_pil.resize((output_width, output_height), Image.Resampling.LANCZOS)
-    
-    last_valid_frames = [None] * len(caps)
-    original_frame_indices = [min(int(frame_idx * speed_multiplier), original_total_frames - 1) for frame_idx in range(total_frames)]
-    
+    if engine == ENGINE_FFMPEG and check_ffmpeg_availability():
+        # setpts tăng tốc thay cho việc chọn frame theo index
+        optimized_file = render_video_with_ffmpeg_engine(frame_type, video_files, background_path, overlay_path,
+                                                         total_width, total_height, temp_output_file, fast_duration,
+                                                         speed=speed_multiplier, label="FAST VIDEO")
+        return deliver_video_output(optimized_file, temp_output_file, upload_to_host, "Fast video")
+    
+    start_time, start_cpu = time.perf_counter(), get_cpu_seconds()
+    layout = get_frame_layout(frame_type, SCALE_VIDEO)
+    output_width, output_height = layout.size
+    
+    # Thread cho reader từng slot + encoder giữ từ ngân sách ffmpeg tới khi các tiến trình kết thúc
+    granted_threads = acquire_render_threads(len(video_files), 1)
+    caps = []
+    out = pipeline = None
+    optimized_file = None
     try:
-        for frame_idx in original_frame_indices:
-            frame = background_frame.copy() if background_frame is not None else np.ones((output_height, output_width, 3), dtype=np.uint8) * 255
-            for idx, (cap, pos) in enumerate(zip(caps, scaled_positions)):
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-                ret, video_frame = cap.read()
-                if not ret or video_frame is None:
-                    if frame_idx > 0:
-                        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx - 1)
-                        ret, video_frame = cap.read()
-                    if not ret or video_frame is None:
-                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                        ret, video_frame = cap.read()
-                    if not ret and last_valid_frames[idx] is not None:
-                        video_frame = last_valid_frames[idx]
-                    elif not ret:
-                        continue
-                last_valid_frames[idx] = video_frame.copy()
-                frame = process_video_frame(frame, video_frame, pos, (photo_width, photo_height), frame_type.get("isCircle", False), frame_type)
+        # Đọc tuần tự một lượt, chỉ lấy các frame cần cho fast video (không seek từng frame)
+        caps = open_video_captures(video_files, layout.slot_size, layout.slot_crop_top, loop=False, label="FAST VIDEO")
+        
+        fps = min([cap.get(cv2.CAP_PROP_FPS) or VIDEO_FPS for cap in caps])
+        total_frames = int(fast_duration * fps)
+        original_total_frames = int(original_duration * fps)
+        
+        # Tạo encoder theo backend (ffmpeg pipe hoặc VideoWriter với fallback codec)
+        out, used_encoder = create_video_encoder(temp_output_file, fps, output_width, output_height, encoder,
+                                                 granted_threads - len(video_files))
+        
+        # Layer tĩnh lấy từ template cache (chỉ chuẩn bị lần đầu cho mỗi template)
+        layers = get_video_layer_stack(background_path, overlay_path, layout.print_size, layout.size, layout.template_crop)
+        
+        original_frame_indices = [min(int(frame_idx * speed_multiplier), original_total_frames - 1) for frame_idx in range(total_frames)]
+        # Reader tự fallback về frame hợp lệ gần nhất khi nguồn hết sớm
+        pipeline = PrefetchPipeline([DecimatingReader(cap).iter_frames(original_frame_indices) for cap in caps],
+                                    prefetch_depth, label="FAST VIDEO", releases=[cap.release for cap in caps])
+        for _ in original_frame_indices:
+            slot_frames = pipeline.next_frames()
+            if slot_frames is None:
+                break
+            frame = layers.new_frame()
+            for video_frame, pos in zip(slot_frames, layout.positions):
+                if video_frame is None:
+                    continue
+                frame = process_video_frame(frame, video_frame, pos, layout)
             
-            if overlay_pil:
-                overlay_np = np.array(overlay_pil)
-                if overlay_np.shape[2] == 4:
-                    overlay_rgb = overlay_np[:, :, :3]
-                    overlay_alpha = overlay_np[:, :, 3] / 255.0
-                    overlay_bgr = cv2.cvtColor(overlay_rgb, cv2.COLOR_RGB2BGR)
-                    for c in range(3):
-                        frame[:, :, c] = frame[:, :, c] * (1 - overlay_alpha) + overlay_bgr[:, :, c] * overlay_alpha
-            out.write(frame)
+            out.write(layers.apply_overlay(frame))
+        
+        optimized_file = finalize_video_encoder(out, used_encoder, temp_output_file, start_time, start_cpu, "FAST VIDEO")
     finally:
-        for cap in caps:
-            cap.release()
-        out.release()
+        if pipeline is not None:
+            # Pipeline giải phóng reader sau khi thread decoder của từng slot đã thoát
+            pipeline.close()
+        else:
+            for cap in caps:
+                cap.release()
         cv2.destroyAllWindows()  # Clean up any OpenCV windows
+        if optimized_file is None and out is not None:
+            # Huỷ encoder, không để lại file dở
+            abort_video_encoder(out, temp_output_file)
+        ffmpeg_thread_budget.release(granted_threads)
     
-    # Đảm bảo file hoàn tất trước khi tối ưu và upload  
-    import time
-    time.sleep(0.5)  # Wait for file to be completely written
-    
-    # Chuẩn hóa video thành h264+aac
-    from utils.video_standardizer import standardize_video
-    optimized_file = standardize_video(temp_output_file, crf=23, preset="fast")
-    
-    # Upload to host if requested
-    if upload_to_host:
-        # Kiểm tra tính toàn vẹn của file trước khi upload
-        if not verify_video_file_integrity(optimized_file):
-            print(f"Fast video file integrity check failed: {optimized_file}")
-            return optimized_file  # Trả về local file nếu có vấn đề
-        
-        from utils.upload import upload_video_to_host
-        uploaded_url = upload_video_to_host(optimized_file, cleanup_after_upload=True)  # Xóa file local sau khi upload
-        if uploaded_url:
-            print(f"Fast video uploaded successfully: {uploaded_url}")
-            # Đảm bảo xóa file gốc và các file trung gian
-            if os.path.exists(temp_output_file) and temp_output_file != optimized_file:
-                os.remove(temp_output_file)
-            return uploaded_url
-        else:
-            # Nếu upload thất bại, trả về đường dẫn local
-            print(f"Fast video upload failed, using local file: {optimized_file}")
-            return optimized_file
-    else:
-        # Trả về đường dẫn local file
-        print(f"Local fast video created: {optimized_file}")
-        return optimized_file
+    return deliver_video_output(optimized_file, temp_output_file, upload_to_host, "Fast video")
 
 def verify_video_file_integrity(video_file_path):
     """
@@ -662,7 +733,11 @@ def verify_video_file_integrity(video_file_path):
         if os.path.getsize(video_file_path) == 0:
             return False
         
-        # Thử mở video với OpenCV
+        # Metadata ffprobe (có cache) loại sớm file không có video stream trước khi mở VideoCapture
+        if has_video_stream(video_file_path) is False:
+            return False
+        
+        # ffprobe chỉ đọc metadata: vẫn decode thử vài frame đầu với OpenCV
         cap = cv2.VideoCapture(video_file_path, cv2.CAP_FFMPEG)
         if not cap.isOpened():
             cap.release()
@@ -686,13 +761,13 @@ def verify_video_file_integrity(video_file_path):
         print(f"Video integrity check failed: {e}")
         return False
 
-def process_video_task(frame_type, video_files, background_path, overlay_path, total_width, total_height, duration=2, upload_to_host=True):
+def process_video_task(frame_type, video_files, background_path, overlay_path, total_width, total_height, duration=2, upload_to_host=True, encoder=None, engine=None):
     try:
         from utils.logging import setup_logging
         logger = setup_logging()
         logger.info(f"Starting video processing task - duration: {duration}s, upload: {upload_to_host}")
         
-        result = create_video_output(frame_type, video_files, background_path, overlay_path, total_width, total_height, duration, upload_to_host)
+        result = create_video_output(frame_type, video_files, background_path, overlay_path, total_width, total_height, duration, upload_to_host, encoder, engine)
         
         if result:
             logger.info(f"Video processing completed successfully: {result}")
@@ -706,13 +781,28 @@ def process_video_task(frame_type, video_files, background_path, overlay_path, t
         logger.error(f"[VIDEO PROCESSING TASK] Error: {str(e)}")
         return None
 
-def process_fast_video_task(frame_type, video_files, background_path, overlay_path, total_width, total_height, original_duration=10, upload_to_host=True):
+def process_video_outputs_task(frame_type, video_files, background_path, overlay_path, total_width, total_height, duration=10, upload_to_host=True, encoder=None, engine=None, include_fast=True, prefetch_depth=None):
+    """Task render video thường + fast video dùng chung một lượt decode/composite"""
+    from utils.logging import setup_logging
+    logger = setup_logging()
+    try:
+        logger.info(f"Starting shared video task - duration: {duration}s, fast video: {include_fast}, upload: {upload_to_host}")
+        
+        results = create_video_outputs(frame_type, video_files, background_path, overlay_path, total_width, total_height, duration, upload_to_host, encoder, engine, include_fast, prefetch_depth)
+        
+        logger.info(f"Shared video processing completed: {results}")
+        return results
+    except Exception as e:
+        logger.error(f"[VIDEO OUTPUTS TASK] Error: {str(e)}")
+        return {}
+
+def process_fast_video_task(frame_type, video_files, background_path, overlay_path, total_width, total_height, original_duration=10, upload_to_host=True, encoder=None, engine=None):
     try:
         from utils.logging import setup_logging
         logger = setup_logging()
         logger.info(f"Starting fast video processing task - original duration: {original_duration}s, upload: {upload_to_host}")
         
-        result = create_fast_video_output(frame_type, video_files, background_path, overlay_path, total_width, total_height, original_duration, upload_to_host)
+        result = create_fast_video_output(frame_type, video_files, background_path, overlay_path, total_width, total_height, original_duration, upload_to_host, encoder, engine)
         
         if result:
             logger.info(f"Fast video processing completed successfully: {result}")
@@ -0,0 +1,228 @@
+"""
+Reader video cho compositor: decode + scale/crop về đúng kích thước slot ngay trong ffmpeg,
+Python chỉ nhận các buffer BGR đã sẵn sàng để dán vào frame.
+"""
+import subprocess
+import platform
+import cv2
+import numpy as np
+from utils.logging import setup_logging
+from utils.ffmpeg_utils import get_ffmpeg_command
+from utils.ffmpeg_budget import ffmpeg_thread_budget
+
+logger = setup_logging()
+
+def get_subprocess_args():
+    """
+    Trả về các tham số phù hợp cho subprocess tùy theo hệ điều hành
+
+    Returns:
+        dict: Dictionary chứa các tham số cho subprocess
+    """
+    args = {}
+    if platform.system() == "Windows":
+        args["creationflags"] = subprocess.CREATE_NO_WINDOW
+    return args
+
+def build_slot_filter(size, crop_top=False):
+    """
+    Filter ffmpeg tương đương logic resize + crop của process_video_frame:
+    scale phủ kín slot (giữ tỉ lệ) rồi crop giữa, hoặc crop từ trên xuống nếu crop_top.
+    """
+    width, height = size
+    y_expr = "0" if crop_top else "(ih-oh)/2"
+    return (f"scale={width}:{height}:force_original_aspect_ratio=increase,"
+            f"crop={width}:{height}:(iw-ow)/2:{y_expr},setsar=1")
+
+class FFmpegSlotReader:
+    """
+    Reader có giao diện giống cv2.VideoCapture (isOpened/read/grab/retrieve/get/release)
+    nhưng mỗi frame trả về đã đúng kích thước slot (width x height, BGR uint8).
+
+    Frame đầu tiên được đọc ngay khi khởi tạo để isOpened() phản ánh đúng việc
+    ffmpeg có decode được file hay không (cho phép fallback về OpenCV).
+    """
+
+    def __init__(self, video_file, size, crop_top=False, fps=None, loop=False, threads=1):
+        self.video_file = video_file
+        self.width, self.height = size
+        self.fps = fps
+        self._frame_bytes = self.width * self.height * 3
+        self._pending = None
+        self._raw = None
+
+        # threads: phần ngân sách ffmpeg caller đã giữ cho reader này (không để ffmpeg tự dùng hết core)
+        cmd = [get_ffmpeg_command(), '-hide_banner', '-loglevel', 'error', '-nostdin',
+               '-filter_threads', str(threads), '-threads', str(threads)]
+        if loop:
+            cmd.extend(['-stream_loop', '-1'])
+        cmd.extend([
+            '-i', video_file,
+            '-an', '-sn',
+            '-vf', build_slot_filter(size, crop_top),
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+            '-'
+        ])
+        try:
+            self.process = subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                bufsize=self._frame_bytes, **get_subprocess_args()
+            )
+            ffmpeg_thread_budget.track(self.process)
+        except OSError as e:
+            logger.warning(f"[SLOT READER] Cannot start ffmpeg for {video_file}: {e}")
+            self.process = None
+            return
+
+        self._pending = self._read_frame()
+        if self._pending is None:
+            logger.warning(f"[SLOT READER] ffmpeg could not decode {video_file}")
+            self.release()
+
+    def isOpened(self):
+        return self.process is not None
+
+    def _read_frame(self):
+        frame = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        view = memoryview(frame).cast('B')
+        filled = 0
+        while filled < self._frame_bytes:
+            n = self.process.stdout.readinto(view[filled:])
+            if not n:
+                return None
+            filled += n
+        return frame
+
+    def grab(self):
+        if self.process is None:
+            return False
+        if self._pending is not None:
+            self._raw, self._pending = self._pending, None
+        else:
+            self._raw = self._read_frame()
+        return self._raw is not None
+
+    def retrieve(self):
+        frame, self._raw = self._raw, None
+        return frame is not None, frame
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps or 0
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        return 0
+
+    # Pipe chỉ đọc tuần tự, không seek được (dùng loop=True để lặp video)
+    seekable = False
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdout.close()
+        except OSError:
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        ffmpeg_thread_budget.untrack(self.process)
+        self.process = None
+
+def iter_looping_frames(cap, total_frames):
+    """
+    Trả về lần lượt total_frames frame từ cap; khi hết video thì quay về frame 0,
+    nếu vẫn không đọc được thì lặp lại frame hợp lệ gần nhất (None nếu chưa có frame nào).
+    """
+    last_valid_frame = None
+    for _ in range(total_frames):
+        ret, video_frame = cap.read()
+        if not ret or video_frame is None:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, video_frame = cap.read()
+        if ret and video_frame is not None:
+            last_valid_frame = video_frame
+        yield last_valid_frame
+
+class DecimatingReader:
+    """
+    Đọc tuần tự một nguồn video (cv2.VideoCapture hoặc FFmpegSlotReader) đúng một lượt:
+    grab() để bỏ qua frame không cần, retrieve() chỉ frame được yêu cầu.
+    Thay cho cap.set(CAP_PROP_POS_FRAMES, idx) ở mỗi frame output (mỗi lần seek H.264
+    phải về keyframe rồi decode lại).
+
+    read_at() phải được gọi với frame index không giảm dần.
+
+    Nguồn không seek được (FFmpegSlotReader, retrieve() không tốn thêm decode) được retrieve cả frame
+    bỏ qua để luôn giữ frame cuối cùng đã grab, dùng khi nguồn hết sớm. cv2.VideoCapture chỉ retrieve
+    frame cần và seek lại một lần khi hết sớm.
+    """
+
+    def __init__(self, cap):
+        self.cap = cap
+        self._keep_grabbed = not getattr(cap, "seekable", True)
+        self._next_index = 0    # index của frame sẽ được grab tiếp theo
+        self._last_index = -1   # index của frame retrieve gần nhất
+        self._last_frame = None
+        self._eof = False
+
+    def read_at(self, frame_idx):
+        """
+        Returns:
+            tuple: (ret, frame) - frame tại frame_idx, hoặc frame hợp lệ gần nhất trước đó
+            nếu nguồn đã hết
+        """
+        if frame_idx <= self._last_index and self._last_frame is not None:
+            return True, self._last_frame
+        if self._eof:
+            return self._last_frame is not None, self._last_frame
+
+        while self._next_index <= frame_idx:
+            if not self.cap.grab():
+                self._eof = True
+                return self._read_tail()
+            self._next_index += 1
+            if self._keep_grabbed and self._next_index <= frame_idx:
+                ret, frame = self.cap.retrieve()
+                if ret and frame is not None:
+                    self._last_index, self._last_frame = self._next_index - 1, frame
+
+        ret, frame = self.cap.retrieve()
+        if ret and frame is not None:
+            self._last_index, self._last_frame = frame_idx, frame
+        return self._last_frame is not None, self._last_frame
+
+    def iter_frames(self, frame_indices):
+        """Trả về lần lượt frame tại từng index (None nếu slot không có frame nào)"""
+        for frame_idx in frame_indices:
+            _, frame = self.read_at(frame_idx)
+            yield frame
+
+    def _read_tail(self):
+        """
+        Nguồn hết trước frame cần đọc: lấy frame cuối cùng đã grab (giống fallback frame_idx - 1),
+        nếu chưa đọc được frame nào thì thử frame 0. Nguồn không seek được đã giữ sẵn frame cuối
+        đã grab; nguồn seek được chỉ seek tối đa một lần.
+        """
+        if self._keep_grabbed:
+            return self._last_frame is not None, self._last_frame
+        last_grabbed = self._next_index - 1
+        if last_grabbed > self._last_index and self.cap.set(cv2.CAP_PROP_POS_FRAMES, last_grabbed):
+            ret, frame = self.cap.read()
+            if ret and frame is not None:
+                self._last_index, self._last_frame = last_grabbed, frame
+        if self._last_frame is None and self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0):
+            ret, frame = self.cap.read()
+            if ret and frame is not None:
+                self._last_index, self._last_frame = 0, frame
+        return self._last_frame is not None, self._last_frame
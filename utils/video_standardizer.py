@@ -7,8 +7,12 @@ import sys
 import platform
 from pathlib import Path
 import time
+from concurrent.futures import ThreadPoolExecutor
 from utils.logging import setup_logging
 from utils.ffmpeg_utils import get_ffmpeg_command, check_ffmpeg_availability
+from utils.ffmpeg_budget import ffmpeg_thread_budget
+from config import FFMPEG_PROCESS_THREADS
+from utils.media_probe import probe_media
 
 logger = setup_logging()
 
@@ -24,18 +28,23 @@ def get_subprocess_args():
         args["creationflags"] = subprocess.CREATE_NO_WINDOW
     return args
 
-def standardize_video(input_file, output_file=None, crf=23, preset="fast"):
+def standardize_video(input_file, output_file=None, crf=23, preset="fast", use_cache=False, threads=None):
     """
     Chuẩn hóa video về định dạng h264+aac sử dụng ffmpeg.
+    Bỏ qua encode nếu file đã đạt chuẩn (xem is_standardized).
     
     Args:
         input_file (str): Đường dẫn đến file video đầu vào
         output_file (str, optional): Đường dẫn đến file output. Nếu None, sẽ tự tạo.
         crf (int, optional): Constant Rate Factor cho h264 (18-28). Mặc định: 23.
         preset (str, optional): Preset của ffmpeg. Mặc định: "fast".
+        use_cache (bool, optional): Dùng transcode cache (key theo hash nội dung + tham số),
+            dành cho video upload có thể được gửi lại. Mặc định: False.
+        threads (int, optional): Số thread xin từ ngân sách ffmpeg chung (-threads).
+            None = FFMPEG_PROCESS_THREADS, được cấp tối đa phần còn trống.
         
     Returns:
-        str: Đường dẫn đến file đã chuẩn hóa, hoặc file gốc nếu có lỗi
+        str: Đường dẫn đến file đã chuẩn hóa, file gốc nếu đã đạt chuẩn hoặc có lỗi
     """
     if not check_ffmpeg_availability():
         logger.warning("FFmpeg không khả dụng để chuẩn hóa video")
@@ -45,12 +54,29 @@ def standardize_video(input_file, output_file=None, crf=23, preset="fast"):
         logger.error(f"File input không tồn tại: {input_file}")
         return input_file
     
+    if is_standardized(input_file):
+        logger.info(f"Video đã đạt chuẩn h264, bỏ qua encode: {input_file}")
+        return input_file
+    
     # Tạo output file path nếu không được cung cấp
     if not output_file:
         file_dir = os.path.dirname(input_file)
         file_name = os.path.splitext(os.path.basename(input_file))[0]
         output_file = os.path.join(file_dir, f"{file_name}_h264_aac.mp4")
     
+    cache_key = None
+    if use_cache:
+        from utils.transcode_cache import transcode_cache
+        cache_key = transcode_cache.make_key(input_file, {
+            "codec": "libx264", "crf": crf, "preset": preset, "pix_fmt": "yuv420p",
+            "profile": "high", "level": "4.0", "audio": "aac-192k-2ch-44100"
+        })
+        if transcode_cache.fetch(cache_key, output_file):
+            return output_file
+        if os.path.exists(output_file):
+            # Có thể là hardlink tới entry cache cũ, ffmpeg -y sẽ ghi đè chính entry đó
+            os.remove(output_file)
+    
     try:
         # Sử dụng ffmpeg để chuẩn hóa
         ffmpeg_cmd = get_ffmpeg_command()
@@ -67,16 +93,24 @@ def standardize_video(input_file, output_file=None, crf=23, preset="fast"):
             '-b:a', '192k',        # Bitrate audio hợp lý
             '-ac', '2',            # 2 audio channels (stereo)
             '-ar', '44100',        # Sample rate audio phổ biến
-            output_file
         ]
         
-        logger.info(f"Chuẩn hóa video h264+aac: {input_file} -> {output_file}")
         subprocess_args = get_subprocess_args()
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True, **subprocess_args)
+        wait_start = time.perf_counter()
+        with ffmpeg_thread_budget.reserve(threads or FFMPEG_PROCESS_THREADS) as granted_threads:
+            start_time = time.perf_counter()
+            logger.info(f"Chuẩn hóa video h264+aac ({granted_threads} threads): {input_file} -> {output_file}")
+            result = ffmpeg_thread_budget.run(cmd + ['-threads', str(granted_threads), output_file],
+                                              check=True, capture_output=True, text=True, **subprocess_args)
+            encode_time = time.perf_counter() - start_time
         
         # Kiểm tra file output
         if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
-            logger.info(f"Chuẩn hóa video thành công: {output_file}")
+            logger.info(f"Chuẩn hóa video thành công: {output_file} "
+                        f"(encode {encode_time:.2f}s, chờ thread {start_time - wait_start:.2f}s)")
+            if cache_key:
+                transcode_cache.store(cache_key, output_file)
+                return output_file
             
             # Đảm bảo video output ổn định
             time.sleep(0.5)  # Đợi hệ thống file cập nhật
@@ -92,26 +126,57 @@ def standardize_video(input_file, output_file=None, crf=23, preset="fast"):
         logger.error(f"Lỗi khi chuẩn hóa video: {str(e)}")
         return input_file
 
-def standardize_videos_in_batch(video_files, preset="fast", crf=23):
+def standardize_videos_in_batch(video_files, preset="fast", crf=23, use_cache=True):
     """
-    Chuẩn hóa nhiều video cùng lúc
+    Chuẩn hóa nhiều video cùng lúc: các ffmpeg chạy song song, mỗi tiến trình xin
+    một phần ngân sách thread chung (FFMPEG_THREAD_BUDGET / số file).
     
     Args:
         video_files (list): Danh sách các đường dẫn video
         preset (str, optional): Preset của ffmpeg. Mặc định: "fast"
         crf (int, optional): Constant Rate Factor. Mặc định: 23
+        use_cache (bool, optional): Dùng transcode cache. Mặc định: True
         
     Returns:
         list: Danh sách các đường dẫn video đã chuẩn hóa
     """
-    standardized_files = []
+    if not video_files:
+        return []
     
-    for video_file in video_files:
-        standardized_file = standardize_video(video_file, preset=preset, crf=crf)
-        standardized_files.append(standardized_file)
+    batch_start = time.perf_counter()
+    threads_per_file = ffmpeg_thread_budget.share(len(video_files))
     
+    def _standardize(video_file):
+        start_time = time.perf_counter()
+        standardized_file = standardize_video(video_file, preset=preset, crf=crf,
+                                              use_cache=use_cache, threads=threads_per_file)
+        logger.info(f"[STANDARDIZE BATCH] {os.path.basename(video_file)}: {time.perf_counter() - start_time:.2f}s")
+        return standardized_file
+    
+    max_workers = min(len(video_files), ffmpeg_thread_budget.total)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        standardized_files = list(executor.map(_standardize, video_files))
+    
+    logger.info(f"[STANDARDIZE BATCH] {len(video_files)} files in {time.perf_counter() - batch_start:.2f}s "
+                f"({max_workers} concurrent, {threads_per_file} threads/file)")
     return standardized_files
 
+def is_standardized(video_file):
+    """
+    Kiểm tra video đã đáp ứng định dạng của standardize_video chưa: h264 yuv420p,
+    audio AAC hoặc không có audio (encode lại cũng không tạo thêm audio,
+    còn compositor luôn bỏ audio).
+
+    Returns:
+        bool: True nếu không cần encode lại
+    """
+    info = probe_media(video_file)
+    if not info:
+        return False
+    if info['video_codec'] != 'h264' or info['pix_fmt'] != 'yuv420p':
+        return False
+    return info['audio_codec'] in (None, 'aac')
+
 def verify_video_codec(video_file):
     """
     Kiểm tra xem video đã có codec h264+aac chưa
@@ -122,35 +187,8 @@ def verify_video_codec(video_file):
     Returns:
         bool: True nếu video đã chuẩn hóa, False nếu chưa
     """
-    from utils.ffmpeg_utils import get_ffprobe_command, check_ffprobe_availability
-    
-    if not check_ffprobe_availability():
-        logger.warning("FFprobe không khả dụng để kiểm tra codec")
+    info = probe_media(video_file)
+    if not info:
         return False
     
-    try:
-        ffprobe_cmd = get_ffprobe_command()
-        cmd = [
-            ffprobe_cmd, '-v', 'quiet', '-print_format', 'json',
-            '-show_streams', video_file
-        ]
-        
-        subprocess_args = get_subprocess_args()
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, **subprocess_args)
-        
-        import json
-        data = json.loads(result.stdout)
-        
-        # Kiểm tra codec video
-        video_stream = next((s for s in data['streams'] if s['codec_type'] == 'video'), None)
-        has_h264 = video_stream and video_stream.get('codec_name') == 'h264'
-        
-        # Kiểm tra codec audio
-        audio_stream = next((s for s in data['streams'] if s['codec_type'] == 'audio'), None)
-        has_aac = audio_stream and audio_stream.get('codec_name') == 'aac'
-        
-        return has_h264 and has_aac
-    
-    except Exception as e:
-        logger.warning(f"Lỗi khi kiểm tra codec: {str(e)}")
-        return False
+    return info['video_codec'] == 'h264' and info['audio_codec'] == 'aac'
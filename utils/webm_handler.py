@@ -8,7 +8,10 @@ import shutil
 import sys
 import platform
 from utils.logging import setup_logging
-from utils.ffmpeg_utils import get_ffmpeg_command, get_ffprobe_command, check_ffmpeg_availability, check_ffprobe_availability
+from utils.ffmpeg_utils import get_ffmpeg_command, get_ffprobe_command, check_ffmpeg_availability
+from utils.media_probe import probe_media, has_video_stream
+from utils.ffmpeg_budget import ffmpeg_thread_budget
+from config import FFMPEG_PROCESS_THREADS
 
 logger = setup_logging()
 
@@ -56,35 +59,17 @@ def detect_webm_codec(webm_file):
     """
     Phát hiện codec của file WebM để xử lý tương thích
     """
-    if not check_ffprobe_availability():
+    info = probe_media(webm_file)
+    if not info or not info['video_codec']:
         return None
     
-    try:
-        ffprobe_cmd = get_ffprobe_command()
-        
-        cmd = [
-            ffprobe_cmd, '-v', 'quiet', '-print_format', 'json',
-            '-show_streams', webm_file
-        ]
-        subprocess_args = get_subprocess_args()
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, **subprocess_args)
-        
-        import json
-        data = json.loads(result.stdout)
-        
-        video_stream = next((s for s in data['streams'] if s['codec_type'] == 'video'), None)
-        if video_stream:
-            return {
-                'codec_name': video_stream.get('codec_name'),
-                'pix_fmt': video_stream.get('pix_fmt'),
-                'width': video_stream.get('width'),
-                'height': video_stream.get('height'),
-                'fps': eval(video_stream.get('r_frame_rate', '30/1'))
-            }
-    except Exception as e:
-        logger.warning(f"Failed to detect WebM codec: {e}")
-    
-    return None
+    return {
+        'codec_name': info['video_codec'],
+        'pix_fmt': info['pix_fmt'],
+        'width': info['width'],
+        'height': info['height'],
+        'fps': info['fps'] or 30
+    }
 
 def optimize_webm_for_opencv(input_file, output_file=None):
     """
@@ -122,11 +107,11 @@ def optimize_webm_for_opencv(input_file, output_file=None):
         if webm_info and (webm_info.get('width', 0) > 1920 or webm_info.get('height', 0) > 1080):
             cmd.extend(['-vf', 'scale=1920:1080:force_original_aspect_ratio=decrease'])
         
-        cmd.append(output_file)
-        
         logger.info(f"Optimizing WebM for OpenCV: {input_file} -> {output_file}")
         subprocess_args = get_subprocess_args()
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True, **subprocess_args)
+        with ffmpeg_thread_budget.reserve(FFMPEG_PROCESS_THREADS) as granted_threads:
+            result = ffmpeg_thread_budget.run(cmd + ['-threads', str(granted_threads), output_file],
+                                              check=True, capture_output=True, text=True, **subprocess_args)
         
         if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
             logger.info(f"WebM optimization successful: {output_file}")
@@ -148,6 +133,11 @@ def validate_webm_for_processing(webm_file):
     """
     import cv2
     
+    # Có ffprobe thì dựa vào kết quả probe (có cache), không cần mở VideoCapture
+    has_video = has_video_stream(webm_file)
+    if has_video is not None:
+        return has_video
+    
     try:
         cap = cv2.VideoCapture(webm_file, cv2.CAP_FFMPEG)
         if not cap.isOpened():